@@ -0,0 +1,351 @@
+"""
+API - Read-only JSON endpoints with cursor pagination
+
+/api/v1/<resource> lists students, teachers, enrollments, calificaciones,
+attendance and schedules. Rows are read as plain column tuples and written
+straight to JSON, without building ORM objects. Pages are keyset-paginated
+on (updated_at, id), which every write to a row moves forward: `after` is
+the next_cursor of the previous page, and an integration that keeps its
+last cursor later fetches only the rows added or changed since (deleted
+rows are not reported). `updated_since` (ISO date or datetime, UTC)
+starts such a sync without a cursor. `fields` picks the columns (a
+teacher's email, contract end and status are for admins only), and
+grade_id, teacher_id, student_id, subject_id, start and end (ISO dates,
+inclusive) filter the rows. Teachers and students only see rows of their
+own enrollments.
+"""
+
+import os
+import uuid
+from datetime import date, datetime, timedelta, timezone
+from flask import jsonify, request
+from flask_login import login_required, current_user
+from sqlalchemy import Date, DateTime, Numeric, and_, or_, select
+from models import db, User, Student, Teacher, Enrollment, Calificacion, Attendance, Schedule
+from app import app
+
+API_PAGE_SIZE = int(os.getenv('API_PAGE_SIZE', 100))
+API_MAX_PAGE_SIZE = int(os.getenv('API_MAX_PAGE_SIZE', 1000))
+
+ID_FILTERS = ('grade_id', 'teacher_id', 'student_id', 'subject_id')
+
+
+class ApiError(Exception):
+    """A bad request; the message is returned to the client."""
+
+
+def _iso(value):
+    return value.isoformat()
+
+
+def _converter(column):
+    """Function turning a column's value into JSON, or None when json handles it as is."""
+    if isinstance(column.type, (Date, DateTime)):
+        return _iso
+    if isinstance(column.type, Numeric):
+        return float
+    return None
+
+
+def _enrolled_with(teacher_id):
+    return select(Enrollment.student_id).where(Enrollment.teacher_id == teacher_id)
+
+
+class Resource:
+    """A table exposed under /api/v1/<name>.
+
+    fields maps output names to columns (joins lists the tables they need
+    besides table), filters maps query parameters to functions building
+    the WHERE clause, date_column is what start/end filter on, and scopes
+    maps each non-admin role to a function of the user's profile id that
+    limits the rows they may read (None: every row). admin_fields are
+    fields only admins may read.
+    """
+
+    def __init__(self, table, fields, filters, date_column, scopes, joins=(), admin_fields=()):
+        self.table = table
+        self.fields = fields
+        self.filters = filters
+        self.date_column = date_column
+        self.scopes = scopes
+        self.joins = joins
+        self.admin_fields = frozenset(admin_fields)
+
+    def visible_fields(self, role):
+        """Names of the fields role may read, in declaration order."""
+        return [name for name in self.fields if role == 'admin' or name not in self.admin_fields]
+
+    def page(self, fields, conditions, after, per_page):
+        """(rows as dicts, next cursor) for one page; after is an (updated_at, id) pair or None."""
+        # updated_at and id always come first: the cursor needs them whether or not they were asked for
+        names = [name for name in fields if name not in ('updated_at', 'id')]
+        columns = [self.fields[name] for name in names]
+        updated_at, row_id = self.table.updated_at, self.table.id
+        query = select(updated_at, row_id, *columns).select_from(self.table)
+        for target, onclause in self.joins:
+            query = query.join(target, onclause)
+        if after:
+            after_updated_at, after_id = after
+            conditions = conditions + [or_(updated_at > after_updated_at,
+                                           and_(updated_at == after_updated_at, row_id > after_id))]
+        query = query.where(and_(*conditions)).order_by(updated_at, row_id).limit(per_page + 1)
+
+        rows = db.session.execute(query).all()
+        next_cursor = _cursor(*rows[per_page - 1][:2]) if len(rows) > per_page else None
+        converters = [(index, _converter(column)) for index, column in enumerate(columns, start=2)]
+        converters = [(index, convert) for index, convert in converters if convert]
+        with_updated_at, with_id = 'updated_at' in fields, 'id' in fields
+        data = []
+        for row in rows[:per_page]:
+            values = list(row)
+            for index, convert in converters:
+                if values[index] is not None:
+                    values[index] = convert(values[index])
+            item = dict(zip(names, values[2:]))
+            if with_updated_at:
+                item['updated_at'] = _iso(values[0])
+            if with_id:
+                item['id'] = values[1]
+            data.append(item)
+        return data, next_cursor
+
+
+def _cursor(updated_at, row_id):
+    return f'{updated_at.isoformat()}_{row_id}'
+
+
+RESOURCES = {
+    'students': Resource(
+        Student,
+        fields={
+            'id': Student.id, 'student_code': Student.student_code, 'name': User.name, 'email': User.email,
+            'apellido_paterno': Student.apellido_paterno, 'apellido_materno': Student.apellido_materno,
+            'grade_id': Student.grade_id, 'enrollment_date': Student.enrollment_date, 'status': Student.status,
+            'updated_at': Student.updated_at,
+        },
+        joins=[(User, Student.user_id == User.id)],
+        filters={
+            'grade_id': lambda value: Student.grade_id == value,
+            'teacher_id': lambda value: Student.id.in_(_enrolled_with(value)),
+            'student_id': lambda value: Student.id == value,
+        },
+        date_column=Student.enrollment_date,
+        scopes={
+            'teacher': lambda teacher_id: Student.id.in_(_enrolled_with(teacher_id)),
+            'student': lambda student_id: Student.id == student_id,
+        },
+    ),
+    'teachers': Resource(
+        Teacher,
+        fields={
+            'id': Teacher.id, 'teacher_code': Teacher.teacher_code, 'name': User.name, 'email': User.email,
+            'apellido_paterno': Teacher.apellido_paterno, 'apellido_materno': Teacher.apellido_materno,
+            'specialization': Teacher.specialization, 'hire_date': Teacher.hire_date,
+            'end_contract_date': Teacher.end_contract_date, 'status': Teacher.status,
+            'updated_at': Teacher.updated_at,
+        },
+        joins=[(User, Teacher.user_id == User.id)],
+        filters={
+            'grade_id': lambda value: Teacher.id.in_(select(Enrollment.teacher_id).where(Enrollment.grade_id == value)),
+            'teacher_id': lambda value: Teacher.id == value,
+            'subject_id': lambda value: Teacher.id.in_(
+                select(Enrollment.teacher_id).where(Enrollment.subject_id == value)),
+        },
+        date_column=Teacher.hire_date,
+        scopes={'teacher': None, 'student': None},
+        # Contact and contract details are staff records, not a directory
+        admin_fields=('email', 'end_contract_date', 'status'),
+    ),
+    'enrollments': Resource(
+        Enrollment,
+        fields={
+            'id': Enrollment.id, 'student_id': Enrollment.student_id, 'teacher_id': Enrollment.teacher_id,
+            'subject_id': Enrollment.subject_id, 'grade_id': Enrollment.grade_id, 'status': Enrollment.status,
+            'semester_1': Enrollment.semester_1, 'semester_2': Enrollment.semester_2,
+            'semester_3': Enrollment.semester_3, 'average': Enrollment.average,
+            'has_grades': Enrollment.has_grades, 'enrollment_date': Enrollment.enrollment_date,
+            'updated_at': Enrollment.updated_at,
+        },
+        filters={name: (lambda column: lambda value: column == value)(getattr(Enrollment, name))
+                 for name in ID_FILTERS},
+        date_column=Enrollment.enrollment_date,
+        scopes={
+            'teacher': lambda teacher_id: Enrollment.teacher_id == teacher_id,
+            'student': lambda student_id: Enrollment.student_id == student_id,
+        },
+    ),
+    'calificaciones': Resource(
+        Calificacion,
+        fields={
+            'id': Calificacion.id, 'enrollment_id': Calificacion.enrollment_id,
+            'student_id': Calificacion.student_id, 'teacher_id': Calificacion.teacher_id,
+            'subject_id': Calificacion.subject_id, 'semester': Calificacion.semester,
+            'calificacion': Calificacion.calificacion, 'nota_texto': Calificacion.nota_texto,
+            'fecha_calificacion': Calificacion.fecha_calificacion,
+            'updated_at': Calificacion.updated_at,
+        },
+        filters={
+            'grade_id': lambda value: Calificacion.enrollment_id.in_(
+                select(Enrollment.id).where(Enrollment.grade_id == value)),
+            'teacher_id': lambda value: Calificacion.teacher_id == value,
+            'student_id': lambda value: Calificacion.student_id == value,
+            'subject_id': lambda value: Calificacion.subject_id == value,
+        },
+        date_column=Calificacion.fecha_calificacion,
+        scopes={
+            'teacher': lambda teacher_id: Calificacion.teacher_id == teacher_id,
+            'student': lambda student_id: Calificacion.student_id == student_id,
+        },
+    ),
+    'attendance': Resource(
+        Attendance,
+        fields={
+            'id': Attendance.id, 'enrollment_id': Attendance.enrollment_id,
+            'student_id': Enrollment.student_id, 'teacher_id': Enrollment.teacher_id,
+            'subject_id': Enrollment.subject_id, 'grade_id': Enrollment.grade_id,
+            'attendance_date': Attendance.attendance_date, 'status': Attendance.status, 'notes': Attendance.notes,
+            'updated_at': Attendance.updated_at,
+        },
+        joins=[(Enrollment, Attendance.enrollment_id == Enrollment.id)],
+        filters={name: (lambda column: lambda value: column == value)(getattr(Enrollment, name))
+                 for name in ID_FILTERS},
+        date_column=Attendance.attendance_date,
+        scopes={
+            'teacher': lambda teacher_id: Enrollment.teacher_id == teacher_id,
+            'student': lambda student_id: Enrollment.student_id == student_id,
+        },
+    ),
+    'schedules': Resource(
+        Schedule,
+        fields={
+            'id': Schedule.id, 'teacher_id': Schedule.teacher_id, 'grade_id': Schedule.grade_id,
+            'subject_id': Schedule.subject_id, 'day_of_week': Schedule.day_of_week,
+            'start_time': Schedule.start_time, 'end_time': Schedule.end_time, 'classroom': Schedule.classroom,
+            'updated_at': Schedule.updated_at,
+        },
+        filters={
+            'grade_id': lambda value: Schedule.grade_id == value,
+            'teacher_id': lambda value: Schedule.teacher_id == value,
+            'subject_id': lambda value: Schedule.subject_id == value,
+        },
+        date_column=Schedule.created_at,
+        scopes={
+            'teacher': lambda teacher_id: Schedule.teacher_id == teacher_id,
+            'student': lambda student_id: Schedule.grade_id == select(Student.grade_id)
+            .where(Student.id == student_id).scalar_subquery(),
+        },
+    ),
+}
+
+
+def _uuid_arg(name):
+    value = request.args.get(name) or None
+    if value is None:
+        return None
+    try:
+        return str(uuid.UUID(value))
+    except ValueError:
+        raise ApiError(f'{name} inválido: {value}')
+
+
+def _cursor_arg(name):
+    value = request.args.get(name) or None
+    if value is None:
+        return None
+    try:
+        updated_at, row_id = value.split('_', 1)
+        return datetime.fromisoformat(updated_at), str(uuid.UUID(row_id))
+    except ValueError:
+        raise ApiError(f'{name} inválido: {value}')
+
+
+def _int_arg(name, default):
+    value = request.args.get(name) or None
+    if value is None:
+        return default
+    try:
+        return int(value)
+    except ValueError:
+        raise ApiError(f'{name} inválido: {value}')
+
+
+def _datetime_arg(name):
+    value = request.args.get(name) or None
+    if value is None:
+        return None
+    try:
+        value = datetime.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'Fecha inválida en {name}: {value} (usa AAAA-MM-DD o AAAA-MM-DDTHH:MM:SS)')
+    # updated_at is stored as naive UTC
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def _date_arg(name):
+    value = request.args.get(name) or None
+    if value is None:
+        return None
+    try:
+        return date.fromisoformat(value)
+    except ValueError:
+        raise ApiError(f'Fecha inválida en {name}: {value} (usa AAAA-MM-DD)')
+
+
+def _conditions(resource):
+    """WHERE clauses for the request's filters and the current user's scope."""
+    conditions = []
+    if current_user.role != 'admin':
+        if current_user.role not in resource.scopes:
+            raise PermissionError()
+        scope = resource.scopes[current_user.role]
+        if scope is not None:
+            conditions.append(scope(current_user.profile_id))
+
+    for name in ID_FILTERS:
+        value = _uuid_arg(name)
+        if value is None:
+            continue
+        if name not in resource.filters:
+            raise ApiError(f'Filtro no disponible para este recurso: {name}')
+        conditions.append(resource.filters[name](value))
+
+    updated_since = _datetime_arg('updated_since')
+    if updated_since:
+        conditions.append(resource.table.updated_at >= updated_since)
+
+    start, end = _date_arg('start'), _date_arg('end')
+    if start:
+        conditions.append(resource.date_column >= start)
+    if end:
+        # end is inclusive; a DateTime column needs everything before the next day
+        if isinstance(resource.date_column.type, DateTime):
+            conditions.append(resource.date_column < end + timedelta(days=1))
+        else:
+            conditions.append(resource.date_column <= end)
+    return conditions
+
+
+@app.route('/api/v1/<resource>', methods=['GET'])
+@login_required
+def api_list(resource):
+    """One page of a resource as {'data': [...], 'next_cursor': cursor or null}."""
+    definition = RESOURCES.get(resource)
+    if definition is None:
+        return jsonify({'error': 'Recurso no encontrado'}), 404
+    try:
+        visible = definition.visible_fields(current_user.role)
+        fields = [name for name in (request.args.get('fields') or '').split(',') if name] or visible
+        unknown = [name for name in fields if name not in visible]
+        if unknown:
+            raise ApiError(f'Campos desconocidos: {", ".join(unknown)}')
+        per_page = _int_arg('per_page', API_PAGE_SIZE)
+        per_page = max(1, min(per_page, API_MAX_PAGE_SIZE))
+        conditions = _conditions(definition)
+        data, next_cursor = definition.page(fields, conditions, _cursor_arg('after'), per_page)
+    except ApiError as e:
+        return jsonify({'error': str(e)}), 400
+    except PermissionError:
+        return jsonify({'error': 'Denegado'}), 403
+    return jsonify({'data': data, 'next_cursor': next_cursor})
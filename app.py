@@ -3,10 +3,17 @@ Main Application - Flask Setup
 """
 
 import os
+import sqlite3
 from typing import Optional
-from flask import Flask
+from flask import Flask, flash, redirect, request, url_for
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import StatementError
+from werkzeug.routing import UUIDConverter
 from flask_login import LoginManager
-from models import db, User
+from models import db, User, InvalidId
+from identity import load_identity
+import keys
 from auth import hash_password
 from datetime import date
 from dotenv import load_dotenv
@@ -33,12 +40,49 @@ app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
     'pool_pre_ping': True,
     'pool_recycle': 300,
-    'pool_size': 10,
-    'max_overflow': 20,
 }
+# SQLite files use a pool without size limits
+if not app.config['SQLALCHEMY_DATABASE_URI'].startswith('sqlite'):
+    app.config['SQLALCHEMY_ENGINE_OPTIONS'].update(pool_size=10, max_overflow=20)
 
 db.init_app(app)
 
+
+# SQLite only enforces foreign keys, and so ON DELETE CASCADE, when asked to
+@event.listens_for(Engine, 'connect')
+def _enable_sqlite_foreign_keys(dbapi_connection, connection_record):
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.execute('PRAGMA foreign_keys=ON')
+
+class IdConverter(UUIDConverter):
+    """<id:name> URL parts: a UUID key, passed to the view as its canonical string."""
+
+    def to_python(self, value):
+        return str(super().to_python(value))
+
+
+app.url_map.converters['id'] = IdConverter
+
+
+# Ids posted in forms or query strings reach the database unchecked; a
+# value that is not a UUID stops at CompactUUID instead of matching nothing.
+# Routes that parse form ids themselves raise InvalidId directly.
+@app.errorhandler(InvalidId)
+@app.errorhandler(StatementError)
+def _invalid_id(error):
+    if isinstance(error, StatementError) and not isinstance(error.orig, InvalidId):
+        raise error
+    db.session.rollback()
+    flash('Identificador inválido', 'error')
+    return redirect(request.referrer or url_for('dashboard'))
+
+
+# A database from before the compact keys cannot be read until it is upgraded
+@app.before_first_request
+def _check_schema():
+    keys.require_compact_keys()
+
+
 # Login Manager
 login_manager: LoginManager = LoginManager()
 login_manager.init_app(app)
@@ -47,7 +91,7 @@ login_manager.login_view = 'login'  # type: ignore
 @login_manager.user_loader
 def load_user(user_id):
     try:
-        return User.query.get(user_id)
+        return load_identity(user_id)
     except Exception as e:
         print(f"Error loading user: {e}")
         return None
@@ -75,3 +119,7 @@ def init_db():
 
 # Import routes AFTER app definition
 import routes
+import metrics
+import assets
+import api
+import commands
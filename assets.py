@@ -0,0 +1,256 @@
+"""
+Assets - Self-hosted CSS, icon and font bundle with content-hashed names
+
+flask build-assets compiles the Tailwind classes the templates use into one
+minified stylesheet, appends the Font Awesome icons they use (as CSS masks,
+so <i class="fas fa-..."> keeps working without the icon font) and the
+Plus Jakarta Sans faces, and writes everything to static/dist under names
+that change with the content. /assets/<name> serves those files with a
+one-year immutable Cache-Control and the precompressed .br/.gz variant the
+browser accepts.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import re
+import shlex
+import subprocess
+import tempfile
+from urllib.parse import quote
+from flask import abort, request, send_file, url_for
+from app import app
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+TEMPLATES_DIR = os.path.join(ROOT, 'templates')
+SOURCE_CSS = os.path.join(ROOT, 'styles', 'app.css')
+TAILWIND_CONFIG = os.path.join(ROOT, 'tailwind.config.js')
+NODE_MODULES = os.path.join(ROOT, 'node_modules')
+ICON_METADATA = os.path.join(NODE_MODULES, '@fortawesome', 'fontawesome-free', 'metadata', 'icons.json')
+FONT_FILES = os.path.join(NODE_MODULES, '@fontsource', 'plus-jakarta-sans', 'files')
+ASSETS_DIR = os.path.join(ROOT, 'static', 'dist')
+MANIFEST_PATH = os.path.join(ASSETS_DIR, 'manifest.json')
+
+# Tailwind CLI; point it at the standalone binary where there is no Node
+TAILWIND_COMMAND = os.getenv('TAILWIND_COMMAND', 'npx --no-install tailwindcss')
+# Built files are named by their content, so browsers may keep them for a year
+ASSET_MAX_AGE = int(os.getenv('ASSET_MAX_AGE', 365 * 24 * 3600))
+
+FONT_FAMILY = 'Plus Jakarta Sans'
+FONT_WEIGHTS = (400, 500, 600, 700, 800)
+
+# Font Awesome style classes and the icon style each one draws
+ICON_STYLES = {
+    'fa': 'solid', 'fas': 'solid', 'fa-solid': 'solid',
+    'far': 'regular', 'fa-regular': 'regular',
+    'fab': 'brands', 'fa-brands': 'brands',
+}
+# Font Awesome utility classes the bundle supports besides the icons
+ICON_MODIFIERS = {
+    'fa-fw': 'width:1.25em',
+    'fa-xs': 'font-size:.75em',
+    'fa-sm': 'font-size:.875em',
+    'fa-lg': 'font-size:1.25em',
+    'fa-xl': 'font-size:1.5em',
+    'fa-2x': 'font-size:2em',
+    'fa-3x': 'font-size:3em',
+    'fa-spin': 'animation:fa-spin 2s linear infinite',
+}
+ICON_BASE_CSS = (
+    '@keyframes fa-spin{to{transform:rotate(360deg)}}'
+    '.fa,.fas,.far,.fab,.fa-solid,.fa-regular,.fa-brands{display:inline-block;width:1em;height:1em;'
+    'vertical-align:-.125em;background-color:currentColor;'
+    # Without an icon rule the mask is a transparent image, not none (which would paint a solid square)
+    '-webkit-mask:var(--fa-icon,linear-gradient(transparent,transparent)) center/contain no-repeat;'
+    'mask:var(--fa-icon,linear-gradient(transparent,transparent)) center/contain no-repeat}'
+)
+
+_CLASS_ATTRIBUTE = re.compile(r'class\s*=\s*(["\'])(.*?)\1', re.S)
+# Font Awesome classes wherever they appear, including inside {% if %} blocks and script strings
+_ICON_CLASS = re.compile(r'\bfa[srb]?(?:-[a-z0-9]+)*\b')
+
+
+def used_icons(templates_dir=TEMPLATES_DIR):
+    """{(style, icon class)} for every Font Awesome icon named in the templates.
+
+    An icon takes the styles (fas, far, fab...) of the class attributes it
+    appears in, with solid as the default; icons named outside any class
+    attribute, like those swapped in by JavaScript, are drawn solid.
+    """
+    icons = set()
+    for directory, _, files in os.walk(templates_dir):
+        for name in files:
+            if not name.endswith('.html'):
+                continue
+            with open(os.path.join(directory, name), encoding='utf-8') as source:
+                text = source.read()
+            styled = set()
+            for _, classes in _CLASS_ATTRIBUTE.findall(text):
+                classes = _ICON_CLASS.findall(classes)
+                styles = {ICON_STYLES[c] for c in classes if c in ICON_STYLES}
+                for c in classes:
+                    if _is_icon(c):
+                        icons.update((style, c) for style in styles or {'solid'})
+                        styled.add(c)
+            icons.update(('solid', c) for c in _ICON_CLASS.findall(text) if _is_icon(c) and c not in styled)
+    return icons
+
+
+def _is_icon(name):
+    return name.startswith('fa-') and name not in ICON_STYLES and name not in ICON_MODIFIERS
+
+
+def _icon_index():
+    """{name or alias: icon metadata} from Font Awesome's icons.json."""
+    with open(ICON_METADATA, encoding='utf-8') as source:
+        metadata = json.load(source)
+    index = {}
+    for name, icon in metadata.items():
+        for alias in [name] + icon.get('aliases', {}).get('names', []):
+            index.setdefault(alias, icon)
+    return index
+
+
+def icon_css(icons):
+    """CSS drawing each (style, icon class) as a mask of its SVG path; raises ValueError for unknown icons."""
+    index = _icon_index()
+    rules, unknown = [], []
+    for style, icon_class in sorted(icons):
+        svg = index.get(icon_class[len('fa-'):], {}).get('svg', {}).get(style)
+        if svg is None:
+            unknown.append(f'{icon_class} ({style})')
+            continue
+        path = svg['path'] if isinstance(svg['path'], str) else ' '.join(svg['path'])
+        image = (f'<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 {svg["width"]} {svg["height"]}">'
+                 f'<path d="{path}"/></svg>')
+        selector = f'.{icon_class}' if style == 'solid' else ','.join(
+            f'.{style_class}.{icon_class}' for style_class, s in ICON_STYLES.items() if s == style)
+        rules.append(f'{selector}{{--fa-icon:url("data:image/svg+xml,{quote(image, safe=" =/:.,-")}");'
+                     f'width:{svg["width"] / svg["height"]:.4g}em}}')
+    if unknown:
+        raise ValueError(f'Unknown Font Awesome icons in templates: {", ".join(unknown)}')
+    modifiers = ''.join(f'.{name}{{{rule}}}' for name, rule in ICON_MODIFIERS.items())
+    return ICON_BASE_CSS + ''.join(rules) + modifiers
+
+
+def _tailwind_css():
+    """Run the Tailwind CLI over styles/app.css; only classes found in the templates are emitted."""
+    with tempfile.TemporaryDirectory() as directory:
+        output = os.path.join(directory, 'app.css')
+        command = shlex.split(TAILWIND_COMMAND) + ['-c', TAILWIND_CONFIG, '-i', SOURCE_CSS, '-o', output, '--minify']
+        try:
+            subprocess.run(command, cwd=ROOT, check=True, capture_output=True, text=True)
+        except FileNotFoundError:
+            raise ValueError(f'Tailwind CLI not found ({TAILWIND_COMMAND}); run npm install or set TAILWIND_COMMAND')
+        except subprocess.CalledProcessError as e:
+            raise ValueError(f'Tailwind build failed: {e.stderr.strip()}')
+        with open(output, 'rb') as source:
+            return source.read()
+
+
+def _hashed_name(name, content):
+    stem, extension = os.path.splitext(name)
+    return f'{stem}.{hashlib.sha256(content).hexdigest()[:12]}{extension}'
+
+
+def _write_asset(name, content, compress):
+    """Write content under its hashed name (plus .gz and, with brotli installed, .br); returns the name."""
+    hashed = _hashed_name(name, content)
+    path = os.path.join(ASSETS_DIR, hashed)
+    with open(path, 'wb') as output:
+        output.write(content)
+    if compress:
+        with open(path + '.gz', 'wb') as output:
+            output.write(gzip.compress(content, compresslevel=9, mtime=0))
+        try:
+            import brotli
+        except ImportError:
+            pass
+        else:
+            with open(path + '.br', 'wb') as output:
+                output.write(brotli.compress(content, quality=11))
+    return hashed
+
+
+def build_assets(echo=None):
+    """Build static/dist and its manifest; returns the manifest ({logical name: hashed name}).
+
+    Needs npm install to have run, for the Tailwind CLI (unless
+    TAILWIND_COMMAND points elsewhere), Font Awesome's icon metadata and
+    the font files. Files of earlier builds are removed.
+    """
+    echo = echo or (lambda message: None)
+    for path in (ICON_METADATA, FONT_FILES):
+        if not os.path.exists(path):
+            raise ValueError(f'{os.path.relpath(path, ROOT)} is missing; run npm install first')
+    os.makedirs(ASSETS_DIR, exist_ok=True)
+    manifest = {}
+
+    font_faces = []
+    for weight in FONT_WEIGHTS:
+        name = f'plus-jakarta-sans-latin-{weight}-normal.woff2'
+        with open(os.path.join(FONT_FILES, name), 'rb') as source:
+            manifest[name] = _write_asset(name, source.read(), compress=False)
+        font_faces.append(f"@font-face{{font-family:'{FONT_FAMILY}';font-style:normal;font-weight:{weight};"
+                          f"font-display:swap;src:url({manifest[name]}) format('woff2')}}")
+
+    icons = used_icons()
+    stylesheet = _tailwind_css() + (''.join(font_faces) + icon_css(icons)).encode('utf-8')
+    manifest['app.css'] = _write_asset('app.css', stylesheet, compress=True)
+    echo(f'{manifest["app.css"]}: {len(stylesheet) / 1024:.1f} KiB, {len(icons)} icons, '
+         f'{len(FONT_WEIGHTS)} font weights')
+
+    with open(MANIFEST_PATH, 'w') as output:
+        json.dump(manifest, output, indent=2, sort_keys=True)
+    keep = {os.path.basename(MANIFEST_PATH)} | {
+        name + suffix for name in manifest.values() for suffix in ('', '.gz', '.br')}
+    for name in os.listdir(ASSETS_DIR):
+        if name not in keep:
+            os.remove(os.path.join(ASSETS_DIR, name))
+    global _manifest
+    _manifest = manifest
+    return manifest
+
+
+_manifest = None
+
+
+def asset_manifest():
+    """The manifest of the last build, read once per process; empty when nothing was built."""
+    global _manifest
+    if _manifest is None:
+        try:
+            with open(MANIFEST_PATH) as source:
+                _manifest = json.load(source)
+        except FileNotFoundError:
+            _manifest = {}
+    return _manifest
+
+
+@app.template_global()
+def asset_url(name):
+    """URL of the built file for name, or None before flask build-assets has run."""
+    hashed = asset_manifest().get(name)
+    return url_for('asset', filename=hashed) if hashed else None
+
+
+@app.route('/assets/<filename>')
+def asset(filename):
+    if filename not in asset_manifest().values():
+        abort(404)
+    path = os.path.join(ASSETS_DIR, filename)
+    mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    encoding = None
+    for candidate, suffix in (('br', '.br'), ('gzip', '.gz')):
+        if candidate in request.accept_encodings and os.path.exists(path + suffix):
+            encoding, path = candidate, path + suffix
+            break
+    response = send_file(path, mimetype=mimetype, max_age=ASSET_MAX_AGE)
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+    response.cache_control.public = True
+    response.cache_control.immutable = True
+    return response
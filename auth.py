@@ -2,14 +2,133 @@
 Authentication - Password hashing and verification
 """
 
+import os
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
 from werkzeug.security import generate_password_hash, check_password_hash
 
+# werkzeug hash method; for pbkdf2 the iteration count is the cost
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', 'pbkdf2:sha256')
+PASSWORD_HASH_ITERATIONS = int(os.getenv('PASSWORD_HASH_ITERATIONS', 260000))
+# Password checks running at once per process; 0 checks on the request thread
+LOGIN_HASH_WORKERS = int(os.getenv('LOGIN_HASH_WORKERS', os.cpu_count() or 1))
+# Logins allowed to wait for a free worker before new ones are turned away
+LOGIN_QUEUE_LIMIT = int(os.getenv('LOGIN_QUEUE_LIMIT', 64))
+LOGIN_HASH_TIMEOUT = float(os.getenv('LOGIN_HASH_TIMEOUT', 10))
+
+
+def password_hash_method():
+    """The full werkzeug method string new hashes are created with."""
+    if PASSWORD_HASH_METHOD.startswith('pbkdf2') and PASSWORD_HASH_METHOD.count(':') == 1:
+        return f'{PASSWORD_HASH_METHOD}:{PASSWORD_HASH_ITERATIONS}'
+    return PASSWORD_HASH_METHOD
+
 
 def hash_password(password):
     """Hash password"""
-    return generate_password_hash(password)
+    return generate_password_hash(password, method=password_hash_method())
 
 
 def verify_password(password, password_hash):
     """Verify password"""
     return check_password_hash(password_hash, password)
+
+
+def needs_rehash(password_hash):
+    """True when password_hash was made with another method or cost than the configured one."""
+    return password_hash.split('$', 1)[0] != password_hash_method()
+
+
+class LoginBusy(Exception):
+    """Raised when every hash worker is busy and the wait queue is full."""
+
+
+class HashPool:
+    """Bounded thread pool for password hashing.
+
+    pbkdf2 runs in hashlib without holding the GIL, so a few threads keep
+    every core busy while threaded gunicorn workers go on serving other
+    requests. At most workers + queue_limit checks are admitted at once;
+    beyond that LoginBusy is raised straight away instead of letting
+    requests pile up behind the hashing.
+    """
+
+    def __init__(self, workers, queue_limit):
+        self.workers = workers
+        self._slots = threading.BoundedSemaphore(workers + queue_limit) if workers > 0 else None
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        # Created on first use so a forking server starts its threads after the fork
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='password-hash')
+            return self._executor
+
+    def run(self, fn, *args):
+        if self._slots is None:
+            return fn(*args)
+        if not self._slots.acquire(blocking=False):
+            raise LoginBusy()
+        try:
+            future = self._get_executor().submit(fn, *args)
+        except BaseException:
+            self._slots.release()
+            raise
+        # The slot is held until the hash itself is done (or cancelled), not
+        # just until this request stops waiting, so timed-out checks still
+        # count against workers + queue_limit
+        future.add_done_callback(lambda _: self._slots.release())
+        try:
+            return future.result(timeout=LOGIN_HASH_TIMEOUT)
+        except TimeoutError:
+            future.cancel()
+            raise LoginBusy()
+
+    def map(self, fn, items):
+        """[fn(item) for item in items] on the pool, for bulk work such as roster imports.
+
+        Only half the workers' worth of calls is queued at a time, so a
+        login arriving meanwhile waits behind a few hashes rather than the
+        whole batch. Bulk work is never turned away with LoginBusy.
+        """
+        if self._slots is None:
+            return [fn(item) for item in items]
+        executor = self._get_executor()
+        window = max(1, self.workers // 2)
+        results, pending = [], deque()
+        for item in items:
+            pending.append(executor.submit(fn, item))
+            if len(pending) >= window:
+                results.append(pending.popleft().result())
+        results.extend(future.result() for future in pending)
+        return results
+
+    def shutdown(self):
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+
+
+hash_pool = HashPool(LOGIN_HASH_WORKERS, LOGIN_QUEUE_LIMIT)
+
+
+def configure_hash_pool(workers, queue_limit=LOGIN_QUEUE_LIMIT):
+    """Replace the process-wide hash pool (used by the login benchmark)."""
+    global hash_pool
+    hash_pool.shutdown()
+    hash_pool = HashPool(workers, queue_limit)
+    return hash_pool
+
+
+def verify_password_pooled(password, password_hash):
+    """verify_password on the hash pool; raises LoginBusy when the pool is saturated."""
+    return hash_pool.run(verify_password, password, password_hash)
+
+
+def hash_password_pooled(password):
+    """hash_password on the hash pool; raises LoginBusy when the pool is saturated."""
+    return hash_pool.run(hash_password, password)
@@ -0,0 +1,345 @@
+"""
+Benchmark - Route latency, query count and memory benchmark suite
+"""
+
+import json
+import platform
+import statistics
+import subprocess
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from sqlalchemy import event, text
+from models import (db, User, Student, Teacher, Grade, Subject, Enrollment, Assessment, Attendance, Schedule,
+                    TeacherSubject)
+from synthetic import timetable_problem
+from timetable import TimetableSolver, find_all_conflicts
+from app import app
+
+ROLES = ('admin', 'teacher', 'student')
+PERCENTILES = (50, 90, 95, 99)
+
+# Endpoints that end the session or are not part of routes.py
+SKIPPED_ENDPOINTS = ('static', 'logout', 'metrics', 'asset')
+
+# Sample values for URL arguments, taken from the data being benchmarked
+_ARGUMENT_MODELS = {
+    'student_id': Student,
+    'teacher_id': Teacher,
+    'grade_id': Grade,
+    'subject_id': Subject,
+    'enrollment_id': Enrollment,
+    'assessment_id': Assessment,
+    'attendance_id': Attendance,
+    'schedule_id': Schedule,
+    'ts_id': TeacherSubject,
+}
+_FIXED_ARGUMENTS = {'kind': 'grades', 'fmt': 'csv', 'resource': 'enrollments'}
+
+
+def logged_in_client(user_id):
+    """A test client whose session is already authenticated as user_id."""
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['_user_id'] = user_id
+        sess['_fresh'] = True
+    return client
+
+
+def _percentile(values, percentile):
+    ordered = sorted(values)
+    index = (len(ordered) - 1) * percentile / 100
+    low = int(index)
+    high = min(low + 1, len(ordered) - 1)
+    return ordered[low] + (ordered[high] - ordered[low]) * (index - low)
+
+
+def _summary(values):
+    summary = {f'p{p}': round(_percentile(values, p), 3) for p in PERCENTILES}
+    summary.update(min=round(min(values), 3), max=round(max(values), 3), mean=round(statistics.mean(values), 3))
+    return summary
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=app.root_path,
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class RouteBenchmark:
+    """Drive every GET route in routes.py through the Flask test client.
+
+    Each route runs as the first role (admin, teacher, student) that gets a
+    200 from it. The teacher is the one with the most enrollments and the
+    student the one with the most enrollments, so the heavy paths are the
+    ones measured. Latency and query counts come from the timed
+    iterations; peak memory from one extra tracemalloc run, so tracing
+    does not skew the timings.
+    """
+
+    def __init__(self, iterations=20, warmup=2, endpoints=None):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.endpoints = set(endpoints or ())
+        self.queries = 0
+
+    def _users(self):
+        users = {}
+        admin = User.query.filter_by(role='admin').first()
+        if admin:
+            users['admin'] = admin.id
+        for role, model, column in (('teacher', Teacher, Enrollment.teacher_id),
+                                    ('student', Student, Enrollment.student_id)):
+            busiest = (
+                db.session.query(model.user_id)
+                .join(Enrollment, column == model.id)
+                .group_by(model.id, model.user_id)
+                .order_by(db.func.count(Enrollment.id).desc())
+                .first()
+            )
+            if busiest is None:
+                busiest = db.session.query(model.user_id).first()
+            if busiest:
+                users[role] = busiest[0]
+        return users
+
+    def _arguments(self, users):
+        """Sample URL arguments from rows the benchmark teacher and student own.
+
+        Teacher-only routes check ownership, so an enrollment (and its
+        grade, subject, attendance and assessments) of somebody else's
+        would only ever answer with a redirect.
+        """
+        arguments = dict(_FIXED_ARGUMENTS)
+        for name, model in _ARGUMENT_MODELS.items():
+            row = db.session.query(model.id).order_by(model.id).first()
+            if row:
+                arguments[name] = row[0]
+        for role, model in (('teacher', Teacher), ('student', Student)):
+            if role in users:
+                arguments[f'{role}_id'] = db.session.query(model.id).filter_by(user_id=users[role]).scalar()
+        if arguments.get('teacher_id'):
+            # The teacher's enrollment with the most attendance, so history pages have rows to show
+            enrollment = (
+                db.session.query(Enrollment)
+                .outerjoin(Attendance, Attendance.enrollment_id == Enrollment.id)
+                .filter(Enrollment.teacher_id == arguments['teacher_id'])
+                .group_by(Enrollment.id)
+                .order_by(db.func.count(Attendance.id).desc(), Enrollment.id)
+                .first()
+            )
+            if enrollment:
+                arguments.update(enrollment_id=enrollment.id, grade_id=enrollment.grade_id,
+                                 subject_id=enrollment.subject_id)
+                for name, model in (('attendance_id', Attendance), ('assessment_id', Assessment)):
+                    row = db.session.query(model.id).filter_by(enrollment_id=enrollment.id).order_by(model.id).first()
+                    if row:
+                        arguments[name] = row[0]
+        return arguments
+
+    def _routes(self, arguments):
+        routes, skipped = [], []
+        for rule in sorted(app.url_map.iter_rules(), key=lambda r: r.endpoint):
+            if rule.endpoint in SKIPPED_ENDPOINTS or (self.endpoints and rule.endpoint not in self.endpoints):
+                continue
+            if 'GET' not in rule.methods:
+                skipped.append({'endpoint': rule.endpoint, 'reason': 'POST only'})
+                continue
+            missing = [name for name in rule.arguments if name not in arguments]
+            if missing:
+                skipped.append({'endpoint': rule.endpoint, 'reason': f'no sample for {", ".join(missing)}'})
+                continue
+            url = rule.build({name: arguments[name] for name in rule.arguments}, append_unknown=False)[1]
+            routes.append((rule.endpoint, url))
+        return routes, skipped
+
+    def _count_query(self, conn, cursor, statement, parameters, context, executemany):
+        self.queries += 1
+
+    def _request(self, client, url):
+        """One request in a fresh app context; returns (status, seconds, queries)."""
+        self.queries = 0
+        start = time.perf_counter()
+        with app.app_context():
+            response = client.get(url)
+            # Drain streamed bodies so exports are timed in full
+            response.get_data()
+            db.session.remove()
+        return response.status_code, time.perf_counter() - start, self.queries
+
+    def _pick_client(self, clients, url):
+        status = None
+        for role, client in clients.items():
+            status = self._request(client, url)[0]
+            if status == 200:
+                return role, client, status
+        return None, None, status
+
+    def _measure(self, client, url):
+        for _ in range(self.warmup):
+            self._request(client, url)
+
+        latencies, queries, statuses = [], [], set()
+        for _ in range(self.iterations):
+            status, seconds, count = self._request(client, url)
+            statuses.add(status)
+            latencies.append(seconds * 1000)
+            queries.append(count)
+
+        tracemalloc.start()
+        try:
+            self._request(client, url)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        return {
+            'statuses': sorted(statuses),
+            'latency_ms': _summary(latencies),
+            'queries': {'min': min(queries), 'max': max(queries), 'median': statistics.median(queries)},
+            'peak_memory_kb': round(peak / 1024, 1),
+        }
+
+    def run(self, echo=None):
+        """Run the suite; returns a JSON-serialisable results dict."""
+        echo = echo or (lambda message: None)
+        with app.app_context():
+            users = self._users()
+            arguments = self._arguments(users)
+            tables = {table.name: db.session.execute(text(f'SELECT COUNT(*) FROM {table.name}')).scalar()
+                      for table in db.Model.metadata.sorted_tables}
+            dialect = db.engine.dialect.name
+            engine = db.engine
+            db.session.remove()
+
+        clients = {role: logged_in_client(users[role]) for role in ROLES if role in users}
+        routes, skipped = self._routes(arguments)
+
+        results = {}
+        event.listen(engine, 'before_cursor_execute', self._count_query)
+        try:
+            for endpoint, url in routes:
+                role, client, status = self._pick_client(clients, url)
+                if client is None:
+                    skipped.append({'endpoint': endpoint, 'reason': f'no role got 200 (last status {status})'})
+                    continue
+                results[endpoint] = dict(url=url, role=role, iterations=self.iterations, **self._measure(client, url))
+                latency = results[endpoint]['latency_ms']
+                echo(f'{endpoint}: p50 {latency["p50"]} ms, p95 {latency["p95"]} ms, '
+                     f'{results[endpoint]["queries"]["max"]} queries, {results[endpoint]["peak_memory_kb"]} KiB')
+        finally:
+            event.remove(engine, 'before_cursor_execute', self._count_query)
+
+        return {
+            'meta': {
+                'commit': _git_commit(),
+                'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+                'dialect': dialect,
+                'python': platform.python_version(),
+                'iterations': self.iterations,
+                'warmup': self.warmup,
+                'tables': tables,
+            },
+            'routes': results,
+            'skipped': skipped,
+        }
+
+
+def login_burst(credentials, concurrency):
+    """POST /login once per (email, password) from concurrency threads at once.
+
+    Each attempt uses its own test client, like a separate browser, and
+    the threads stand in for a threaded gunicorn worker. Returns
+    throughput, outcome counts and latency percentiles.
+    """
+    def attempt(credential):
+        email, password = credential
+        client = app.test_client()
+        start = time.perf_counter()
+        response = client.post('/login', data={'email': email, 'password': password})
+        seconds = time.perf_counter() - start
+        succeeded = response.status_code == 302 and response.headers.get('Location', '').endswith('/dashboard')
+        return response.status_code, succeeded, seconds * 1000
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(attempt, credentials))
+    elapsed = time.perf_counter() - start
+
+    succeeded = sum(1 for _, ok, _ in results if ok)
+    busy = sum(1 for status, _, _ in results if status == 503)
+    return {
+        'attempts': len(results),
+        'succeeded': succeeded,
+        'rejected_busy': busy,
+        'failed': len(results) - succeeded - busy,
+        'concurrency': concurrency,
+        'seconds': round(elapsed, 3),
+        'logins_per_second': round(succeeded / elapsed, 1) if elapsed else None,
+        'latency_ms': _summary([latency for _, _, latency in results]) if results else None,
+    }
+
+
+def timetable_benchmark(sizes, seed=1, time_limit=30.0, echo=None):
+    """Solve synthetic schools of each size (in grades) and report time, placement and conflicts.
+
+    Runs in memory, without the database. Every solution is checked with
+    find_all_conflicts(), so a timetable that books anything twice shows
+    up as conflicts rather than passing silently.
+    """
+    echo = echo or (lambda message: None)
+    results = {}
+    for grades in sizes:
+        problem = timetable_problem(grades, seed=seed)
+        solution = TimetableSolver(time_limit=time_limit, **problem).solve()
+        results[grades] = {
+            'courses': len(problem['courses']),
+            'teachers': len(problem['unavailable']),
+            'classrooms': len(problem['rooms']),
+            'lessons': len(solution.lessons),
+            'unplaced': len(solution.unplaced),
+            'moves': solution.moves,
+            'seconds': round(solution.seconds, 3),
+            'conflicts': len(find_all_conflicts(solution.lessons)),
+        }
+        result = results[grades]
+        echo(f'{grades} grades, {result["teachers"]} teachers, {result["classrooms"]} classrooms: '
+             f'{result["lessons"]} lessons placed, {result["unplaced"]} unplaced, {result["conflicts"]} conflicts '
+             f'in {result["seconds"]}s')
+    return {
+        'meta': {
+            'commit': _git_commit(),
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'python': platform.python_version(),
+            'seed': seed,
+        },
+        'sizes': results,
+    }
+
+
+def compare(baseline, current, threshold=0.2):
+    """Yield (endpoint, metric, before, after, regressed) for routes in both runs.
+
+    A route regresses when its p50 or p95 latency grows by more than
+    threshold (a fraction), or when it issues more queries than before.
+    """
+    for endpoint in sorted(set(baseline['routes']) & set(current['routes'])):
+        before, after = baseline['routes'][endpoint], current['routes'][endpoint]
+        for metric in ('p50', 'p95'):
+            old, new = before['latency_ms'][metric], after['latency_ms'][metric]
+            yield endpoint, metric, old, new, old > 0 and (new - old) / old > threshold
+        old, new = before['queries']['max'], after['queries']['max']
+        yield endpoint, 'queries', old, new, new > old
+
+
+def save(results, path):
+    with open(path, 'w') as output:
+        json.dump(results, output, indent=2, sort_keys=True)
+
+
+def load(path):
+    with open(path) as source:
+        return json.load(source)
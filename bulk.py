@@ -0,0 +1,177 @@
+"""
+Bulk - Set-based write helpers
+"""
+
+from datetime import datetime
+from sqlalchemy import tuple_
+from cache import rows_written
+from models import db, Enrollment, Calificacion, SEMESTERS, semester_average
+
+# Rows per INSERT statement, keeping bound parameters under SQLite's 32766 limit
+UPSERT_CHUNK_SIZE = 500
+
+
+def _dialect_insert():
+    dialect = db.engine.dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+        return insert
+    if dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        return insert
+    return None
+
+
+def upsert(model, rows, conflict_columns, update_columns):
+    """Insert rows, updating update_columns where conflict_columns already exist.
+
+    Uses INSERT ... ON CONFLICT DO UPDATE on PostgreSQL and SQLite, which
+    needs a unique index on conflict_columns. Other databases fall back to
+    one SELECT of the existing keys followed by bulk inserts and updates.
+    Runs inside the caller's transaction; the caller commits.
+    """
+    if not rows:
+        return
+
+    insert = _dialect_insert()
+    if insert is None:
+        _upsert_fallback(model, rows, conflict_columns, update_columns)
+        return
+
+    table = model.__table__
+    # ON CONFLICT DO UPDATE skips the columns' onupdate defaults
+    touched = {column.name: datetime.utcnow() for column in table.columns
+               if column.onupdate is not None and column.name not in update_columns}
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = rows[start:start + UPSERT_CHUNK_SIZE]
+        stmt = insert(table).values(chunk)
+        updates = {column: stmt.excluded[column] for column in update_columns}
+        updates.update(touched)
+        stmt = stmt.on_conflict_do_update(index_elements=conflict_columns, set_=updates)
+        db.session.execute(stmt)
+
+
+def increment(model, rows, key_columns, counter_columns, replace_columns=()):
+    """Add each row's counter_columns to the row with the same key, creating it if missing.
+
+    key_columns must be the primary key. Uses INSERT ... ON CONFLICT DO
+    UPDATE SET c = c + excluded.c on PostgreSQL and SQLite, so concurrent
+    increments never overwrite each other. replace_columns are simply
+    overwritten with the row's value. Runs inside the caller's
+    transaction; the caller commits.
+    """
+    if not rows:
+        return
+
+    insert = _dialect_insert()
+    if insert is None:
+        _increment_fallback(model, rows, key_columns, counter_columns, replace_columns)
+        return
+
+    table = model.__table__
+    for start in range(0, len(rows), UPSERT_CHUNK_SIZE):
+        chunk = rows[start:start + UPSERT_CHUNK_SIZE]
+        stmt = insert(table).values(chunk)
+        updates = {column: table.c[column] + stmt.excluded[column] for column in counter_columns}
+        updates.update({column: stmt.excluded[column] for column in replace_columns})
+        stmt = stmt.on_conflict_do_update(index_elements=key_columns, set_=updates)
+        db.session.execute(stmt)
+
+
+def _increment_fallback(model, rows, key_columns, counter_columns, replace_columns=()):
+    columns = [getattr(model, column) for column in key_columns + counter_columns]
+    keys = [tuple(row[column] for column in key_columns) for row in rows]
+
+    existing = {}
+    for start in range(0, len(keys), UPSERT_CHUNK_SIZE):
+        chunk = keys[start:start + UPSERT_CHUNK_SIZE]
+        query = db.session.query(*columns).filter(tuple_(*columns[:len(key_columns)]).in_(chunk))
+        for found in query.with_for_update():
+            existing[tuple(found[:len(key_columns)])] = found[len(key_columns):]
+
+    inserts, updates = [], []
+    for key, row in zip(keys, rows):
+        if key in existing:
+            update = dict(zip(key_columns, key))
+            for column, current in zip(counter_columns, existing[key]):
+                update[column] = current + row[column]
+            for column in replace_columns:
+                update[column] = row[column]
+            updates.append(update)
+        else:
+            inserts.append(row)
+
+    db.session.bulk_insert_mappings(model, inserts)
+    db.session.bulk_update_mappings(model, updates)
+
+
+def _upsert_fallback(model, rows, conflict_columns, update_columns):
+    key_columns = [getattr(model, column) for column in conflict_columns]
+    keys = [tuple(row[column] for column in conflict_columns) for row in rows]
+
+    existing = {}
+    for start in range(0, len(keys), UPSERT_CHUNK_SIZE):
+        chunk = keys[start:start + UPSERT_CHUNK_SIZE]
+        for found in db.session.query(model.id, *key_columns).filter(tuple_(*key_columns).in_(chunk)):
+            existing[tuple(found[1:])] = found[0]
+
+    inserts, updates = [], []
+    for key, row in zip(keys, rows):
+        if key in existing:
+            update = {column: row[column] for column in update_columns}
+            update['id'] = existing[key]
+            updates.append(update)
+        else:
+            inserts.append(row)
+
+    db.session.bulk_insert_mappings(model, inserts)
+    db.session.bulk_update_mappings(model, updates)
+
+
+def save_semester_grades(enrollments, grades, with_notes=False):
+    """Write semester scores to Enrollment.semester_* and Calificacion.
+
+    grades maps enrollment id -> {semester: (score, note)}; enrollments are
+    the already-authorized Enrollment objects those ids refer to. One
+    executemany UPDATE covers the enrollments and one upsert on
+    (enrollment_id, semester) the calificaciones. Notes are only written
+    when with_notes is set, so callers without a notes field keep them.
+    Runs inside the caller's transaction; the caller commits.
+    """
+    enrollment_updates = []
+    calificaciones = []
+    for enrollment in enrollments:
+        entry = grades.get(enrollment.id)
+        if not entry:
+            continue
+
+        update = {'id': enrollment.id}
+        scores = {semester: getattr(enrollment, f'semester_{semester}') for semester in SEMESTERS}
+        for semester, (score, note) in entry.items():
+            update[f'semester_{semester}'] = score
+            scores[semester] = score
+            row = {
+                'enrollment_id': enrollment.id,
+                'student_id': enrollment.student_id,
+                'subject_id': enrollment.subject_id,
+                'teacher_id': enrollment.teacher_id,
+                'semester': semester,
+                'calificacion': score
+            }
+            if with_notes:
+                update[f'nota_semester_{semester}'] = note
+                row['nota_texto'] = note
+            calificaciones.append(row)
+        # bulk_update_mappings skips the mapper events, so keep the average here
+        update['average'], update['has_grades'] = semester_average(*scores.values())
+        enrollment_updates.append(update)
+
+    if not enrollment_updates:
+        return 0
+
+    db.session.bulk_update_mappings(Enrollment, enrollment_updates)
+    rows_written(db.session, Enrollment.__tablename__, [e for e in enrollments if e.id in grades])
+    update_columns = ['calificacion', 'nota_texto'] if with_notes else ['calificacion']
+    upsert(Calificacion, calificaciones, ['enrollment_id', 'semester'], update_columns)
+    rows_written(db.session, Calificacion.__tablename__, calificaciones)
+    return len(enrollment_updates)
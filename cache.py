@@ -0,0 +1,247 @@
+"""
+Cache - In-process TTL/LRU caches invalidated by committed writes
+"""
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+
+class TTLCache:
+    """A bounded, thread-safe LRU cache whose entries expire after ttl seconds."""
+
+    def __init__(self, ttl, max_entries=1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            expires, value = entry
+            if expires < time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key, factory):
+        value = self.get(key)
+        if value is None:
+            value = factory()
+            self.set(key, value)
+        return value
+
+    def invalidate(self, key=None):
+        """Drop one key, or everything when key is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FragmentCache:
+    """Rendered HTML fragments in LRU order, bounded by their total length.
+
+    Keys are expected to carry the version of the data a fragment was
+    rendered from, so entries are never invalidated: stale ones are simply
+    no longer asked for and fall off the end.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            html = self._entries.get(key)
+            if html is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return html
+
+    def set(self, key, html):
+        if len(html) > self.max_size:
+            return
+        with self._lock:
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self.size -= len(previous)
+            self._entries[key] = html
+            self.size += len(html)
+            while self.size > self.max_size:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# (table names, cache) pairs cleared when a commit writes to any of the tables
+_dependents = []
+
+
+def invalidate_on(cache, *tables):
+    """Clear cache whenever a transaction that wrote to one of tables commits."""
+    _dependents.append((frozenset(tables), cache))
+    return cache
+
+
+# table name -> [(column, cache)] for caches keyed by a column of that table
+_row_dependents = {}
+
+
+def invalidate_rows_on(cache, table, column):
+    """Drop the cache entry keyed by row[column] when a row of table is written.
+
+    ORM flushes are picked up automatically; Core writes report their rows
+    through rows_written(). Entries are dropped once the transaction commits.
+    """
+    _row_dependents.setdefault(table, []).append((column, cache))
+    return cache
+
+
+def dependent_columns(table):
+    """Columns of table that row-keyed caches are keyed by."""
+    return sorted({column for column, _ in _row_dependents.get(table, ())})
+
+
+def rows_written(session, table, rows):
+    """Record Core-written rows (dicts or objects) of table for invalidation on commit."""
+    dependents = _row_dependents.get(table)
+    if not dependents:
+        return
+    session.info.setdefault('reported_tables', set()).add(table)
+    pending = session.info.setdefault('pending_invalidations', set())
+    for row in rows:
+        for column, cache in dependents:
+            key = row.get(column) if isinstance(row, dict) else getattr(row, column, None)
+            if key is not None:
+                pending.add((cache, key))
+
+
+# Dashboard counts per (role, user id); admins share one entry
+DASHBOARD_STATS_TTL = int(os.getenv('DASHBOARD_STATS_TTL', 60))
+dashboard_stats = invalidate_on(TTLCache(ttl=DASHBOARD_STATS_TTL), 'students', 'teachers', 'enrollments', 'grades')
+
+# /student/my-grades per (student id, student version, catalog version);
+# keyed by the data versions rather than invalidated, so a write committed
+# by another worker is never served from this one's copy
+REPORT_CARD_TTL = int(os.getenv('REPORT_CARD_TTL', 3600))
+REPORT_CARD_MAX_ENTRIES = int(os.getenv('REPORT_CARD_MAX_ENTRIES', 50000))
+report_cards = TTLCache(ttl=REPORT_CARD_TTL, max_entries=REPORT_CARD_MAX_ENTRIES)
+
+
+# Per-grade sections of the teacher and schedule pages; HTML is mostly
+# ASCII, so the bound is close to the memory the strings take
+FRAGMENT_CACHE_MAX_BYTES = int(os.getenv('FRAGMENT_CACHE_MAX_BYTES', 32 * 1024 * 1024))
+page_fragments = FragmentCache(FRAGMENT_CACHE_MAX_BYTES)
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_flushed_rows(session, flush_context, instances):
+    for objects in (session.new, session.dirty, session.deleted):
+        for obj in objects:
+            table = getattr(obj, '__tablename__', None)
+            if table in _row_dependents:
+                rows_written(session, table, [obj])
+    # A row moved to another key changes the old key's entry too
+    for obj in session.dirty:
+        table = getattr(obj, '__tablename__', None)
+        if table in _row_dependents:
+            attrs = inspect(obj).attrs
+            previous = {column: attrs[column].history.deleted[0]
+                        for column in dependent_columns(table) if attrs[column].history.deleted}
+            if previous:
+                rows_written(session, table, [previous])
+
+
+class UnreportedWrite(RuntimeError):
+    """A Core statement wrote rows that row-keyed caches depend on without reporting them."""
+
+
+# Core statements run through Session.execute() skip the flush hooks above;
+# each one on a table with row-keyed dependents must go with a
+# rows_written() call for that table in the same transaction
+@event.listens_for(Session, 'do_orm_execute')
+def _record_core_write(orm_execute_state):
+    if not (orm_execute_state.is_insert or orm_execute_state.is_update or orm_execute_state.is_delete):
+        return
+    table = getattr(orm_execute_state.statement, 'table', None)
+    if table is not None and table.name in _row_dependents:
+        orm_execute_state.session.info.setdefault('core_writes', set()).add(table.name)
+
+
+@event.listens_for(Session, 'before_commit')
+def _check_core_writes(session):
+    unreported = session.info.pop('core_writes', set()) - session.info.pop('reported_tables', set())
+    if unreported:
+        raise UnreportedWrite(f'Core writes to {", ".join(sorted(unreported))} were not reported with rows_written()')
+
+
+@event.listens_for(Session, 'after_commit')
+def _invalidate_pending(session):
+    for cache, key in session.info.pop('pending_invalidations', ()):
+        cache.invalidate(key)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_pending(session):
+    for name in ('pending_invalidations', 'core_writes', 'reported_tables'):
+        session.info.pop(name, None)
+
+
+# Every INSERT/UPDATE/DELETE is seen here whether it came from a flush, a
+# bulk helper or a Core statement, so the bookkeeping lives on the connection
+@event.listens_for(Engine, 'after_cursor_execute')
+def _record_written_table(conn, cursor, statement, parameters, context, executemany):
+    if context is None or context.compiled is None:
+        return
+    if context.isinsert or context.isupdate or context.isdelete:
+        table = getattr(context.compiled.statement, 'table', None)
+        if table is not None:
+            conn.info.setdefault('written_tables', set()).add(table.name)
+
+
+@event.listens_for(Engine, 'commit')
+def _invalidate_written(conn):
+    written = conn.info.pop('written_tables', None)
+    if not written:
+        return
+    for tables, cache in _dependents:
+        if tables & written:
+            cache.invalidate()
+
+
+@event.listens_for(Engine, 'rollback')
+def _discard_written(conn):
+    conn.info.pop('written_tables', None)
@@ -0,0 +1,595 @@
+"""
+Commands - Flask CLI maintenance commands
+"""
+
+import csv
+import re
+import time
+from datetime import datetime
+import click
+from sqlalchemy import event, func, inspect, literal_column, or_, text, update
+from sqlalchemy.orm import joinedload
+from cache import rows_written
+from models import (db, User, Grade, Subject, Student, Teacher, Enrollment, Calificacion, Attendance, Schedule,
+                    SEMESTERS, parse_minutes)
+from importer import RosterImport, read_roster
+from synthetic import SchoolGenerator, ADMIN_EMAIL, SYNTHETIC_DOMAIN, SYNTHETIC_PASSWORD
+from rollups import rebuild_attendance_rollups
+from timetable import (TimetableSolver, find_all_conflicts, load_problem, resource_name, save_timetable,
+                       school_periods)
+import assets
+import auth
+import benchmark
+import deletes
+import keys
+import versions
+from app import app
+
+
+@app.cli.command('import-students')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--workers', type=int, default=None, help='Password hashing processes (default: CPU count).')
+def import_students(path, workers):
+    """Import a CSV/XLSX student roster, reporting rows that could not be imported."""
+    with open(path, 'rb') as stream:
+        imported, errors = RosterImport(workers=workers).run(read_roster(path, stream))
+    for line, error in errors:
+        click.echo(f'line {line}: {error}', err=True)
+    click.echo(f'{imported} students imported, {len(errors)} rows with errors')
+
+
+def _duplicate_keys(index, limit=5):
+    """(total duplicated keys, first limit of them as (key, count)) that would break unique index."""
+    columns = list(index.columns)
+    duplicated = (
+        db.session.query(*columns, func.count().label('rows'))
+        .group_by(*columns)
+        .having(func.count() > 1)
+        .subquery()
+    )
+    total = db.session.query(func.count()).select_from(duplicated).scalar()
+    sample = db.session.query(duplicated).limit(limit).all() if total else []
+    return total, [(tuple(row[:-1]), row[-1]) for row in sample]
+
+
+@app.cli.command('create-indexes')
+def create_indexes():
+    """Create the indexes declared in models.py that an existing database is missing.
+
+    Unique indexes are checked for duplicate keys first; if any are found
+    they are listed and nothing is created.
+    """
+    engine = db.engine
+    existing = {name: {index['name'] for index in inspect(engine).get_indexes(name)}
+                for name in inspect(engine).get_table_names()}
+    missing = [index for table in db.Model.metadata.sorted_tables if table.name in existing
+               for index in table.indexes if index.name not in existing[table.name]]
+    if not missing:
+        click.echo('Every declared index already exists')
+        return
+
+    conflicts = 0
+    for index in missing:
+        if not index.unique:
+            continue
+        total, sample = _duplicate_keys(index)
+        if total:
+            conflicts += 1
+            columns = ', '.join(column.name for column in index.columns)
+            click.echo(f'{index.table.name}: {total} duplicated ({columns}) keys block {index.name}', err=True)
+            for key, count in sample:
+                click.echo(f'  {", ".join(str(value) for value in key)}: {count} rows', err=True)
+    if conflicts:
+        raise click.ClickException(f'{conflicts} unique indexes blocked by duplicate rows; '
+                                   'merge or delete the duplicates and run create-indexes again')
+
+    for index in missing:
+        index.create(bind=engine, checkfirst=True)
+        click.echo(f'{index.table.name}: {index.name}')
+
+
+def _add_missing_columns(model):
+    """ALTER TABLE ... ADD COLUMN for model columns an existing table lacks."""
+    engine = db.engine
+    existing = {column['name'] for column in inspect(engine).get_columns(model.__tablename__)}
+    compiler = engine.dialect.ddl_compiler(engine.dialect, None)
+    with engine.begin() as connection:
+        for column in model.__table__.columns:
+            if column.name not in existing:
+                spec = compiler.get_column_specification(column)
+                connection.execute(text(f'ALTER TABLE {model.__tablename__} ADD COLUMN {spec}'))
+                click.echo(f'{model.__tablename__}: added column {column.name}')
+
+
+@app.cli.command('recompute-averages')
+def recompute_averages():
+    """Backfill Enrollment.average and has_grades from the semester columns."""
+    _add_missing_columns(Enrollment)
+    for index in Enrollment.__table__.indexes:
+        index.create(bind=db.engine, checkfirst=True)
+
+    # Same arithmetic as models.semester_average(): missing semesters are 0
+    # and the divisor is always the number of semesters
+    scores = [func.coalesce(getattr(Enrollment, f'semester_{semester}'), 0) for semester in SEMESTERS]
+    result = db.session.execute(
+        update(Enrollment.__table__).values(
+            average=func.round(sum(scores[1:], scores[0]) / literal_column(f'{len(SEMESTERS)}.0'), 2),
+            has_grades=or_(*(score != 0 for score in scores))
+        )
+    )
+    rows_written(db.session, Enrollment.__tablename__,
+                 db.session.query(Enrollment.student_id, Enrollment.grade_id).distinct())
+    db.session.commit()
+    click.echo(f'{result.rowcount} enrollments recomputed')
+
+
+@app.cli.command('add-updated-at')
+def add_updated_at():
+    """Add updated_at (backfilled from created_at) and its index to the tables the API serves."""
+    now = datetime.utcnow()
+    for model in (Student, Teacher, Enrollment, Calificacion, Attendance, Schedule):
+        _add_missing_columns(model)
+        table = model.__table__
+        with db.engine.begin() as connection:
+            result = connection.execute(
+                update(table).where(table.c.updated_at.is_(None))
+                .values(updated_at=func.coalesce(table.c.created_at, now))
+            )
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
+        click.echo(f'{table.name}: {result.rowcount} rows backfilled')
+
+
+@app.cli.command('rebuild-attendance-rollups')
+def rebuild_attendance_rollups_command():
+    """Recompute attendance_summaries from the attendance table."""
+    db.create_all()
+    # Monthly counts were kept by earlier versions but never read
+    db.session.execute(text('DROP TABLE IF EXISTS attendance_monthly'))
+    rebuild_attendance_rollups()
+    db.session.commit()
+    summaries = db.session.execute(text('SELECT COUNT(*) FROM attendance_summaries')).scalar()
+    click.echo(f'{summaries} enrollment rollups')
+
+
+@app.cli.command('bump-page-versions')
+def bump_page_versions():
+    """Create data_versions if missing and make every browser refetch the student pages."""
+    db.create_all()
+    versions.bump_versions([versions.CATALOG_SCOPE])
+    db.session.commit()
+    click.echo('Student page ETags changed; run this after editing data outside the app')
+
+
+@app.cli.command('build-assets')
+def build_assets():
+    """Build the Tailwind CSS, icon and font bundle into static/dist (needs npm install)."""
+    try:
+        manifest = assets.build_assets(echo=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{len(manifest)} files written to static/dist')
+
+
+@app.cli.command('migrate-compact-keys')
+def migrate_compact_keys():
+    """Convert 36-character string keys to native UUID (PostgreSQL) or 16-byte BLOB (SQLite)."""
+    try:
+        migrated = keys.migrate_compact_keys(echo=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if not migrated:
+        click.echo('Every key column is already compact')
+        return
+    click.echo(f'{len(migrated)} tables migrated')
+    if db.engine.dialect.name == 'sqlite':
+        click.echo('Run VACUUM to return the freed pages to the filesystem')
+
+
+@app.cli.command('key-stats')
+@click.option('--repeat', default=5, show_default=True, help='Timed runs per join.')
+@click.option('--output', '-o', default=None, help='Also write the stats to this JSON file.')
+def key_stats(repeat, output):
+    """Index/table sizes and join timings for attendance and calificaciones."""
+    try:
+        stats = keys.key_stats(repeat=repeat)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    if stats['pending']:
+        click.echo(f'String keys still in: {", ".join(stats["pending"])}')
+    for name, size in sorted(stats['sizes'].items()):
+        click.echo(f'{name}: {size / 1024:.0f} KiB')
+    for name, join in stats['joins'].items():
+        click.echo(f'{name} join: {join["rows"]} rows, median {join["median_ms"]} ms')
+    if output:
+        benchmark.save(stats, output)
+
+
+@app.cli.command('migrate-cascades')
+def migrate_cascades():
+    """Recreate foreign keys created without ON DELETE CASCADE."""
+    try:
+        migrated = deletes.migrate_cascades(echo=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    click.echo(f'{len(migrated)} tables migrated' if migrated else 'Every foreign key already cascades')
+
+
+@app.cli.command('sweep-orphans')
+@click.option('--chunk-size', default=deletes.DELETE_CHUNK_SIZE, show_default=True,
+              help='Missing parent ids handled per transaction.')
+@click.option('--dry-run', is_flag=True, help='Only count the rows whose parent is gone.')
+def sweep_orphans(chunk_size, dry_run):
+    """Delete attendance, assessments, calificaciones and other rows whose parent row is gone."""
+    counts = deletes.sweep_orphans(chunk_size=chunk_size, dry_run=dry_run, echo=click.echo)
+    if dry_run:
+        for table, count in sorted(counts.items()):
+            if count:
+                click.echo(f'{table}: {count} orphaned rows')
+    click.echo(f'{sum(counts.values())} orphaned rows {"found" if dry_run else "deleted"}')
+    if counts and not dry_run and db.engine.dialect.name == 'sqlite':
+        click.echo('Run VACUUM to return the freed pages to the filesystem')
+
+
+# Indexes on schedules replaced by the (resource, day, start, end) ones
+_SUPERSEDED_SCHEDULE_INDEXES = ('ix_schedules_grade_day', 'ix_schedules_teacher_id')
+
+
+@app.cli.command('normalize-schedules')
+def normalize_schedules():
+    """Fill Schedule.start_minute/end_minute, normalize the times to HH:MM and report conflicts."""
+    _add_missing_columns(Schedule)
+    engine = db.engine
+    for index in Schedule.__table__.indexes:
+        index.create(bind=engine, checkfirst=True)
+    existing = {index['name'] for index in inspect(engine).get_indexes(Schedule.__tablename__)}
+    with engine.begin() as connection:
+        for name in _SUPERSEDED_SCHEDULE_INDEXES:
+            if name in existing:
+                connection.execute(text(f'DROP INDEX {name}'))
+                click.echo(f'schedules: dropped index {name}')
+
+    normalized = invalid = 0
+    for schedule in Schedule.query.all():
+        try:
+            schedule.refresh_minutes()
+            normalized += 1
+        except ValueError as e:
+            db.session.expire(schedule)
+            invalid += 1
+            click.echo(f'{schedule.id}: {e}', err=True)
+    db.session.commit()
+    click.echo(f'{normalized} schedules normalized, {invalid} with invalid times')
+    click.echo(f'{len(find_all_conflicts())} conflicts; run schedule-conflicts for the list')
+
+
+@app.cli.command('schedule-conflicts')
+def schedule_conflicts():
+    """List every pair of schedules that books a teacher, grade or classroom twice."""
+    schedules = Schedule.query.options(joinedload(Schedule.teacher).joinedload(Teacher.user),
+                                       joinedload(Schedule.grade_rel)).all()
+    conflicts = find_all_conflicts(schedules)
+    for column, label, first, second in conflicts:
+        click.echo(f'{label} {resource_name(column, first)}, {first.day_of_week}: {first.start_time}-{first.end_time} '
+                   f'({first.grade_rel.name}) / {second.start_time}-{second.end_time} ({second.grade_rel.name})')
+    click.echo(f'{len(conflicts)} conflicts in {len(schedules)} schedules')
+
+
+def _read_unavailability(path):
+    """{teacher id: [(day, start_minute, end_minute)]} from a teacher_code,day,start,end CSV."""
+    codes = dict(db.session.query(Teacher.teacher_code, Teacher.id))
+    unavailable = {}
+    with open(path, newline='', encoding='utf-8-sig') as source:
+        for line, row in enumerate(csv.reader(source), start=1):
+            if not row or row[0].strip().lower() == 'teacher_code':
+                continue
+            try:
+                code, day, start, end = (value.strip() for value in row)
+                teacher_id = codes[code]
+                block = (day, parse_minutes(start), parse_minutes(end))
+            except (KeyError, ValueError) as e:
+                raise click.ClickException(f'{path} línea {line}: {e}')
+            unavailable.setdefault(teacher_id, []).append(block)
+    return unavailable
+
+
+@app.cli.command('generate-timetable')
+@click.option('--grade', 'grade_names', multiple=True, help='Only regenerate this grade (repeatable).')
+@click.option('--day-start', default='08:00', show_default=True)
+@click.option('--period-minutes', default=60, show_default=True)
+@click.option('--periods', default=8, show_default=True, help='Periods per day.')
+@click.option('--break-after', default=0, show_default=True, help='Period after which the break starts.')
+@click.option('--break-minutes', default=0, show_default=True)
+@click.option('--hours', type=int, default=None, help='Periods per subject a week (default: Subject.credits).')
+@click.option('--classrooms', default=None,
+              help='Comma-separated classroom pool (default: each grade keeps its usual classroom).')
+@click.option('--unavailable', type=click.Path(exists=True, dir_okay=False),
+              help='CSV of teacher_code,day,start,end blocks when a teacher cannot teach.')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--time-limit', default=30.0, show_default=True, help='Seconds to search before giving up.')
+@click.option('--dry-run', is_flag=True, help='Solve and report without replacing any schedule.')
+def generate_timetable(grade_names, day_start, period_minutes, periods, break_after, break_minutes, hours, classrooms,
+                       unavailable, seed, time_limit, dry_run):
+    """Replace the weekly schedules with a generated timetable without conflicts."""
+    grade_ids = None
+    if grade_names:
+        grades = dict(db.session.query(Grade.name, Grade.id).filter(Grade.name.in_(grade_names)))
+        unknown = sorted(set(grade_names) - set(grades))
+        if unknown:
+            raise click.ClickException(f'Grados no encontrados: {", ".join(unknown)}')
+        grade_ids = list(grades.values())
+    try:
+        day_periods = school_periods(parse_minutes(day_start), period_minutes, periods, break_after, break_minutes)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+
+    problem, missing = load_problem(grade_ids, lessons=hours)
+    for grade_name, subject_name in missing:
+        click.echo(f'{grade_name}: no active teacher is qualified for {subject_name}', err=True)
+    if not problem['courses']:
+        raise click.ClickException('No enrollments to build a timetable from.')
+    rooms = [room.strip() for room in classrooms.split(',') if room.strip()] if classrooms else None
+    solver = TimetableSolver(periods=day_periods, rooms=rooms, seed=seed, time_limit=time_limit,
+                             unavailable=_read_unavailability(unavailable) if unavailable else None, **problem)
+    solution = solver.solve()
+    conflicts = find_all_conflicts(solution.lessons + problem['fixed'])
+    click.echo(f'{len(solution.lessons)} lessons placed, {len(solution.unplaced)} unplaced, '
+               f'{len(conflicts)} conflicts in {solution.seconds:.2f}s')
+    if solution.unplaced:
+        grades = dict(db.session.query(Grade.id, Grade.name))
+        subjects = dict(db.session.query(Subject.id, Subject.name))
+        teachers = dict(db.session.query(Teacher.id, Teacher.teacher_code))
+        for course in sorted(set(solution.unplaced)):
+            click.echo(f'unplaced: {grades[course.grade_id]}, {subjects[course.subject_id]} '
+                       f'({teachers[course.teacher_id]}), {solution.unplaced.count(course)} lessons', err=True)
+    if solution.unplaced or conflicts:
+        raise click.ClickException('The timetable is incomplete; nothing was saved.')
+    if not dry_run:
+        regenerated = {course.grade_id for course in problem['courses']}
+        click.echo(f'{save_timetable(regenerated, solution.lessons)} schedules saved')
+
+
+@app.cli.command('bench-timetable')
+@click.option('--sizes', default='10,30,60,120,240', show_default=True, help='Comma-separated school sizes in grades.')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--time-limit', default=30.0, show_default=True)
+@click.option('--output', '-o', default=None, help='Also write the results to this JSON file.')
+def bench_timetable(sizes, seed, time_limit, output):
+    """Time the timetable generator on synthetic schools of increasing size."""
+    results = benchmark.timetable_benchmark([int(size) for size in sizes.split(',')], seed=seed,
+                                            time_limit=time_limit, echo=click.echo)
+    if output:
+        benchmark.save(results, output)
+
+
+@app.cli.command('bench-login')
+@click.option('--count', default=200, show_default=True, help='Login attempts in the burst.')
+@click.option('--concurrency', default=32, show_default=True, help='Attempts in flight at once.')
+@click.option('--hash-workers', type=int, default=None,
+              help='Override LOGIN_HASH_WORKERS for this run (0 hashes on the request thread).')
+@click.option('--output', '-o', default=None, help='Also write the summary to this JSON file.')
+def bench_login(count, concurrency, hash_workers, output):
+    """Burst-login synthetic students (see generate-school) and report throughput and p99."""
+    if hash_workers is not None:
+        auth.configure_hash_pool(hash_workers)
+    students = [email for (email,) in db.session.query(User.email)
+                .filter(User.role == 'student', User.email.like(f'%@{SYNTHETIC_DOMAIN}'))
+                .order_by(User.email).limit(count)]
+    db.session.remove()
+    if not students:
+        raise click.ClickException('No synthetic students found; run generate-school first.')
+
+    credentials = [(students[i % len(students)], SYNTHETIC_PASSWORD) for i in range(count)]
+    results = benchmark.login_burst(credentials, concurrency)
+    results.update(hash_workers=auth.hash_pool.workers, hash_method=auth.password_hash_method())
+    latency = results['latency_ms']
+    click.echo(f'{results["succeeded"]}/{results["attempts"]} logins in {results["seconds"]}s '
+               f'({results["logins_per_second"]}/s), {results["rejected_busy"]} busy, {results["failed"]} failed; '
+               f'p50 {latency["p50"]} ms, p99 {latency["p99"]} ms')
+    if output:
+        benchmark.save(results, output)
+
+
+# Plan lines that mean "read the whole table"
+_SEQ_SCAN_PATTERNS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (?:TABLE )?(\w+)'),
+}
+
+
+def _table_sizes():
+    sizes = {}
+    for table in db.Model.metadata.sorted_tables:
+        sizes[table.name] = db.session.execute(text(f'SELECT COUNT(*) FROM {table.name}')).scalar()
+    return sizes
+
+
+def _explain(connection, dialect, statement, parameters):
+    """Return the plan lines for one captured statement."""
+    prefix = 'EXPLAIN QUERY PLAN ' if dialect == 'sqlite' else 'EXPLAIN '
+    rows = connection.exec_driver_sql(prefix + statement, parameters).fetchall()
+    if dialect == 'sqlite':
+        # (id, parent, notused, detail)
+        return [row[-1] for row in rows]
+    return [row[0] for row in rows]
+
+
+def _capture_route_statements():
+    """Drive every argument-free GET route as one admin, teacher and student.
+
+    Returns {endpoint: [(statement, parameters), ...]} with distinct statements.
+    """
+    users = []
+    for role in ('admin', 'teacher', 'student'):
+        user = User.query.filter_by(role=role).first()
+        if user:
+            users.append(user.id)
+    db.session.remove()
+
+    endpoints = []
+    for rule in app.url_map.iter_rules():
+        if 'GET' in rule.methods and not rule.arguments and rule.endpoint not in ('static', 'logout'):
+            endpoints.append((rule.endpoint, rule.rule))
+
+    captured = {}
+    current = {'endpoint': None}
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current['endpoint'] and not executemany:
+            statements = captured.setdefault(current['endpoint'], [])
+            if all(statement != s for s, _ in statements):
+                statements.append((statement, parameters))
+
+    engine = db.engine
+    event.listen(engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        for user_id in users:
+            client = benchmark.logged_in_client(user_id)
+            for endpoint, url in endpoints:
+                current['endpoint'] = endpoint
+                try:
+                    # A fresh app context per request, so nothing is served
+                    # from the previous request's session or g
+                    with app.app_context():
+                        client.get(url)
+                except Exception as e:
+                    click.echo(f'{endpoint}: request failed ({e})', err=True)
+                current['endpoint'] = None
+    finally:
+        event.remove(engine, 'before_cursor_execute', before_cursor_execute)
+    return captured
+
+
+@app.cli.command('index-advisor')
+@click.option('--min-rows', default=1000, show_default=True,
+              help='Only flag sequential scans on tables with at least this many rows.')
+def index_advisor(min_rows):
+    """EXPLAIN the queries issued by each route and flag sequential scans on large tables."""
+    dialect = db.engine.dialect.name
+    pattern = _SEQ_SCAN_PATTERNS.get(dialect)
+    if pattern is None:
+        raise click.ClickException(f'Unsupported database dialect: {dialect}')
+
+    sizes = _table_sizes()
+    captured = _capture_route_statements()
+
+    flagged = 0
+    with db.engine.connect() as connection:
+        for endpoint in sorted(captured):
+            findings = []
+            for statement, parameters in captured[endpoint]:
+                try:
+                    plan = _explain(connection, dialect, statement, parameters)
+                except Exception as e:
+                    click.echo(f'{endpoint}: could not EXPLAIN ({e})', err=True)
+                    continue
+                for line in plan:
+                    match = pattern.search(line)
+                    if not match:
+                        continue
+                    # SQLAlchemy aliases tables as <name>_1, <name>_2, ...
+                    table = re.sub(r'_\d+$', '', match.group(1))
+                    rows = sizes.get(table)
+                    if rows is not None and rows >= min_rows:
+                        findings.append((table, rows, line.strip(), statement))
+
+            click.echo(f'{endpoint}: {len(captured[endpoint])} statements, {len(findings)} sequential scans')
+            for table, rows, line, statement in findings:
+                flagged += 1
+                click.echo(f'  {table} ({rows} rows): {line}')
+                click.echo(f'    {" ".join(statement.split())[:200]}')
+
+    click.echo(f'{flagged} sequential scans on tables with >= {min_rows} rows')
+
+
+@app.cli.command('generate-school')
+@click.option('--grades', default=60, show_default=True)
+@click.option('--students', default=30000, show_default=True)
+@click.option('--teachers', default=200, show_default=True)
+@click.option('--subjects', default=12, show_default=True)
+@click.option('--subjects-per-student', default=6, show_default=True)
+@click.option('--attendance', default=500000, show_default=True, help='Attendance rows to create.')
+@click.option('--calificaciones', default=200000, show_default=True, help='Calificaciones rows to create.')
+@click.option('--seed', default=1, show_default=True)
+@click.option('--reset', is_flag=True, help='Drop and recreate every table first.')
+def generate_school(grades, students, teachers, subjects, subjects_per_student, attendance, calificaciones, seed, reset):
+    """Fill the database with a synthetic school for benchmarking."""
+    if reset:
+        db.drop_all()
+    db.create_all()
+    if not reset and User.query.first() is not None:
+        raise click.ClickException('The database is not empty; use --reset to replace its contents.')
+
+    start = time.perf_counter()
+    try:
+        generator = SchoolGenerator(grades=grades, students=students, teachers=teachers, subjects=subjects,
+                                    subjects_per_student=subjects_per_student, attendance=attendance,
+                                    calificaciones=calificaciones, seed=seed, echo=click.echo)
+    except ValueError as e:
+        raise click.ClickException(str(e))
+    counts = generator.run()
+    click.echo(f'{sum(counts.values())} rows in {time.perf_counter() - start:.1f}s; '
+               f'log in as {ADMIN_EMAIL} / {SYNTHETIC_PASSWORD}')
+
+
+@app.cli.command('bench-routes')
+@click.option('--output', '-o', default='bench-results.json', show_default=True, help='JSON results file.')
+@click.option('--iterations', default=20, show_default=True, help='Timed requests per route.')
+@click.option('--warmup', default=2, show_default=True, help='Untimed requests per route first.')
+@click.option('--endpoint', 'endpoints', multiple=True, help='Only benchmark this endpoint (repeatable).')
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False),
+              help='Earlier results file to compare against.')
+@click.option('--threshold', default=0.2, show_default=True,
+              help='Latency growth (fraction) that counts as a regression.')
+def bench_routes(output, iterations, warmup, endpoints, baseline, threshold):
+    """Benchmark every GET route: latency percentiles, query counts and peak memory."""
+    suite = benchmark.RouteBenchmark(iterations=iterations, warmup=warmup, endpoints=endpoints)
+    results = suite.run(echo=click.echo)
+    benchmark.save(results, output)
+    for skipped in results['skipped']:
+        click.echo(f'skipped {skipped["endpoint"]}: {skipped["reason"]}', err=True)
+    click.echo(f'{len(results["routes"])} routes written to {output}')
+
+    if baseline:
+        regressions = 0
+        for endpoint, metric, before, after, regressed in benchmark.compare(benchmark.load(baseline), results, threshold):
+            if regressed:
+                regressions += 1
+                click.echo(f'REGRESSION {endpoint} {metric}: {before} -> {after}')
+        if regressions:
+            raise click.ClickException(f'{regressions} regressions against {baseline}')
+        click.echo(f'No regressions against {baseline}')
+
+
+# Migrations of a database created by an earlier version, in the order they
+# must run: later steps read the compact keys, columns and indexes the
+# earlier ones add. Each step skips work already done.
+UPGRADE_STEPS = (
+    migrate_compact_keys,
+    migrate_cascades,
+    normalize_schedules,
+    add_updated_at,
+    recompute_averages,
+    create_indexes,
+    rebuild_attendance_rollups_command,
+    bump_page_versions,
+)
+
+
+@app.cli.command('upgrade')
+@click.pass_context
+def upgrade(ctx):
+    """Bring an existing database up to date by running every migration command in order.
+
+    Safe to run again. The app refuses to serve a database with string keys
+    until this (or at least migrate-compact-keys) has run.
+    """
+    for step in UPGRADE_STEPS:
+        click.echo(f'== {step.name}')
+        ctx.invoke(step)
+        # Tables may have been rebuilt underneath the session's identity map
+        db.session.remove()
+        if step is migrate_compact_keys:
+            # Tables added since (data_versions, attendance_summaries...) reference the converted keys
+            db.create_all()
+    click.echo('Database upgraded')
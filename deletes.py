@@ -0,0 +1,210 @@
+"""
+Deletes - Set-based cascading deletes, chunked for large parents, and the orphan sweeper
+"""
+
+import os
+from collections import Counter
+from sqlalchemy import exists, func, inspect, or_, select
+from sqlalchemy.schema import AddConstraint
+from cache import dependent_columns, rows_written
+from keys import pending_tables, rebuild_sqlite_tables
+from models import db, User, Student, Teacher, Grade, Subject, Enrollment
+
+# Parent rows deleted, with everything under them, per transaction
+DELETE_CHUNK_SIZE = int(os.getenv('DELETE_CHUNK_SIZE', 100))
+
+
+def _cascades(table):
+    """(child table, foreign key column, referenced column) for each ON DELETE CASCADE pointing at table."""
+    return [(child, fk.parent, fk.column)
+            for child in db.Model.metadata.sorted_tables
+            for fk in child.foreign_keys
+            if fk.column.table is table and fk.ondelete == 'CASCADE']
+
+
+def _delete_tree(table, condition, counts):
+    """Delete the rows of table matching condition after everything that cascades from them.
+
+    One DELETE ... WHERE fk IN (...) per table, children first, so this
+    works the same whether or not the database's foreign keys were created
+    with ON DELETE CASCADE. The parent keys are read once per level: the
+    children are then matched through their foreign key indexes, and a
+    branch with no parent rows costs no further queries.
+    """
+    cascades = _cascades(table)
+    if cascades:
+        keys = {referenced: db.session.execute(select(referenced).where(condition)).scalars().all()
+                for referenced in {referenced for _, _, referenced in cascades}}
+        if not any(keys.values()):
+            return
+        for child, column, referenced in cascades:
+            _delete_tree(child, column.in_(keys[referenced]), counts)
+    columns = dependent_columns(table.name)
+    if columns:
+        # Core deletes bypass the flush hooks, so report the cache keys here
+        rows = db.session.execute(select(*(table.c[name] for name in columns)).where(condition))
+        rows_written(db.session, table.name, [dict(row._mapping) for row in rows])
+    counts[table.name] += db.session.execute(table.delete().where(condition)).rowcount
+
+
+def delete_rows(model, condition):
+    """Delete model rows matching condition and everything under them, in the current transaction.
+
+    Returns a Counter of rows deleted per table; the caller commits.
+    """
+    counts = Counter()
+    _delete_tree(model.__table__, condition, counts)
+    return counts
+
+
+def delete_in_chunks(model, condition, chunk_size=DELETE_CHUNK_SIZE, after_chunk=None):
+    """delete_rows() chunk_size parent rows at a time, committing after each chunk.
+
+    Every transaction stays short, so deleting a large grade never holds
+    its locks for long. An interrupted run leaves whole chunks deleted and
+    can simply be repeated. after_chunk(ids) runs after each commit.
+    """
+    table = model.__table__
+    counts = Counter()
+    while True:
+        ids = db.session.execute(select(table.c.id).where(condition).limit(chunk_size)).scalars().all()
+        if not ids:
+            return counts
+        counts.update(delete_rows(model, table.c.id.in_(ids)))
+        db.session.commit()
+        if after_chunk:
+            after_chunk(ids)
+
+
+def delete_student(student):
+    """Delete a student, their user account and everything under them."""
+    counts = delete_rows(User, User.id == student.user_id)
+    # Also covers a student whose user row is already gone
+    counts.update(delete_rows(Student, Student.id == student.id))
+    db.session.commit()
+    return counts
+
+
+def delete_teacher(teacher):
+    """Delete a teacher and their user account; their enrollments go in chunks first."""
+    counts = delete_in_chunks(Enrollment, Enrollment.teacher_id == teacher.id)
+    counts.update(delete_rows(User, User.id == teacher.user_id))
+    counts.update(delete_rows(Teacher, Teacher.id == teacher.id))
+    db.session.commit()
+    return counts
+
+
+def delete_grade(grade, after_chunk=None):
+    """Delete a grade with its students (and their user accounts), in chunks.
+
+    after_chunk(user_ids) runs after each chunk of student accounts is committed.
+    """
+    student_users = User.id.in_(select(Student.user_id).where(Student.grade_id == grade.id))
+    counts = delete_in_chunks(User, student_users, after_chunk=after_chunk)
+    counts.update(delete_in_chunks(Enrollment, Enrollment.grade_id == grade.id))
+    counts.update(delete_rows(Grade, Grade.id == grade.id))
+    db.session.commit()
+    return counts
+
+
+def delete_subject(subject):
+    """Delete a subject; its enrollments, and their grades and attendance, go in chunks first."""
+    counts = delete_in_chunks(Enrollment, Enrollment.subject_id == subject.id)
+    counts.update(delete_rows(Subject, Subject.id == subject.id))
+    db.session.commit()
+    return counts
+
+
+def delete_enrollment(enrollment):
+    """Delete one enrollment with its attendance, assessments, calificaciones and rollups."""
+    counts = delete_rows(Enrollment, Enrollment.id == enrollment.id)
+    db.session.commit()
+    return counts
+
+
+def _orphaned(table):
+    """[(foreign key column, condition)] matching rows of table whose parent row is gone."""
+    return [(fk.parent, fk.parent.isnot(None) & ~exists().where(fk.column == fk.parent))
+            for fk in table.foreign_keys if fk.ondelete == 'CASCADE']
+
+
+def sweep_orphans(chunk_size=DELETE_CHUNK_SIZE, dry_run=False, echo=None):
+    """Delete rows whose parent row no longer exists, with everything under them.
+
+    Tables are visited parents first, so an orphaned enrollment takes its
+    attendance, assessments and calificaciones with it. Each chunk of
+    missing parent ids is its own transaction. With dry_run nothing is
+    deleted and only the directly orphaned rows are counted. Returns a
+    Counter of rows per table.
+    """
+    echo = echo or (lambda message: None)
+    counts = Counter()
+    for table in db.Model.metadata.sorted_tables:
+        orphaned = _orphaned(table)
+        if not orphaned:
+            continue
+        if dry_run:
+            conditions = [condition for _, condition in orphaned]
+            counts[table.name] = db.session.execute(
+                select(func.count()).select_from(table).where(or_(*conditions))
+            ).scalar()
+            continue
+        for column, condition in orphaned:
+            while True:
+                missing = db.session.execute(select(column).where(condition).distinct().limit(chunk_size)).scalars().all()
+                if not missing:
+                    break
+                _delete_tree(table, column.in_(missing), counts)
+                db.session.commit()
+        if counts[table.name]:
+            echo(f'{table.name}: {counts[table.name]} orphaned rows deleted')
+    return +counts
+
+
+def pending_cascades():
+    """{table: [(constraint, reflected name)]} for foreign keys the database defines without the model's ON DELETE rule."""
+    inspector = inspect(db.engine)
+    existing = set(inspector.get_table_names())
+    pending = {}
+    for table in db.Model.metadata.sorted_tables:
+        if table.name not in existing:
+            continue
+        reflected = {tuple(fk['constrained_columns']): fk for fk in inspector.get_foreign_keys(table.name)}
+        for constraint in table.foreign_key_constraints:
+            if not constraint.ondelete:
+                continue
+            fk = reflected.get(tuple(constraint.column_keys))
+            ondelete = ((fk or {}).get('options') or {}).get('ondelete') or ''
+            if ondelete.upper() != constraint.ondelete.upper():
+                pending.setdefault(table, []).append((constraint, fk and fk['name']))
+    return pending
+
+
+def migrate_cascades(echo=None):
+    """Recreate foreign keys that lack ON DELETE CASCADE; returns the tables changed.
+
+    SQLite tables are rebuilt from the models (keys.rebuild_sqlite_tables);
+    PostgreSQL constraints are dropped and added again. Either way it is
+    one transaction and safe to run again.
+    """
+    echo = echo or (lambda message: None)
+    if pending_tables():
+        # Rebuilding only some tables would mix string and compact keys
+        raise ValueError('Run migrate-compact-keys first')
+    pending = pending_cascades()
+    if not pending:
+        return []
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        rebuild_sqlite_tables(list(pending), echo)
+    elif dialect == 'postgresql':
+        with db.engine.begin() as connection:
+            for table, constraints in pending.items():
+                for constraint, name in constraints:
+                    if name:
+                        connection.exec_driver_sql(f'ALTER TABLE "{table.name}" DROP CONSTRAINT "{name}"')
+                    connection.execute(AddConstraint(constraint))
+                echo(f'{table.name}: {len(constraints)} foreign keys now cascade')
+    else:
+        raise ValueError(f'Unsupported database dialect: {dialect}')
+    return [table.name for table in pending]
@@ -0,0 +1,133 @@
+"""
+Exports - Streaming CSV/XLSX exports of grades, attendance and rosters
+"""
+
+import csv
+import io
+import tempfile
+from sqlalchemy.orm import aliased
+from models import db, User, Student, Teacher, Grade, Subject, Enrollment, Attendance
+
+# Rows fetched per round trip from the server-side cursor
+EXPORT_BATCH_SIZE = 1000
+# Bytes per chunk when streaming a finished XLSX file
+XLSX_CHUNK_SIZE = 64 * 1024
+
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+
+
+def grades_rows(grade_id=None, subject_id=None):
+    """Yield the header and one row per enrollment with its semester grades."""
+    student_user = aliased(User)
+    teacher_user = aliased(User)
+    query = (
+        db.session.query(
+            Grade.name, Student.student_code, Student.apellido_paterno, Student.apellido_materno,
+            student_user.name, teacher_user.name, Subject.name,
+            Enrollment.semester_1, Enrollment.semester_2, Enrollment.semester_3, Enrollment.average
+        )
+        .select_from(Enrollment)
+        .join(Grade, Enrollment.grade_id == Grade.id)
+        .join(Student, Enrollment.student_id == Student.id)
+        .join(student_user, Student.user_id == student_user.id)
+        .join(Teacher, Enrollment.teacher_id == Teacher.id)
+        .join(teacher_user, Teacher.user_id == teacher_user.id)
+        .join(Subject, Enrollment.subject_id == Subject.id)
+    )
+    if grade_id:
+        query = query.filter(Enrollment.grade_id == grade_id)
+    if subject_id:
+        query = query.filter(Enrollment.subject_id == subject_id)
+
+    yield ('Grado', 'Código', 'Apellido Paterno', 'Apellido Materno', 'Estudiante', 'Profesor', 'Materia',
+           '1er Semestre', '2do Semestre', '3er Semestre', 'Promedio')
+    for row in query.order_by(Grade.level, Student.apellido_paterno, Enrollment.id).yield_per(EXPORT_BATCH_SIZE):
+        yield tuple(row)
+
+
+def attendance_rows(start=None, end=None, grade_id=None):
+    """Yield the header and one row per attendance record in the date range."""
+    student_user = aliased(User)
+    teacher_user = aliased(User)
+    query = (
+        db.session.query(
+            Attendance.attendance_date, Grade.name, Student.student_code, Student.apellido_paterno,
+            Student.apellido_materno, student_user.name, Subject.name, teacher_user.name,
+            Attendance.status, Attendance.notes
+        )
+        .select_from(Attendance)
+        .join(Enrollment, Attendance.enrollment_id == Enrollment.id)
+        .join(Grade, Enrollment.grade_id == Grade.id)
+        .join(Student, Enrollment.student_id == Student.id)
+        .join(student_user, Student.user_id == student_user.id)
+        .join(Teacher, Enrollment.teacher_id == Teacher.id)
+        .join(teacher_user, Teacher.user_id == teacher_user.id)
+        .join(Subject, Enrollment.subject_id == Subject.id)
+    )
+    if start:
+        query = query.filter(Attendance.attendance_date >= start)
+    if end:
+        query = query.filter(Attendance.attendance_date <= end)
+    if grade_id:
+        query = query.filter(Enrollment.grade_id == grade_id)
+
+    yield ('Fecha', 'Grado', 'Código', 'Apellido Paterno', 'Apellido Materno', 'Estudiante', 'Materia',
+           'Profesor', 'Estado', 'Notas')
+    for row in query.order_by(Attendance.attendance_date, Attendance.id).yield_per(EXPORT_BATCH_SIZE):
+        yield tuple(row)
+
+
+def roster_rows(grade_id=None):
+    """Yield the header and one row per student."""
+    query = (
+        db.session.query(
+            Grade.name, Student.student_code, Student.apellido_paterno, Student.apellido_materno,
+            User.name, User.email, Student.status
+        )
+        .select_from(Student)
+        .join(Grade, Student.grade_id == Grade.id)
+        .join(User, Student.user_id == User.id)
+    )
+    if grade_id:
+        query = query.filter(Student.grade_id == grade_id)
+
+    yield ('Grado', 'Código', 'Apellido Paterno', 'Apellido Materno', 'Nombre', 'Email', 'Estado')
+    for row in query.order_by(Grade.level, Student.apellido_paterno, Student.id).yield_per(EXPORT_BATCH_SIZE):
+        yield tuple(row)
+
+
+def stream_csv(rows):
+    """Encode rows as CSV, yielding one chunk per EXPORT_BATCH_SIZE rows."""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so spreadsheet programs detect UTF-8
+    yield '\ufeff'
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+
+def stream_xlsx(rows):
+    """Write rows to a write-only workbook on disk, then stream the file."""
+    from openpyxl import Workbook
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in rows:
+        sheet.append([float(value) if hasattr(value, 'as_tuple') else value for value in row])
+
+    with tempfile.TemporaryFile() as output:
+        workbook.save(output)
+        output.seek(0)
+        while True:
+            chunk = output.read(XLSX_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
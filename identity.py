@@ -0,0 +1,115 @@
+"""
+Identity - Cached user identities for the Flask-Login user_loader
+"""
+
+import hashlib
+import os
+from flask import g, session
+from flask_login import UserMixin, current_user
+from sqlalchemy.orm import joinedload
+from cache import TTLCache
+from models import db, User, Teacher, Student
+
+# Longest a change made by someone else (an admin resetting a password,
+# deleting the user) through another worker goes unnoticed by this one
+USER_IDENTITY_TTL = int(os.getenv('USER_IDENTITY_TTL', 30))
+USER_IDENTITY_MAX_ENTRIES = int(os.getenv('USER_IDENTITY_MAX_ENTRIES', 10000))
+user_identities = TTLCache(ttl=USER_IDENTITY_TTL, max_entries=USER_IDENTITY_MAX_ENTRIES)
+
+# Stamp of the identity the session last saw; each worker compares its
+# cached entry against it, so a change the user made through another
+# worker is noticed on their next request without asking the database
+SESSION_STAMP_KEY = '_identity_stamp'
+
+
+def identity_stamp(user_id, email, name, role, password):
+    """Short digest that changes whenever any identity field or the password changes."""
+    raw = '\0'.join(str(value) for value in (user_id, email, name, role, password))
+    return hashlib.sha1(raw.encode('utf-8')).hexdigest()[:16]
+
+
+class Identity(UserMixin):
+    """Read-only snapshot of a users row, used as current_user.
+
+    profile_id is the id of the Teacher or Student row matching the role
+    (None for admins or users without one). Routes that change the
+    account must load the User row itself.
+    """
+
+    def __init__(self, id, email, name, role, stamp, profile_id=None):
+        self.id = id
+        self.email = email
+        self.name = name
+        self.role = role
+        self.stamp = stamp
+        self.profile_id = profile_id
+
+
+def _fetch(user_id):
+    row = (
+        db.session.query(User.id, User.email, User.name, User.role, User.password,
+                         Teacher.id.label('teacher_id'), Student.id.label('student_id'))
+        .outerjoin(Teacher, Teacher.user_id == User.id)
+        .outerjoin(Student, Student.user_id == User.id)
+        .filter(User.id == user_id)
+        .first()
+    )
+    if row is None:
+        return None
+    profile_id = {'teacher': row.teacher_id, 'student': row.student_id}.get(row.role)
+    return Identity(row.id, row.email, row.name, row.role, identity_stamp(*row[:5]), profile_id)
+
+
+def load_identity(user_id):
+    """Return the cached Identity for user_id, reloading it when missing or stale.
+
+    A cached entry is used without touching the database while it matches
+    the session's stamp; it is refetched when the stamp differs (the user
+    changed their account through another worker) and once its
+    USER_IDENTITY_TTL runs out (anyone else changed it).
+    """
+    stamp = session.get(SESSION_STAMP_KEY)
+    identity = user_identities.get(user_id)
+    if identity is None or (stamp is not None and identity.stamp != stamp):
+        identity = _fetch(user_id)
+        if identity is None:
+            user_identities.invalidate(user_id)
+            return None
+        user_identities.set(user_id, identity)
+    if stamp != identity.stamp:
+        session[SESSION_STAMP_KEY] = identity.stamp
+    return identity
+
+
+def remember_identity(user):
+    """Cache user's identity and stamp the session with it (after login or a profile change)."""
+    identity = _fetch(user.id)
+    user_identities.set(user.id, identity)
+    session[SESSION_STAMP_KEY] = identity.stamp
+    return identity
+
+
+def forget_identity(*user_ids):
+    """Drop cached identities after their users rows change or are deleted."""
+    for user_id in user_ids:
+        user_identities.invalidate(user_id)
+
+
+def current_profile():
+    """The current user's Teacher or Student row, loaded once per request.
+
+    The row comes with its user (and a student's grade) joined in and is
+    kept on g.profile for the rest of the request.
+    """
+    if 'profile' not in g:
+        profile = None
+        if current_user.is_authenticated and current_user.profile_id:
+            if current_user.role == 'teacher':
+                profile = Teacher.query.options(joinedload(Teacher.user)).get(current_user.profile_id)
+            elif current_user.role == 'student':
+                profile = (
+                    Student.query.options(joinedload(Student.user), joinedload(Student.grade))
+                    .get(current_user.profile_id)
+                )
+        g.profile = profile
+    return g.profile
@@ -0,0 +1,190 @@
+"""
+Keys - Migration of 36-character string keys to compact UUID storage
+"""
+
+import statistics
+import time
+from sqlalchemy import String, column, inspect, select, table, text
+from models import db, CompactUUID
+
+# Rows copied per executemany while rewriting a SQLite table
+COPY_CHUNK_SIZE = 5000
+
+# Joins timed by key_stats(): the two largest tables against their parents
+JOIN_QUERIES = {
+    'attendance': (
+        'SELECT COUNT(*), COUNT(s.id) FROM attendance a '
+        'JOIN enrollments e ON e.id = a.enrollment_id '
+        'JOIN students s ON s.id = e.student_id'
+    ),
+    'calificaciones': (
+        'SELECT COUNT(*), COUNT(t.id) FROM calificaciones c '
+        'JOIN enrollments e ON e.id = c.enrollment_id '
+        'JOIN students s ON s.id = c.student_id '
+        'JOIN teachers t ON t.id = c.teacher_id'
+    ),
+}
+
+
+def _key_columns(model_table):
+    return [c for c in model_table.columns if isinstance(c.type, CompactUUID)]
+
+
+def pending_tables():
+    """Tables whose key columns are still stored as strings in the database."""
+    inspector = inspect(db.engine)
+    existing = set(inspector.get_table_names())
+    pending = []
+    for model_table in db.Model.metadata.sorted_tables:
+        if model_table.name not in existing:
+            continue
+        stored = {c['name']: c['type'] for c in inspector.get_columns(model_table.name)}
+        if any(isinstance(stored.get(c.name), String) for c in _key_columns(model_table)):
+            pending.append(model_table)
+    return pending
+
+
+def require_compact_keys():
+    """Raise RuntimeError when the database still stores string keys.
+
+    CompactUUID cannot read those rows (the first query fails with a
+    TypeError deep in the driver), so the app refuses to serve until
+    flask upgrade has converted them.
+    """
+    pending = pending_tables()
+    if pending:
+        raise RuntimeError(f'String keys still in {", ".join(t.name for t in pending)}; '
+                           'run flask upgrade before starting the app')
+
+
+def _copy_rows(connection, old_name, model_table):
+    """Copy every row of old_name into model_table; CompactUUID converts string keys on bind."""
+    stored = {c['name']: c['type'] for c in inspect(connection).get_columns(old_name)}
+    # Read string keys as the strings they are today and everything else
+    # with its model type; columns the old table lacks get their defaults
+    source = table(old_name, *(column(c.name, String() if isinstance(stored[c.name], String) else c.type)
+                               for c in model_table.columns if c.name in stored))
+    result = connection.execute(select(*source.columns))
+    copied = 0
+    while True:
+        rows = result.fetchmany(COPY_CHUNK_SIZE)
+        if not rows:
+            break
+        connection.execute(model_table.insert(), [dict(row._mapping) for row in rows])
+        copied += len(rows)
+    return copied
+
+
+def rebuild_sqlite_tables(tables, echo):
+    """Recreate each table from its model definition, keeping its rows, in one transaction.
+
+    SQLite cannot change a column type or a constraint in place, so each
+    table is renamed aside, recreated from the model (with its indexes)
+    and refilled. With legacy_alter_table on, the rename leaves other
+    tables' REFERENCES pointing at the original name, which the new table
+    takes over.
+    """
+    with db.engine.connect() as connection:
+        foreign_keys = connection.exec_driver_sql('PRAGMA foreign_keys').scalar()
+        connection.exec_driver_sql('PRAGMA foreign_keys=OFF')
+        connection.exec_driver_sql('PRAGMA legacy_alter_table=ON')
+        try:
+            with connection.begin():
+                for model_table in tables:
+                    old_name = f'{model_table.name}_string_keys'
+                    for index in inspect(connection).get_indexes(model_table.name):
+                        connection.exec_driver_sql(f'DROP INDEX "{index["name"]}"')
+                    connection.exec_driver_sql(f'ALTER TABLE "{model_table.name}" RENAME TO "{old_name}"')
+                    model_table.create(bind=connection)
+                    copied = _copy_rows(connection, old_name, model_table)
+                    connection.exec_driver_sql(f'DROP TABLE "{old_name}"')
+                    echo(f'{model_table.name}: {copied} rows rewritten')
+        finally:
+            connection.exec_driver_sql('PRAGMA legacy_alter_table=OFF')
+            connection.exec_driver_sql(f'PRAGMA foreign_keys={"ON" if foreign_keys else "OFF"}')
+
+
+def _migrate_postgresql(tables, echo):
+    """ALTER the key columns to uuid in one transaction, with the foreign keys dropped meanwhile."""
+    names = {model_table.name for model_table in tables}
+    with db.engine.begin() as connection:
+        inspector = inspect(connection)
+        foreign_keys = [(name, fk) for name in inspector.get_table_names()
+                        for fk in inspector.get_foreign_keys(name) if fk['referred_table'] in names or name in names]
+        for name, fk in foreign_keys:
+            connection.exec_driver_sql(f'ALTER TABLE "{name}" DROP CONSTRAINT "{fk["name"]}"')
+        for model_table in tables:
+            alterations = ', '.join(
+                f'ALTER COLUMN "{c.name}" TYPE uuid USING NULLIF("{c.name}", \'\')::uuid'
+                for c in _key_columns(model_table)
+            )
+            connection.exec_driver_sql(f'ALTER TABLE "{model_table.name}" {alterations}')
+            echo(f'{model_table.name}: key columns converted')
+        for name, fk in foreign_keys:
+            columns = ', '.join(f'"{c}"' for c in fk['constrained_columns'])
+            referred = ', '.join(f'"{c}"' for c in fk['referred_columns'])
+            ondelete = (fk.get('options') or {}).get('ondelete')
+            connection.exec_driver_sql(
+                f'ALTER TABLE "{name}" ADD CONSTRAINT "{fk["name"]}" FOREIGN KEY ({columns}) '
+                f'REFERENCES "{fk["referred_table"]}" ({referred})' + (f' ON DELETE {ondelete}' if ondelete else '')
+            )
+
+
+def migrate_compact_keys(echo=None):
+    """Convert string key columns to CompactUUID storage; returns the tables migrated.
+
+    Safe to run again: tables already converted are skipped. Each run is
+    one transaction, so a failure leaves the database as it was.
+    """
+    echo = echo or (lambda message: None)
+    tables = pending_tables()
+    if not tables:
+        return []
+    dialect = db.engine.dialect.name
+    if dialect == 'sqlite':
+        rebuild_sqlite_tables(tables, echo)
+    elif dialect == 'postgresql':
+        _migrate_postgresql(tables, echo)
+    else:
+        raise ValueError(f'Unsupported database dialect: {dialect}')
+    return [model_table.name for model_table in tables]
+
+
+def _relation_sizes(connection, dialect, table_names):
+    """{table or index name: bytes} for the given tables and their indexes."""
+    if dialect == 'sqlite':
+        # Needs SQLite built with the dbstat virtual table (the default for Python's sqlite3)
+        rows = connection.execute(text(
+            'SELECT d.name, SUM(d.pgsize) FROM dbstat d JOIN sqlite_master m ON m.name = d.name '
+            'WHERE m.tbl_name IN (' + ', '.join(f"'{name}'" for name in table_names) + ') GROUP BY d.name'
+        ))
+    elif dialect == 'postgresql':
+        rows = connection.execute(text(
+            'SELECT c.relname, pg_relation_size(c.oid) FROM pg_class c '
+            'LEFT JOIN pg_index i ON i.indexrelid = c.oid '
+            'WHERE c.relname = ANY(:names) OR i.indrelid = ANY(CAST(:names AS regclass[]))'
+        ), {'names': list(table_names)})
+    else:
+        raise ValueError(f'Unsupported database dialect: {dialect}')
+    return {name: int(size) for name, size in rows}
+
+
+def key_stats(repeat=5):
+    """Table/index sizes and join timings for attendance and calificaciones.
+
+    Each join runs once to warm the cache and then repeat times; the
+    median is reported in milliseconds.
+    """
+    dialect = db.engine.dialect.name
+    with db.engine.connect() as connection:
+        sizes = _relation_sizes(connection, dialect, ('attendance', 'calificaciones', 'enrollments'))
+        joins = {}
+        for name, query in JOIN_QUERIES.items():
+            connection.execute(text(query)).fetchall()
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                rows = connection.execute(text(query)).scalar()
+                timings.append((time.perf_counter() - start) * 1000)
+            joins[name] = {'rows': rows, 'median_ms': round(statistics.median(timings), 2)}
+    return {'dialect': dialect, 'pending': [t.name for t in pending_tables()], 'sizes': sizes, 'joins': joins}
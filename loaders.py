@@ -0,0 +1,424 @@
+"""
+Loaders - Batched read queries for the heavy views
+"""
+
+from datetime import date
+from sqlalchemy import and_, or_, case, distinct, func, select, true
+from sqlalchemy.orm import aliased, contains_eager, joinedload
+from models import db, User, Student, Teacher, Grade, Subject, Enrollment, Attendance, AttendanceSummary, Calificacion, Schedule, PASSING_SCORE
+from timetable import find_all_conflicts
+
+# How many of the latest attendance records /teacher/attendance shows per student
+RECENT_ATTENDANCE_LIMIT = 10
+# Records per page of a student's full attendance history
+ATTENDANCE_HISTORY_PAGE_SIZE = 50
+
+# Enrollments per page on /admin/all-grades
+ADMIN_GRADES_PAGE_SIZE = 50
+ADMIN_GRADES_MAX_PAGE_SIZE = 200
+
+
+def load_teacher_roster(teacher_id, grade_ids=None):
+    """Build the grades_data structure for /teacher/grades in two queries.
+
+    Returns (all_grades, grades_data). Each grade entry lists the students
+    enrolled with this teacher ('students_with_scores') and the ones that
+    are not yet ('available_students') for the add-student modal. With
+    grade_ids only those grades are loaded.
+    """
+    grades_query = Grade.query.order_by(Grade.level)
+    # One pass over every student with their user, outer-joined to this
+    # teacher's enrollments only
+    query = (
+        db.session.query(Student, Enrollment)
+        .join(Student.user)
+        .outerjoin(Enrollment, and_(Enrollment.student_id == Student.id,
+                                    Enrollment.teacher_id == teacher_id))
+        .options(contains_eager(Student.user))
+    )
+    if grade_ids is not None:
+        grades_query = grades_query.filter(Grade.id.in_(grade_ids))
+        query = query.filter(Student.grade_id.in_(grade_ids))
+    all_grades = grades_query.all()
+    rows = query.all()
+
+    grades_data = {}
+    for grade in all_grades:
+        # Always add grade to grades_data, even if no students are enrolled yet
+        grades_data[grade.id] = {
+            'grade': grade,
+            'students_with_scores': [],
+            'available_students': []
+        }
+
+    seen = set()
+    for student, enrollment in rows:
+        # A student may share several enrollments with the same teacher;
+        # keep the first one like the per-student lookup did
+        if student.id in seen:
+            continue
+        seen.add(student.id)
+
+        data = grades_data.get(student.grade_id)
+        if data is None:
+            continue
+
+        if enrollment:
+            data['students_with_scores'].append({
+                'student': student,
+                'enrollment': enrollment,
+                'total_score': float(enrollment.average),
+                'has_enrollment': True,
+                'has_grades': enrollment.has_grades
+            })
+        else:
+            data['available_students'].append(student)
+
+    return all_grades, grades_data
+
+
+def load_teaching_grades(teacher_id):
+    """Grades in which the teacher has enrollments, by level."""
+    return (
+        Grade.query
+        .filter(Grade.id.in_(select(Enrollment.grade_id).where(Enrollment.teacher_id == teacher_id)))
+        .order_by(Grade.level)
+        .all()
+    )
+
+
+def load_teacher_attendance(teacher_id, grade_ids=None):
+    """Build the grades_data structure for /teacher/attendance.
+
+    Counts per status are read from the attendance_summaries rollup,
+    joined onto the enrollments query, and the latest
+    RECENT_ATTENDANCE_LIMIT records per enrollment come from a single
+    ROW_NUMBER() query, so no attendance history is scanned or loaded
+    into Python. With grade_ids only those grades are loaded.
+    """
+    teacher_enrollments = Enrollment.teacher_id == teacher_id
+    if grade_ids is not None:
+        teacher_enrollments = and_(teacher_enrollments, Enrollment.grade_id.in_(grade_ids))
+
+    rows = (
+        db.session.query(Enrollment, AttendanceSummary)
+        .outerjoin(AttendanceSummary, AttendanceSummary.enrollment_id == Enrollment.id)
+        .filter(teacher_enrollments)
+        .options(joinedload(Enrollment.grade),
+                 joinedload(Enrollment.student).joinedload(Student.user))
+        .all()
+    )
+
+    teacher_enrollment_ids = (
+        db.session.query(Enrollment.id)
+        .filter(teacher_enrollments)
+    )
+
+    ranked = (
+        db.session.query(
+            Attendance,
+            func.row_number().over(
+                partition_by=Attendance.enrollment_id,
+                order_by=(Attendance.attendance_date.desc(), Attendance.created_at.desc())
+            ).label('rn')
+        )
+        .filter(Attendance.enrollment_id.in_(teacher_enrollment_ids))
+        .subquery()
+    )
+    recent_alias = aliased(Attendance, ranked)
+    recent = {}
+    recent_rows = (
+        db.session.query(recent_alias)
+        .filter(ranked.c.rn <= RECENT_ATTENDANCE_LIMIT)
+        .order_by(recent_alias.enrollment_id, ranked.c.rn)
+    )
+    for record in recent_rows:
+        recent.setdefault(record.enrollment_id, []).append(record)
+
+    # Group by grade, keeping the order in which grades first appear
+    grades_data = {}
+    for enrollment, summary in rows:
+        grade = enrollment.grade
+        if grade.id not in grades_data:
+            grades_data[grade.id] = {
+                'grade': grade,
+                'enrollments': []
+            }
+
+        if summary:
+            total_records, present_count, absent_count, late_count, excused_count = (
+                summary.total, summary.present, summary.absent, summary.late, summary.excused)
+        else:
+            total_records = present_count = absent_count = late_count = excused_count = 0
+        attendance_percentage = round((present_count / total_records * 100), 1) if total_records > 0 else 0
+
+        grades_data[grade.id]['enrollments'].append({
+            'enrollment': enrollment,
+            'total_records': total_records,
+            'present_count': present_count,
+            'absent_count': absent_count,
+            'late_count': late_count,
+            'excused_count': excused_count,
+            'attendance_percentage': attendance_percentage,
+            'recent_attendance': recent.get(enrollment.id, [])
+        })
+
+    return grades_data
+
+
+def load_attendance_history(enrollment_id, after=None, per_page=ATTENDANCE_HISTORY_PAGE_SIZE):
+    """One keyset-paginated page of an enrollment's attendance, newest first.
+
+    Records are ordered by (attendance_date, id) descending and `after` is
+    the "attendance_date,attendance_id" cursor of the last record of the
+    previous page, so every page is one range scan of the
+    (enrollment_id, attendance_date) index however deep it is. Returns
+    (records, next_cursor); next_cursor is None on the last page.
+    """
+    query = Attendance.query.filter(Attendance.enrollment_id == enrollment_id)
+    if after:
+        after_date, _, after_id = after.partition(',')
+        after_date = date.fromisoformat(after_date)
+        query = query.filter(or_(
+            Attendance.attendance_date < after_date,
+            and_(Attendance.attendance_date == after_date, Attendance.id < after_id)
+        ))
+
+    # Fetch one extra row to know whether there is a next page
+    records = query.order_by(Attendance.attendance_date.desc(), Attendance.id.desc()).limit(per_page + 1).all()
+    next_cursor = None
+    if len(records) > per_page:
+        records = records[:per_page]
+        last = records[-1]
+        next_cursor = f'{last.attendance_date.isoformat()},{last.id}'
+    return records, next_cursor
+
+
+def load_grade_schedules(grade_ids):
+    """{grade_id: {'grade', 'schedules'}} for /schedule, with teachers and their users in the same query."""
+    schedules_by_grade = {grade.id: {'grade': grade, 'schedules': []}
+                          for grade in Grade.query.filter(Grade.id.in_(grade_ids))}
+    schedules = (
+        Schedule.query
+        .filter(Schedule.grade_id.in_(grade_ids))
+        .options(joinedload(Schedule.teacher).joinedload(Teacher.user))
+    )
+    for schedule in schedules:
+        schedules_by_grade[schedule.grade_id]['schedules'].append(schedule)
+    return schedules_by_grade
+
+
+def load_schedule_conflicts():
+    """find_all_conflicts() over the schedules table, loading full rows only for the schedules in a conflict."""
+    rows = db.session.query(Schedule.id, Schedule.teacher_id, Schedule.grade_id, Schedule.classroom,
+                            Schedule.day_of_week, Schedule.start_minute, Schedule.end_minute).all()
+    conflicts = find_all_conflicts(rows)
+    if not conflicts:
+        return []
+    ids = {schedule.id for _, _, first, second in conflicts for schedule in (first, second)}
+    schedules = {
+        schedule.id: schedule
+        for schedule in Schedule.query.filter(Schedule.id.in_(ids))
+        .options(joinedload(Schedule.teacher).joinedload(Teacher.user), joinedload(Schedule.grade_rel))
+    }
+    return [(column, label, schedules[first.id], schedules[second.id]) for column, label, first, second in conflicts]
+
+
+def load_admin_grades_page(grade_id=None, subject_id=None, teacher_id=None, failing=None, after=None,
+                           per_page=ADMIN_GRADES_PAGE_SIZE):
+    """Build one keyset-paginated page of /admin/all-grades.
+
+    Enrollments are ordered by (grade_id, id) and `after` is the
+    "grade_id,enrollment_id" cursor of the last row of the previous page.
+    failing keeps only graded enrollments whose stored average is below
+    PASSING_SCORE. Returns (grades_data, next_cursor); next_cursor is None
+    on the last page.
+    """
+    query = (
+        Enrollment.query
+        .options(joinedload(Enrollment.grade),
+                 joinedload(Enrollment.subject),
+                 joinedload(Enrollment.student).joinedload(Student.user),
+                 joinedload(Enrollment.teacher).joinedload(Teacher.user))
+    )
+    if grade_id:
+        query = query.filter(Enrollment.grade_id == grade_id)
+    if subject_id:
+        query = query.filter(Enrollment.subject_id == subject_id)
+    if teacher_id:
+        query = query.filter(Enrollment.teacher_id == teacher_id)
+    if failing:
+        query = query.filter(Enrollment.has_grades == true(), Enrollment.average < PASSING_SCORE)
+
+    if after:
+        after_grade_id, _, after_id = after.partition(',')
+        query = query.filter(or_(
+            Enrollment.grade_id > after_grade_id,
+            and_(Enrollment.grade_id == after_grade_id, Enrollment.id > after_id)
+        ))
+
+    # Fetch one extra row to know whether there is a next page
+    enrollments = query.order_by(Enrollment.grade_id, Enrollment.id).limit(per_page + 1).all()
+    next_cursor = None
+    if len(enrollments) > per_page:
+        enrollments = enrollments[:per_page]
+        last = enrollments[-1]
+        next_cursor = f'{last.grade_id},{last.id}'
+
+    # Group the visible page by grade
+    grades_data = {}
+    for enrollment in enrollments:
+        grade = enrollment.grade
+        if grade.id not in grades_data:
+            grades_data[grade.id] = {
+                'grade': grade,
+                'enrollments': []
+            }
+
+        grades_data[grade.id]['enrollments'].append({
+            'enrollment': enrollment,
+            'total_score': float(enrollment.average)
+        })
+
+    return grades_data, next_cursor
+
+
+def load_teacher_gradebook(teacher_id, grade_id=None):
+    """Return the teacher's enrollments grouped by grade for bulk grade entry.
+
+    One query with grade, subject and student.user eager-joined; grade_id
+    restricts it to a single grade.
+    """
+    query = (
+        Enrollment.query
+        .filter(Enrollment.teacher_id == teacher_id)
+        .options(joinedload(Enrollment.grade),
+                 joinedload(Enrollment.subject),
+                 joinedload(Enrollment.student).joinedload(Student.user))
+    )
+    if grade_id:
+        query = query.filter(Enrollment.grade_id == grade_id)
+
+    grades_data = {}
+    for enrollment in query.all():
+        grade = enrollment.grade
+        if grade.id not in grades_data:
+            grades_data[grade.id] = {
+                'grade': grade,
+                'enrollments': []
+            }
+        grades_data[grade.id]['enrollments'].append(enrollment)
+
+    return grades_data
+
+
+def load_dashboard_stats(role, profile_id):
+    """Compute the dashboard counters for a role in a single COUNT query.
+
+    profile_id is the Teacher or Student id for those roles.
+    """
+    if role == 'admin':
+        students, teachers, enrollments, grades = db.session.query(
+            select(func.count(Student.id)).scalar_subquery(),
+            select(func.count(Teacher.id)).scalar_subquery(),
+            select(func.count(Enrollment.id)).scalar_subquery(),
+            select(func.count(Grade.id)).scalar_subquery()
+        ).one()
+        return {
+            'students': students,
+            'teachers': teachers,
+            'enrollments': enrollments,
+            'grades': grades
+        }
+
+    if role == 'teacher':
+        my_enrollments, total_students = (
+            db.session.query(func.count(Enrollment.id), func.count(distinct(Enrollment.student_id)))
+            .filter(Enrollment.teacher_id == profile_id)
+            .one()
+        )
+        return {
+            'my_enrollments': my_enrollments,
+            'total_students': total_students
+        }
+
+    if role == 'student':
+        courses = (
+            db.session.query(func.count(Enrollment.id))
+            .filter(Enrollment.student_id == profile_id)
+            .scalar()
+        )
+        return {
+            'courses': courses,
+            'attendance': 0
+        }
+
+    return {}
+
+
+def load_student_courses(student):
+    """Build /student/my-courses: each enrollment with its teacher's schedules in the student's grade."""
+    enrollments = (
+        Enrollment.query
+        .options(joinedload(Enrollment.teacher).joinedload(Teacher.user), joinedload(Enrollment.subject),
+                 joinedload(Enrollment.grade))
+        .filter_by(student_id=student.id)
+        .all()
+    )
+    schedules = Schedule.query.filter_by(grade_id=student.grade_id).all()
+
+    courses_data = []
+    for enrollment in enrollments:
+        teacher = enrollment.teacher
+        courses_data.append({
+            'teacher': teacher,
+            'subject': enrollment.subject,
+            'grade': enrollment.grade,
+            'schedules': [s for s in schedules if s.teacher_id == teacher.id]
+        })
+    return courses_data
+
+
+def load_report_card(student_id):
+    """Build /student/my-grades for one student in a single query.
+
+    Returns (grades_data, general_average): one entry per subject with the
+    teacher's names and the calificaciones newest first, and the average
+    of every non-zero calificación, computed by the database as a window
+    aggregate over the same rows. Only plain values are returned, so the
+    result can be cached across requests.
+    """
+    graded = case((Calificacion.calificacion != 0, Calificacion.calificacion))
+    rows = (
+        db.session.query(
+            Calificacion.subject_id, Subject.name, User.name, Teacher.apellido_paterno, Teacher.apellido_materno,
+            Calificacion.calificacion, Calificacion.semester, Calificacion.fecha_calificacion, Calificacion.nota_texto,
+            func.avg(graded).over().label('general_average')
+        )
+        .join(Subject, Calificacion.subject_id == Subject.id)
+        .join(Teacher, Calificacion.teacher_id == Teacher.id)
+        .join(User, Teacher.user_id == User.id)
+        .filter(Calificacion.student_id == student_id)
+        .order_by(Calificacion.fecha_calificacion.desc(), Calificacion.semester)
+        .all()
+    )
+
+    subjects_grades = {}
+    for subject_id, subject, teacher_name, paterno, materno, calificacion, semester, fecha, nota, _ in rows:
+        if subject_id not in subjects_grades:
+            subjects_grades[subject_id] = {
+                'subject': subject,
+                'teacher_name': teacher_name,
+                'teacher_apellido_paterno': paterno,
+                'teacher_apellido_materno': materno,
+                'grades': []
+            }
+        subjects_grades[subject_id]['grades'].append({
+            'calificacion': float(calificacion) if calificacion else 0,
+            'semester': semester,
+            'fecha': fecha,
+            'nota_texto': nota
+        })
+
+    general_average = rows[0].general_average if rows else None
+    return list(subjects_grades.values()), round(float(general_average), 2) if general_average else 0
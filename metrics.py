@@ -0,0 +1,169 @@
+"""
+Metrics - Per-request query and timing instrumentation
+
+Counts SQL statements, database time, template render time and total time
+for every request, reports them in a Server-Timing header and aggregates
+them per endpoint for /metrics (Prometheus text format), which answers
+a bearer METRICS_TOKEN or a logged-in admin. Aggregates are per process,
+so each gunicorn worker exposes its own.
+"""
+
+import os
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import g, request, has_request_context, Response, abort
+from flask_login import current_user
+from jinja2 import Template
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from app import app
+
+# A statement repeated this many times in one request is reported as a suspected N+1
+N_PLUS_ONE_THRESHOLD = int(os.getenv('N_PLUS_ONE_THRESHOLD', 5))
+# Upper bounds (seconds) of the request duration histogram
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_lock = threading.Lock()
+_totals = defaultdict(lambda: {
+    'requests': 0,
+    'seconds': 0.0,
+    'db_seconds': 0.0,
+    'template_seconds': 0.0,
+    'queries': 0,
+    'n_plus_one': 0,
+    'buckets': [0] * len(DURATION_BUCKETS),
+})
+
+
+def _current():
+    if has_request_context():
+        return g.get('request_metrics')
+    return None
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('query_start', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info['query_start'].pop()
+    current = _current()
+    if current is not None:
+        current['queries'] += 1
+        current['db_seconds'] += elapsed
+        current['statements'][statement] += 1
+
+
+@event.listens_for(Engine, 'handle_error')
+def _handle_error(context):
+    # A failed statement never reaches after_cursor_execute; drop its start
+    # so it does not stay on the pooled connection for good
+    if context.connection is not None:
+        starts = context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+
+class TimedTemplate(Template):
+    """Template that adds its render time to the current request's metrics."""
+
+    def render(self, *args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            current = _current()
+            if current is not None:
+                current['template_seconds'] += time.perf_counter() - start
+
+
+app.jinja_env.template_class = TimedTemplate
+
+
+@app.before_request
+def start_request_metrics():
+    g.request_metrics = {
+        'start': time.perf_counter(),
+        'queries': 0,
+        'db_seconds': 0.0,
+        'template_seconds': 0.0,
+        'statements': Counter(),
+    }
+
+
+@app.after_request
+def record_request_metrics(response):
+    current = _current()
+    if current is None or request.endpoint in (None, 'metrics', 'static'):
+        return response
+
+    total = time.perf_counter() - current['start']
+    endpoint = request.endpoint
+    view = app.view_functions.get(endpoint)
+    view_name = getattr(view, '__name__', endpoint)
+
+    suspects = [(statement, count) for statement, count in current['statements'].items() if count >= N_PLUS_ONE_THRESHOLD]
+    for statement, count in suspects:
+        app.logger.warning('Suspected N+1 in %s(): statement ran %d times: %s',
+                           view_name, count, ' '.join(statement.split())[:200])
+
+    response.headers['Server-Timing'] = ', '.join([
+        f'db;dur={current["db_seconds"] * 1000:.1f};desc="{current["queries"]} queries"',
+        f'tpl;dur={current["template_seconds"] * 1000:.1f}',
+        f'total;dur={total * 1000:.1f}',
+    ])
+
+    with _lock:
+        totals = _totals[endpoint]
+        totals['requests'] += 1
+        totals['seconds'] += total
+        totals['db_seconds'] += current['db_seconds']
+        totals['template_seconds'] += current['template_seconds']
+        totals['queries'] += current['queries']
+        totals['n_plus_one'] += len(suspects)
+        for i, bound in enumerate(DURATION_BUCKETS):
+            if total <= bound:
+                totals['buckets'][i] += 1
+    return response
+
+
+def render_prometheus():
+    """Render the per-endpoint aggregates in Prometheus text exposition format."""
+    with _lock:
+        snapshot = {endpoint: dict(totals, buckets=list(totals['buckets'])) for endpoint, totals in _totals.items()}
+
+    lines = []
+
+    def family(name, kind, help_text, key):
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        for endpoint, totals in sorted(snapshot.items()):
+            lines.append(f'{name}{{endpoint="{endpoint}"}} {totals[key]}')
+
+    lines.append('# HELP academia_request_duration_seconds Request duration by endpoint.')
+    lines.append('# TYPE academia_request_duration_seconds histogram')
+    for endpoint, totals in sorted(snapshot.items()):
+        for bound, count in zip(DURATION_BUCKETS, totals['buckets']):
+            lines.append(f'academia_request_duration_seconds_bucket{{endpoint="{endpoint}",le="{bound}"}} {count}')
+        lines.append(f'academia_request_duration_seconds_bucket{{endpoint="{endpoint}",le="+Inf"}} {totals["requests"]}')
+        lines.append(f'academia_request_duration_seconds_sum{{endpoint="{endpoint}"}} {totals["seconds"]}')
+        lines.append(f'academia_request_duration_seconds_count{{endpoint="{endpoint}"}} {totals["requests"]}')
+
+    family('academia_db_queries_total', 'counter', 'SQL statements issued by endpoint.', 'queries')
+    family('academia_db_seconds_total', 'counter', 'Time spent in SQL statements by endpoint.', 'db_seconds')
+    family('academia_template_seconds_total', 'counter', 'Time spent rendering templates by endpoint.', 'template_seconds')
+    family('academia_n_plus_one_suspected_total', 'counter', 'Statements repeated at least N_PLUS_ONE_THRESHOLD times in one request.', 'n_plus_one')
+    return '\n'.join(lines) + '\n'
+
+
+@app.route('/metrics')
+def metrics():
+    # Scrapers send METRICS_TOKEN; without one configured only admins may look
+    token = os.getenv('METRICS_TOKEN')
+    scraper = token and request.headers.get('Authorization') == f'Bearer {token}'
+    if not scraper and not (current_user.is_authenticated and current_user.role == 'admin'):
+        abort(401)
+    return Response(render_prometheus(), mimetype='text/plain; version=0.0.4')
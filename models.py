@@ -4,15 +4,95 @@ Models - Database Schema for School Management System
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy import inspect
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.orm import Session
+from sqlalchemy.types import TypeDecorator, LargeBinary
 from datetime import datetime
+import os
+import time
 import uuid
 
 db = SQLAlchemy()
 
 
+def new_id():
+    """A time-ordered UUIDv7 string, so new rows append to the end of key indexes."""
+    millis = time.time_ns() // 1_000_000
+    rand = int.from_bytes(os.urandom(10), 'big')
+    value = (millis & 0xFFFFFFFFFFFF) << 80 | 0x7 << 76 | (rand >> 62 & 0xFFF) << 64 | 0b10 << 62 | rand & (2 ** 62 - 1)
+    return str(uuid.UUID(int=value))
+
+
+class InvalidId(ValueError):
+    """A key column was given a value that is not a UUID."""
+
+
+def parse_id(value):
+    """value as a uuid.UUID; raises InvalidId when it is not one."""
+    if isinstance(value, uuid.UUID):
+        return value
+    try:
+        return uuid.UUID(str(value))
+    except ValueError:
+        raise InvalidId(f'Identificador inválido: {value}')
+
+
+class CompactUUID(TypeDecorator):
+    """UUID key stored natively on PostgreSQL and as 16 raw bytes elsewhere.
+
+    Python code keeps seeing the canonical 36-character string. Byte order
+    matches string order, so ORDER BY and keyset comparisons on keys behave
+    as they did with String(36). Binding a value that is not a UUID raises
+    InvalidId (wrapped in a StatementError by SQLAlchemy).
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        if dialect.name == 'postgresql':
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=False))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        value = parse_id(value)
+        return str(value) if dialect.name == 'postgresql' else value.bytes
+
+    def process_result_value(self, value, dialect):
+        if value is None or dialect.name == 'postgresql':
+            return value
+        # Same string as str(uuid.UUID(bytes=...)) at a fraction of the cost on large reads
+        digits = bytes(value).hex()
+        return f'{digits[:8]}-{digits[8:12]}-{digits[12:16]}-{digits[16:20]}-{digits[20:]}'
+
+
+ATTENDANCE_STATUSES = ('present', 'absent', 'late', 'excused')
+SEMESTERS = (1, 2, 3)
+SCHOOL_DAYS = ('Lunes', 'Martes', 'Miércoles', 'Jueves', 'Viernes')
+# Averages below this are shown in red and count as failing
+PASSING_SCORE = 60
+
+
+def semester_average(*scores):
+    """Return (average, has_grades) for an enrollment's semester scores.
+
+    Missing semesters count as 0 and the sum is always divided by the
+    number of semesters, as the grade tables have always shown it.
+    """
+    total = sum(float(score) for score in scores if score)
+    return round(total / len(SEMESTERS), 2), any(scores)
+
+
+def _owned(name):
+    """Backref for a collection the database deletes along with its parent (ON DELETE CASCADE)."""
+    return db.backref(name, cascade='all', passive_deletes=True)
+
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
     email = db.Column(db.String(255), unique=True, nullable=False)
     password = db.Column(db.String(255), nullable=False)
     name = db.Column(db.String(255), nullable=False)
@@ -22,7 +102,7 @@ class User(UserMixin, db.Model):
 
 class Grade(db.Model):
     __tablename__ = 'grades'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
     name = db.Column(db.String(50), unique=True, nullable=False)
     level = db.Column(db.Integer)
     max_students = db.Column(db.Integer, default=40)
@@ -31,7 +111,7 @@ class Grade(db.Model):
 
 class Subject(db.Model):
     __tablename__ = 'subjects'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
     name = db.Column(db.String(255), nullable=False)
     code = db.Column(db.String(20), unique=True, nullable=False)
     credits = db.Column(db.Integer, default=3)
@@ -40,23 +120,32 @@ class Subject(db.Model):
 
 class Student(db.Model):
     __tablename__ = 'students'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_students_grade_id', 'grade_id'),
+        db.Index('ix_students_user_id', 'user_id', unique=True),
+        db.Index('ix_students_updated_at_id', 'updated_at', 'id'),
+    )
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
+    user_id = db.Column(CompactUUID, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     student_code = db.Column(db.String(50), unique=True, nullable=False)
-    grade_id = db.Column(db.String(36), db.ForeignKey('grades.id'), nullable=False)
+    grade_id = db.Column(CompactUUID, db.ForeignKey('grades.id', ondelete='CASCADE'), nullable=False)
     apellido_paterno = db.Column(db.String(100), nullable=True)
     apellido_materno = db.Column(db.String(100), nullable=True)
     enrollment_date = db.Column(db.Date, nullable=False)
     status = db.Column(db.String(20), default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship('User', backref='student_profile')
-    grade = db.relationship('Grade', backref='students')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    user = db.relationship('User', backref=_owned('student_profile'))
+    grade = db.relationship('Grade', backref=_owned('students'))
 
 
 class Teacher(db.Model):
     __tablename__ = 'teachers'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    user_id = db.Column(db.String(36), db.ForeignKey('users.id'), nullable=False, unique=True)
+    __table_args__ = (
+        db.Index('ix_teachers_updated_at_id', 'updated_at', 'id'),
+    )
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
+    user_id = db.Column(CompactUUID, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False, unique=True)
     teacher_code = db.Column(db.String(50), unique=True, nullable=False)
     specialization = db.Column(db.Text)
     apellido_paterno = db.Column(db.String(100), nullable=True)
@@ -65,16 +154,39 @@ class Teacher(db.Model):
     end_contract_date = db.Column(db.Date, nullable=True)
     status = db.Column(db.String(20), default='active')
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    user = db.relationship('User', backref='teacher_profile')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    user = db.relationship('User', backref=_owned('teacher_profile'))
+
+
+# The API lists students and teachers with their account's name and email,
+# so a change to those counts as an update of the profile too
+@db.event.listens_for(Session, 'before_flush')
+def _touch_profiles_of_renamed_users(session, flush_context, instances):
+    now = datetime.utcnow()
+    for obj in session.dirty:
+        if isinstance(obj, User):
+            attrs = inspect(obj).attrs
+            if attrs.name.history.has_changes() or attrs.email.history.has_changes():
+                for profile in obj.student_profile + obj.teacher_profile:
+                    profile.updated_at = now
 
 
 class Enrollment(db.Model):
     __tablename__ = 'enrollments'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    student_id = db.Column(db.String(36), db.ForeignKey('students.id'), nullable=False)
-    teacher_id = db.Column(db.String(36), db.ForeignKey('teachers.id'), nullable=False)
-    subject_id = db.Column(db.String(36), db.ForeignKey('subjects.id'), nullable=False)
-    grade_id = db.Column(db.String(36), db.ForeignKey('grades.id'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_enrollments_student_teacher_subject', 'student_id', 'teacher_id', 'subject_id', unique=True),
+        db.Index('ix_enrollments_teacher_grade', 'teacher_id', 'grade_id'),
+        db.Index('ix_enrollments_grade_id_id', 'grade_id', 'id'),
+        db.Index('ix_enrollments_subject_id', 'subject_id'),
+        db.Index('ix_enrollments_grade_average', 'grade_id', 'average'),
+        db.Index('ix_enrollments_has_grades_average', 'has_grades', 'average'),
+        db.Index('ix_enrollments_updated_at_id', 'updated_at', 'id'),
+    )
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
+    student_id = db.Column(CompactUUID, db.ForeignKey('students.id', ondelete='CASCADE'), nullable=False)
+    teacher_id = db.Column(CompactUUID, db.ForeignKey('teachers.id', ondelete='CASCADE'), nullable=False)
+    subject_id = db.Column(CompactUUID, db.ForeignKey('subjects.id', ondelete='CASCADE'), nullable=False)
+    grade_id = db.Column(CompactUUID, db.ForeignKey('grades.id', ondelete='CASCADE'), nullable=False)
     enrollment_date = db.Column(db.DateTime, default=datetime.utcnow)
     status = db.Column(db.String(20), default='enrolled')
     final_grade = db.Column(db.Numeric(5, 2))
@@ -84,72 +196,167 @@ class Enrollment(db.Model):
     nota_semester_1 = db.Column(db.Text, nullable=True)
     nota_semester_2 = db.Column(db.Text, nullable=True)
     nota_semester_3 = db.Column(db.Text, nullable=True)
+    # Derived from semester_*; see semester_average()
+    average = db.Column(db.Numeric(5, 2), nullable=False, default=0, server_default='0')
+    has_grades = db.Column(db.Boolean, nullable=False, default=False, server_default=db.false())
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    student = db.relationship('Student', backref='enrollments')
-    teacher = db.relationship('Teacher', backref='enrollments')
-    subject = db.relationship('Subject', backref='enrollments')
-    grade = db.relationship('Grade', backref='enrollments')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    student = db.relationship('Student', backref=_owned('enrollments'))
+    teacher = db.relationship('Teacher', backref=_owned('enrollments'))
+    subject = db.relationship('Subject', backref=_owned('enrollments'))
+    grade = db.relationship('Grade', backref=_owned('enrollments'))
+
+    def refresh_average(self):
+        self.average, self.has_grades = semester_average(self.semester_1, self.semester_2, self.semester_3)
+
+
+# Any ORM flush of an enrollment keeps its average current; bulk writers
+# (bulk.save_semester_grades, the synthetic generator) set it themselves
+@db.event.listens_for(Enrollment, 'before_insert')
+@db.event.listens_for(Enrollment, 'before_update')
+def _refresh_enrollment_average(mapper, connection, enrollment):
+    enrollment.refresh_average()
 
 
 class Assessment(db.Model):
     __tablename__ = 'assessments'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    enrollment_id = db.Column(db.String(36), db.ForeignKey('enrollments.id'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_assessments_enrollment_id', 'enrollment_id'),
+    )
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
+    enrollment_id = db.Column(CompactUUID, db.ForeignKey('enrollments.id', ondelete='CASCADE'), nullable=False)
     assessment_type = db.Column(db.String(50), nullable=False)
     score = db.Column(db.Numeric(5, 2), nullable=False)
     assessment_date = db.Column(db.Date, nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    enrollment = db.relationship('Enrollment', backref='assessments')
+    enrollment = db.relationship('Enrollment', backref=_owned('assessments'))
 
 
 class Attendance(db.Model):
     __tablename__ = 'attendance'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    enrollment_id = db.Column(db.String(36), db.ForeignKey('enrollments.id'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_attendance_enrollment_date', 'enrollment_id', 'attendance_date', unique=True),
+        db.Index('ix_attendance_updated_at_id', 'updated_at', 'id'),
+    )
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
+    enrollment_id = db.Column(CompactUUID, db.ForeignKey('enrollments.id', ondelete='CASCADE'), nullable=False)
     attendance_date = db.Column(db.Date, nullable=False)
     status = db.Column(db.String(20), nullable=False)
     notes = db.Column(db.Text)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    enrollment = db.relationship('Enrollment', backref='attendance_records')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    enrollment = db.relationship('Enrollment', backref=_owned('attendance_records'))
+
+
+class AttendanceSummary(db.Model):
+    """Per-enrollment attendance counts, kept in step with attendance by rollups.py."""
+    __tablename__ = 'attendance_summaries'
+    enrollment_id = db.Column(CompactUUID, db.ForeignKey('enrollments.id', ondelete='CASCADE'), primary_key=True)
+    total = db.Column(db.Integer, nullable=False, default=0)
+    present = db.Column(db.Integer, nullable=False, default=0)
+    absent = db.Column(db.Integer, nullable=False, default=0)
+    late = db.Column(db.Integer, nullable=False, default=0)
+    excused = db.Column(db.Integer, nullable=False, default=0)
+
+
+class DataVersion(db.Model):
+    """Write counter bumped by versions.py; scope is 'student:<id>', 'grade:<id>' or 'catalog'."""
+    __tablename__ = 'data_versions'
+    scope = db.Column(db.String(64), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+    updated_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
 
 class TeacherSubject(db.Model):
     __tablename__ = 'teacher_subjects'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    teacher_id = db.Column(db.String(36), db.ForeignKey('teachers.id'), nullable=False)
-    subject_id = db.Column(db.String(36), db.ForeignKey('subjects.id'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_teacher_subjects_teacher_subject', 'teacher_id', 'subject_id', unique=True),
+    )
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
+    teacher_id = db.Column(CompactUUID, db.ForeignKey('teachers.id', ondelete='CASCADE'), nullable=False)
+    subject_id = db.Column(CompactUUID, db.ForeignKey('subjects.id', ondelete='CASCADE'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    teacher = db.relationship('Teacher', backref='teacher_subjects')
-    subject = db.relationship('Subject', backref='teacher_subjects')
+    teacher = db.relationship('Teacher', backref=_owned('teacher_subjects'))
+    subject = db.relationship('Subject', backref=_owned('teacher_subjects'))
+
+
+def parse_minutes(value):
+    """Minutes since midnight for an 'HH:MM' (or 'HH:MM:SS') time string."""
+    try:
+        hours, minutes = (int(part) for part in str(value).strip().split(':')[:2])
+    except ValueError:
+        raise ValueError(f'Hora inválida: {value}')
+    if not (0 <= hours <= 24 and 0 <= minutes < 60) or hours * 60 + minutes > 24 * 60:
+        raise ValueError(f'Hora inválida: {value}')
+    return hours * 60 + minutes
+
+
+def format_minutes(minutes):
+    return f'{minutes // 60:02d}:{minutes % 60:02d}'
 
 
 class Schedule(db.Model):
     __tablename__ = 'schedules'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    teacher_id = db.Column(db.String(36), db.ForeignKey('teachers.id'), nullable=False)
-    grade_id = db.Column(db.String(36), db.ForeignKey('grades.id'), nullable=False)
+    # One index per resource that cannot be in two places at once; each
+    # ends in (start_minute, end_minute) so conflict checks are one seek
+    __table_args__ = (
+        db.Index('ix_schedules_grade_day_start', 'grade_id', 'day_of_week', 'start_minute', 'end_minute'),
+        db.Index('ix_schedules_teacher_day_start', 'teacher_id', 'day_of_week', 'start_minute', 'end_minute'),
+        db.Index('ix_schedules_classroom_day_start', 'classroom', 'day_of_week', 'start_minute', 'end_minute'),
+        db.Index('ix_schedules_updated_at_id', 'updated_at', 'id'),
+    )
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
+    teacher_id = db.Column(CompactUUID, db.ForeignKey('teachers.id', ondelete='CASCADE'), nullable=False)
+    grade_id = db.Column(CompactUUID, db.ForeignKey('grades.id', ondelete='CASCADE'), nullable=False)
     day_of_week = db.Column(db.String(20), nullable=False)
     start_time = db.Column(db.String(10), nullable=False)
     end_time = db.Column(db.String(10), nullable=False)
     classroom = db.Column(db.String(50))
+    # Set by the timetable generator; hand-entered slots leave it empty
+    subject_id = db.Column(CompactUUID, db.ForeignKey('subjects.id', ondelete='CASCADE'), nullable=True)
+    # Derived from start_time/end_time; see refresh_minutes()
+    start_minute = db.Column(db.Integer)
+    end_minute = db.Column(db.Integer)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    teacher = db.relationship('Teacher', backref='schedules')
-    grade_rel = db.relationship('Grade', backref='schedules')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    teacher = db.relationship('Teacher', backref=_owned('schedules'))
+    grade_rel = db.relationship('Grade', backref=_owned('schedules'))
+
+    def refresh_minutes(self):
+        """Normalize start_time/end_time to 'HH:MM' and fill the minute columns."""
+        self.start_minute = parse_minutes(self.start_time)
+        self.end_minute = parse_minutes(self.end_time)
+        if self.end_minute <= self.start_minute:
+            raise ValueError('La hora de fin debe ser posterior a la hora de inicio')
+        self.start_time = format_minutes(self.start_minute)
+        self.end_time = format_minutes(self.end_minute)
+
+
+@db.event.listens_for(Schedule, 'before_insert')
+@db.event.listens_for(Schedule, 'before_update')
+def _refresh_schedule_minutes(mapper, connection, schedule):
+    schedule.refresh_minutes()
 
 
 class Calificacion(db.Model):
     __tablename__ = 'calificaciones'
-    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
-    enrollment_id = db.Column(db.String(36), db.ForeignKey('enrollments.id'), nullable=False)
-    student_id = db.Column(db.String(36), db.ForeignKey('students.id'), nullable=False)
-    subject_id = db.Column(db.String(36), db.ForeignKey('subjects.id'), nullable=False)
-    teacher_id = db.Column(db.String(36), db.ForeignKey('teachers.id'), nullable=False)
+    __table_args__ = (
+        db.Index('ix_calificaciones_enrollment_semester', 'enrollment_id', 'semester', unique=True),
+        db.Index('ix_calificaciones_student_id', 'student_id'),
+        db.Index('ix_calificaciones_updated_at_id', 'updated_at', 'id'),
+    )
+    id = db.Column(CompactUUID, primary_key=True, default=new_id)
+    enrollment_id = db.Column(CompactUUID, db.ForeignKey('enrollments.id', ondelete='CASCADE'), nullable=False)
+    student_id = db.Column(CompactUUID, db.ForeignKey('students.id', ondelete='CASCADE'), nullable=False)
+    subject_id = db.Column(CompactUUID, db.ForeignKey('subjects.id', ondelete='CASCADE'), nullable=False)
+    teacher_id = db.Column(CompactUUID, db.ForeignKey('teachers.id', ondelete='CASCADE'), nullable=False)
     semester = db.Column(db.Integer, nullable=False)
     calificacion = db.Column(db.Numeric(5, 2), nullable=False)
     nota_texto = db.Column(db.Text, nullable=True)
     fecha_calificacion = db.Column(db.Date, default=datetime.today)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
-    enrollment = db.relationship('Enrollment', backref='calificaciones')
-    student = db.relationship('Student', backref='calificaciones')
-    subject = db.relationship('Subject', backref='calificaciones')
-    teacher = db.relationship('Teacher', backref='calificaciones')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    enrollment = db.relationship('Enrollment', backref=_owned('calificaciones'))
+    student = db.relationship('Student', backref=_owned('calificaciones'))
+    subject = db.relationship('Subject', backref=_owned('calificaciones'))
+    teacher = db.relationship('Teacher', backref=_owned('calificaciones'))
@@ -0,0 +1,86 @@
+"""
+Rollups - Attendance counters maintained alongside every attendance write
+"""
+
+from collections import defaultdict
+from sqlalchemy import case, func, select
+from bulk import increment
+from cache import rows_written
+from models import db, Attendance, AttendanceSummary, Enrollment, ATTENDANCE_STATUSES
+
+COUNTER_COLUMNS = ['total'] + list(ATTENDANCE_STATUSES)
+
+
+def _apply(deltas, status, sign):
+    # A status outside ATTENDANCE_STATUSES has no column; counting it in
+    # total alone would make the percentages stop adding up
+    if status in ATTENDANCE_STATUSES:
+        deltas['total'] += sign
+        deltas[status] += sign
+
+
+def lock_enrollments(enrollment_ids):
+    """Lock the enrollments' rows (SELECT ... FOR UPDATE) until the transaction ends; returns the ids found.
+
+    Attendance writers call this before reading the statuses they are
+    about to replace. Concurrent writes to the same enrollments then run
+    one after the other, so each sees the other's committed status and no
+    change reaches the rollups twice. SQLite ignores FOR UPDATE, and
+    pysqlite only opens a transaction at the first write, after those
+    reads; there the transaction is started with BEGIN IMMEDIATE, which
+    takes the database write lock up front.
+    """
+    connection = db.session.connection()
+    if connection.dialect.name == 'sqlite' and not connection.connection.dbapi_connection.in_transaction:
+        connection.exec_driver_sql('BEGIN IMMEDIATE')
+    rows = (
+        db.session.query(Enrollment.id)
+        .filter(Enrollment.id.in_(list(enrollment_ids)))
+        .order_by(Enrollment.id)
+        .with_for_update()
+    )
+    return [enrollment_id for enrollment_id, in rows]
+
+
+def record_attendance_changes(changes):
+    """Fold attendance writes into the rollup table.
+
+    changes is an iterable of (enrollment_id, attendance_date, old_status,
+    new_status); old_status is None for an insert and new_status None for
+    a delete, and must have been read after lock_enrollments(). Runs
+    inside the caller's transaction, so the counters commit or roll back
+    together with the attendance rows.
+    """
+    changes = list(changes)
+    rows_written(db.session, Attendance.__tablename__, [{'enrollment_id': change[0]} for change in changes])
+    per_enrollment = defaultdict(lambda: dict.fromkeys(COUNTER_COLUMNS, 0))
+    for enrollment_id, attendance_date, old_status, new_status in changes:
+        if old_status == new_status:
+            continue
+        deltas = per_enrollment[enrollment_id]
+        if old_status is not None:
+            _apply(deltas, old_status, -1)
+        if new_status is not None:
+            _apply(deltas, new_status, 1)
+
+    increment(AttendanceSummary,
+              [dict(deltas, enrollment_id=enrollment_id) for enrollment_id, deltas in per_enrollment.items()],
+              ['enrollment_id'], COUNTER_COLUMNS)
+
+
+def _counters():
+    return [func.count(Attendance.id)] + [
+        func.sum(case((Attendance.status == status, 1), else_=0)) for status in ATTENDANCE_STATUSES
+    ]
+
+
+def rebuild_attendance_rollups():
+    """Recompute the rollup table from attendance with one INSERT ... SELECT statement.
+
+    Runs inside the caller's transaction; the caller commits.
+    """
+    db.session.execute(AttendanceSummary.__table__.delete())
+    db.session.execute(AttendanceSummary.__table__.insert().from_select(
+        ['enrollment_id'] + COUNTER_COLUMNS,
+        select(Attendance.enrollment_id, *_counters()).group_by(Attendance.enrollment_id)
+    ))
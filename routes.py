@@ -2,14 +2,36 @@
 Routes - Flask Views for School Management System
 """
 
-from flask import render_template, request, redirect, url_for, flash, jsonify
+from flask import render_template, request, redirect, url_for, flash, jsonify, Response, stream_with_context
 from flask_login import login_required, current_user, login_user, logout_user
-from models import db, User, Student, Teacher, Grade, Subject, Enrollment, Assessment, Attendance, Schedule, TeacherSubject, Calificacion
-from auth import verify_password, hash_password
+from sqlalchemy.orm import joinedload
+from models import db, User, Student, Teacher, Grade, Subject, Enrollment, Assessment, Attendance, AttendanceSummary, Schedule, TeacherSubject, Calificacion, ATTENDANCE_STATUSES, SEMESTERS, InvalidId, parse_id
+from auth import hash_password, verify_password_pooled, hash_password_pooled, needs_rehash, LoginBusy
+from bulk import upsert, save_semester_grades
+from cache import dashboard_stats, report_cards
+from exports import grades_rows, attendance_rows, roster_rows, stream_csv, stream_xlsx, EXPORT_FORMATS
+from identity import remember_identity, forget_identity, current_profile
+from importer import RosterImport, read_roster
+from rollups import lock_enrollments, record_attendance_changes
+import auth
+import deletes
+from versions import conditional_student_page, grade_sections, student_versions
+from timetable import find_conflict, conflict_message, resource_name
+from loaders import load_dashboard_stats, load_teacher_roster, load_teaching_grades, load_teacher_attendance, load_attendance_history, load_grade_schedules, load_schedule_conflicts, load_admin_grades_page, load_teacher_gradebook, load_report_card, load_student_courses, ADMIN_GRADES_PAGE_SIZE, ADMIN_GRADES_MAX_PAGE_SIZE
 from app import app
 from datetime import date, datetime
 
 
+def _form_id(name):
+    """The id posted in form field name, None when empty; raises InvalidId when it is not a UUID.
+
+    Parsing here keeps a malformed id out of the route's generic error flash
+    (which would show the SQL) and lets the app-level handler report it.
+    """
+    value = request.form.get(name)
+    return str(parse_id(value)) if value else None
+
+
 @app.route('/')
 def index():
     if current_user.is_authenticated:
@@ -24,8 +46,22 @@ def login():
         password = request.form.get('password')
         user = User.query.filter_by(email=email).first()
         
-        if user and verify_password(password, user.password):
+        try:
+            valid = user is not None and verify_password_pooled(password, user.password)
+        except LoginBusy:
+            flash('Demasiados inicios de sesión en este momento, intenta de nuevo en unos segundos', 'error')
+            return render_template('login.html'), 503, {'Retry-After': '5'}
+        
+        if valid:
+            # Upgrade hashes made with an older method or cost; retried on a later login if busy
+            if needs_rehash(user.password):
+                try:
+                    user.password = hash_password_pooled(password)
+                    db.session.commit()
+                except LoginBusy:
+                    pass
             login_user(user)
+            remember_identity(user)
             return redirect(url_for('dashboard'))
         flash('Credenciales inválidas', 'error')
     
@@ -42,30 +78,9 @@ def logout():
 @app.route('/dashboard')
 @login_required
 def dashboard():
-    stats = {}
-    
-    if current_user.role == 'admin':
-        stats = {
-            'students': Student.query.count(),
-            'teachers': Teacher.query.count(),
-            'enrollments': Enrollment.query.count(),
-            'grades': Grade.query.count()
-        }
-    elif current_user.role == 'teacher':
-        teacher = Teacher.query.filter_by(user_id=current_user.id).first()
-        my_enrollments = Enrollment.query.filter_by(teacher_id=teacher.id).all() if teacher else []
-        total_students = len(set(e.student_id for e in my_enrollments))
-        stats = {
-            'my_enrollments': len(my_enrollments),
-            'total_students': total_students
-        }
-    elif current_user.role == 'student':
-        student = Student.query.filter_by(user_id=current_user.id).first()
-        enrollments = Enrollment.query.filter_by(student_id=student.id).all() if student else []
-        stats = {
-            'courses': len(enrollments),
-            'attendance': 0
-        }
+    # Admin counters are global, so all admins share one cache entry
+    key = (current_user.role, None if current_user.role == 'admin' else current_user.id)
+    stats = dashboard_stats.get_or_set(key, lambda: load_dashboard_stats(current_user.role, current_user.profile_id))
     
     return render_template('dashboard.html', stats=stats)
 
@@ -92,7 +107,7 @@ def add_student():
         name = request.form.get('name')
         email = request.form.get('email')
         student_code = request.form.get('student_code')
-        grade_id = request.form.get('grade_id')
+        grade_id = _form_id('grade_id')
         apellido_paterno = request.form.get('apellido_paterno')
         apellido_materno = request.form.get('apellido_materno')
         
@@ -121,6 +136,8 @@ def add_student():
         db.session.commit()
         
         flash(f'Estudiante {name} agregado exitosamente', 'success')
+    except InvalidId:
+        raise
     except Exception as e:
         db.session.rollback()
         flash(f'Error: {str(e)}', 'error')
@@ -128,7 +145,31 @@ def add_student():
     return redirect(url_for('students'))
 
 
-@app.route('/student/<student_id>/edit', methods=['GET', 'POST'])
+@app.route('/students/import', methods=['POST'])
+@login_required
+def import_students():
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Denegado'}), 403
+    
+    roster = request.files.get('roster')
+    if not roster or not roster.filename:
+        flash('Selecciona un archivo CSV o XLSX', 'error')
+        return redirect(url_for('students'))
+    
+    try:
+        # A web worker hashes on its shared thread pool rather than forking processes
+        roster_import = RosterImport(hash_pool=auth.hash_pool)
+        imported, errors = roster_import.run(read_roster(roster.filename, roster.stream))
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error: {str(e)}', 'error')
+        return redirect(url_for('students'))
+    
+    flash(f'{imported} estudiantes importados, {len(errors)} filas con errores', 'success' if imported else 'error')
+    return render_template('student_import_report.html', imported=imported, errors=errors, filename=roster.filename)
+
+
+@app.route('/student/<id:student_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_student(student_id):
     if current_user.role != 'admin':
@@ -145,14 +186,17 @@ def edit_student(student_id):
             student.user.name = request.form.get('name')
             student.user.email = request.form.get('email')
             student.student_code = request.form.get('student_code')
-            student.grade_id = request.form.get('grade_id')
+            student.grade_id = _form_id('grade_id')
             student.status = request.form.get('status')
             student.apellido_paterno = request.form.get('apellido_paterno')
             student.apellido_materno = request.form.get('apellido_materno')
             
             db.session.commit()
+            forget_identity(student.user_id)
             flash('Estudiante actualizado', 'success')
             return redirect(url_for('students'))
+        except InvalidId:
+            raise
         except Exception as e:
             db.session.rollback()
             flash(f'Error: {str(e)}', 'error')
@@ -161,7 +205,7 @@ def edit_student(student_id):
     return render_template('edit_student.html', student=student, grades=grades)
 
 
-@app.route('/student/<student_id>/delete', methods=['POST'])
+@app.route('/student/<id:student_id>/delete', methods=['POST'])
 @login_required
 def delete_student(student_id):
     if current_user.role != 'admin':
@@ -173,11 +217,9 @@ def delete_student(student_id):
             flash('Estudiante no encontrado', 'error')
             return redirect(url_for('students'))
         
-        user = student.user
-        Enrollment.query.filter_by(student_id=student_id).delete()
-        db.session.delete(student)
-        db.session.delete(user)
-        db.session.commit()
+        user_id = student.user_id
+        deletes.delete_student(student)
+        forget_identity(user_id)
         
         flash('Estudiante eliminado', 'success')
     except Exception as e:
@@ -238,7 +280,7 @@ def add_teacher():
     return redirect(url_for('teachers'))
 
 
-@app.route('/teacher/<teacher_id>/edit', methods=['GET', 'POST'])
+@app.route('/teacher/<id:teacher_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_teacher(teacher_id):
     if current_user.role != 'admin':
@@ -267,6 +309,7 @@ def edit_teacher(teacher_id):
                 teacher.end_contract_date = None
             
             db.session.commit()
+            forget_identity(teacher.user_id)
             flash('Profesor actualizado', 'success')
             return redirect(url_for('teachers'))
         except Exception as e:
@@ -276,7 +319,7 @@ def edit_teacher(teacher_id):
     return render_template('edit_teacher.html', teacher=teacher)
 
 
-@app.route('/teacher/<teacher_id>/delete', methods=['POST'])
+@app.route('/teacher/<id:teacher_id>/delete', methods=['POST'])
 @login_required
 def delete_teacher(teacher_id):
     if current_user.role != 'admin':
@@ -288,12 +331,9 @@ def delete_teacher(teacher_id):
             flash('Profesor no encontrado', 'error')
             return redirect(url_for('teachers'))
         
-        user = teacher.user
-        Enrollment.query.filter_by(teacher_id=teacher_id).delete()
-        Schedule.query.filter_by(teacher_id=teacher_id).delete()
-        db.session.delete(teacher)
-        db.session.delete(user)
-        db.session.commit()
+        user_id = teacher.user_id
+        deletes.delete_teacher(teacher)
+        forget_identity(user_id)
         
         flash('Profesor eliminado', 'success')
     except Exception as e:
@@ -339,7 +379,7 @@ def add_grade():
     return redirect(url_for('grades'))
 
 
-@app.route('/grade/<grade_id>/edit', methods=['GET', 'POST'])
+@app.route('/grade/<id:grade_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_grade(grade_id):
     if current_user.role != 'admin':
@@ -367,7 +407,7 @@ def edit_grade(grade_id):
     return render_template('edit_grade.html', grade=grade)
 
 
-@app.route('/grade/<grade_id>/delete', methods=['POST'])
+@app.route('/grade/<id:grade_id>/delete', methods=['POST'])
 @login_required
 def delete_grade(grade_id):
     if current_user.role != 'admin':
@@ -379,11 +419,7 @@ def delete_grade(grade_id):
             flash('Grado no encontrado', 'error')
             return redirect(url_for('grades'))
         
-        Student.query.filter_by(grade_id=grade_id).delete()
-        Enrollment.query.filter_by(grade_id=grade_id).delete()
-        Schedule.query.filter_by(grade_id=grade_id).delete()
-        db.session.delete(grade)
-        db.session.commit()
+        deletes.delete_grade(grade, after_chunk=lambda user_ids: forget_identity(*user_ids))
         
         flash('Grado eliminado', 'success')
     except Exception as e:
@@ -393,7 +429,7 @@ def delete_grade(grade_id):
     return redirect(url_for('grades'))
 
 
-@app.route('/student/<student_id>/assessments')
+@app.route('/student/<id:student_id>/assessments')
 @login_required
 def student_assessments(student_id):
     student = Student.query.get(student_id)
@@ -412,7 +448,7 @@ def add_assessment():
         return jsonify({'error': 'Denegado'}), 403
     
     try:
-        enrollment_id = request.form.get('enrollment_id')
+        enrollment_id = _form_id('enrollment_id')
         assessment_type = request.form.get('assessment_type')
         score = request.form.get('score')
         assessment_date = request.form.get('assessment_date')
@@ -426,6 +462,8 @@ def add_assessment():
         db.session.add(assessment)
         db.session.commit()
         flash('Evaluación registrada', 'success')
+    except InvalidId:
+        raise
     except Exception as e:
         db.session.rollback()
         flash(f'Error: {str(e)}', 'error')
@@ -440,19 +478,27 @@ def mark_attendance():
         return jsonify({'error': 'Denegado'}), 403
     
     try:
-        enrollment_id = request.form.get('enrollment_id')
-        attendance_date = request.form.get('attendance_date')
+        enrollment_id = _form_id('enrollment_id')
+        attendance_date = date.fromisoformat(request.form.get('attendance_date'))
         status = request.form.get('status')
+        if status not in ATTENDANCE_STATUSES:
+            flash('Error: Estado de asistencia inválido', 'error')
+            return redirect(request.referrer or url_for('dashboard'))
         
+        lock_enrollments([enrollment_id])
         existing = Attendance.query.filter_by(enrollment_id=enrollment_id, attendance_date=attendance_date).first()
         if existing:
+            record_attendance_changes([(enrollment_id, attendance_date, existing.status, status)])
             existing.status = status
         else:
             attendance = Attendance(enrollment_id=enrollment_id, attendance_date=attendance_date, status=status)
             db.session.add(attendance)
+            record_attendance_changes([(enrollment_id, attendance_date, None, status)])
         
         db.session.commit()
         flash('Asistencia registrada', 'success')
+    except InvalidId:
+        raise
     except Exception as e:
         db.session.rollback()
         flash(f'Error: {str(e)}', 'error')
@@ -463,28 +509,20 @@ def mark_attendance():
 @app.route('/schedule')
 @login_required
 def view_schedule():
-    schedules = Schedule.query.all()
     grades = Grade.query.order_by(Grade.level).all()
+    is_admin = current_user.role == 'admin'
+    sections = grade_sections('schedules_section.html', ('schedules', is_admin), grades, load_grade_schedules)
     
     # Get only teachers with active contracts (end_contract_date is NULL or in the future)
     today = date.today()
     teachers = Teacher.query.filter(
         (Teacher.end_contract_date == None) | (Teacher.end_contract_date >= today)
-    ).all()
+    ).options(joinedload(Teacher.user)).all()
     
-    # Organize schedules by grade
-    schedules_by_grade = {}
-    for grade in grades:
-        grade_schedules = []
-        for schedule in schedules:
-            if schedule.grade_id == grade.id:
-                grade_schedules.append(schedule)
-        schedules_by_grade[grade.id] = {
-            'grade': grade,
-            'schedules': grade_schedules
-        }
+    conflicts = load_schedule_conflicts() if is_admin else []
     
-    return render_template('schedules.html', schedules_by_grade=schedules_by_grade, teachers=teachers)
+    return render_template('schedules.html', sections=sections, grades=grades, teachers=teachers,
+                           conflicts=conflicts, resource_name=resource_name)
 
 
 @app.route('/schedule/add', methods=['POST'])
@@ -495,17 +533,23 @@ def add_schedule():
     
     try:
         day_of_week = request.form.get('day_of_week')
-        teacher_id = request.form.get('teacher_id')
-        grade_id = request.form.get('grade_id')
+        teacher_id = _form_id('teacher_id')
+        grade_id = _form_id('grade_id')
         start_time = request.form.get('start_time')
         end_time = request.form.get('end_time')
         classroom = request.form.get('classroom')
         
         schedule = Schedule(teacher_id=teacher_id, grade_id=grade_id, day_of_week=day_of_week, start_time=start_time, end_time=end_time, classroom=classroom)
+        conflict = find_conflict(schedule)
+        if conflict:
+            flash(conflict_message(conflict), 'error')
+            return redirect(url_for('view_schedule'))
         db.session.add(schedule)
         db.session.commit()
         
         flash('Horario agregado exitosamente', 'success')
+    except InvalidId:
+        raise
     except Exception as e:
         db.session.rollback()
         flash(f'Error: {str(e)}', 'error')
@@ -513,7 +557,7 @@ def add_schedule():
     return redirect(url_for('view_schedule'))
 
 
-@app.route('/schedule/<schedule_id>/edit', methods=['GET', 'POST'])
+@app.route('/schedule/<id:schedule_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_schedule(schedule_id):
     if current_user.role != 'admin':
@@ -527,8 +571,8 @@ def edit_schedule(schedule_id):
     
     if request.method == 'POST':
         try:
-            teacher_id = request.form.get('teacher_id')
-            grade_id = request.form.get('grade_id')
+            teacher_id = _form_id('teacher_id')
+            grade_id = _form_id('grade_id')
             day_of_week = request.form.get('day_of_week')
             start_time = request.form.get('start_time')
             end_time = request.form.get('end_time')
@@ -541,9 +585,17 @@ def edit_schedule(schedule_id):
             schedule.end_time = end_time
             schedule.classroom = classroom
             
+            conflict = find_conflict(schedule)
+            if conflict:
+                db.session.rollback()
+                flash(conflict_message(conflict), 'error')
+                return redirect(url_for('edit_schedule', schedule_id=schedule_id))
+            
             db.session.commit()
             flash('Horario actualizado', 'success')
             return redirect(url_for('view_schedule'))
+        except InvalidId:
+            raise
         except Exception as e:
             db.session.rollback()
             flash(f'Error: {str(e)}', 'error')
@@ -556,7 +608,7 @@ def edit_schedule(schedule_id):
     return render_template('edit_schedule.html', schedule=schedule, teachers=teachers, grades=grades)
 
 
-@app.route('/schedule/<schedule_id>/delete', methods=['POST'])
+@app.route('/schedule/<id:schedule_id>/delete', methods=['POST'])
 @login_required
 def delete_schedule(schedule_id):
     if current_user.role != 'admin':
@@ -579,7 +631,7 @@ def delete_schedule(schedule_id):
     return redirect(url_for('view_schedule'))
 
 
-@app.route('/api/teacher/<teacher_id>/specialization', methods=['GET'])
+@app.route('/api/teacher/<id:teacher_id>/specialization', methods=['GET'])
 @login_required
 def get_teacher_specialization(teacher_id):
     """API endpoint para obtener especialización de un profesor"""
@@ -612,36 +664,12 @@ def admin_all_grades():
         flash('Acceso denegado', 'error')
         return redirect(url_for('dashboard'))
     
-    # Get all enrollments with all data
-    enrollments = Enrollment.query.all()
-    
-    # Group by grade
-    grades_data = {}
-    for enrollment in enrollments:
-        grade = enrollment.grade
-        if grade.id not in grades_data:
-            grades_data[grade.id] = {
-                'grade': grade,
-                'enrollments': []
-            }
-        
-        # Calculate average
-        sem1 = float(enrollment.semester_1) if enrollment.semester_1 else 0
-        sem2 = float(enrollment.semester_2) if enrollment.semester_2 else 0
-        sem3 = float(enrollment.semester_3) if enrollment.semester_3 else 0
-        total_score = round((sem1 + sem2 + sem3) / 3, 2)
-        
-        grades_data[grade.id]['enrollments'].append({
-            'enrollment': enrollment,
-            'total_score': total_score
-        })
-    
     if request.method == 'POST':
         try:
             action = request.form.get('action')
             
             if action == 'update_grades':
-                enrollment_id = request.form.get('enrollment_id')
+                enrollment_id = _form_id('enrollment_id')
                 semester_1 = request.form.get('semester_1')
                 semester_2 = request.form.get('semester_2')
                 semester_3 = request.form.get('semester_3')
@@ -659,13 +687,76 @@ def admin_all_grades():
                     flash('Calificaciones actualizadas exitosamente', 'success')
                 else:
                     flash('Inscripción no encontrada', 'error')
+        except InvalidId:
+            raise
         except Exception as e:
             db.session.rollback()
             flash(f'Error: {str(e)}', 'error')
         
+        # Keep the filters and page the form was posted from
+        return redirect(url_for('admin_all_grades', **request.args))
+    
+    filters = {
+        'grade_id': request.args.get('grade_id') or None,
+        'subject_id': request.args.get('subject_id') or None,
+        'teacher_id': request.args.get('teacher_id') or None,
+        'failing': request.args.get('failing') or None,
+    }
+    per_page = request.args.get('per_page', ADMIN_GRADES_PAGE_SIZE, type=int)
+    per_page = max(1, min(per_page, ADMIN_GRADES_MAX_PAGE_SIZE))
+    after = request.args.get('after') or None
+    
+    grades_data, next_cursor = load_admin_grades_page(after=after, per_page=per_page, **filters)
+    
+    # Options for the filter form
+    all_grades = Grade.query.order_by(Grade.level).all()
+    all_subjects = Subject.query.order_by(Subject.name).all()
+    all_teachers = Teacher.query.options(joinedload(Teacher.user)).all()
+    
+    return render_template('admin_all_grades.html', grades_data=grades_data, filters=filters,
+                           next_cursor=next_cursor, is_first_page=after is None, per_page=per_page,
+                           all_grades=all_grades, all_subjects=all_subjects, all_teachers=all_teachers)
+
+
+@app.route('/export/<kind>.<fmt>')
+@login_required
+def export_data(kind, fmt):
+    if current_user.role != 'admin':
+        flash('Acceso denegado', 'error')
+        return redirect(url_for('dashboard'))
+    
+    if fmt not in EXPORT_FORMATS:
+        flash('Formato de exportación no soportado', 'error')
+        return redirect(url_for('admin_all_grades'))
+    
+    grade_id = request.args.get('grade_id') or None
+    subject_id = request.args.get('subject_id') or None
+    try:
+        # The rows are read while the response streams, too late to redirect
+        for value in (grade_id, subject_id):
+            if value:
+                parse_id(value)
+        if kind == 'grades':
+            rows = grades_rows(grade_id=grade_id, subject_id=subject_id)
+        elif kind == 'attendance':
+            start = request.args.get('start')
+            end = request.args.get('end')
+            rows = attendance_rows(start=date.fromisoformat(start) if start else None,
+                                   end=date.fromisoformat(end) if end else None,
+                                   grade_id=grade_id)
+        elif kind == 'roster':
+            rows = roster_rows(grade_id=grade_id)
+        else:
+            flash('Exportación no encontrada', 'error')
+            return redirect(url_for('admin_all_grades'))
+    except ValueError as e:
+        flash(f'Error: {str(e)}', 'error')
         return redirect(url_for('admin_all_grades'))
     
-    return render_template('admin_all_grades.html', grades_data=grades_data)
+    stream = stream_csv(rows) if fmt == 'csv' else stream_xlsx(rows)
+    filename = f'{kind}-{date.today().isoformat()}.{fmt}'
+    return Response(stream_with_context(stream), mimetype=EXPORT_FORMATS[fmt],
+                    headers={'Content-Disposition': f'attachment; filename={filename}'})
 
 
 @app.route('/teacher/grades', methods=['GET', 'POST'])
@@ -675,145 +766,46 @@ def teacher_grades():
         flash('Acceso denegado', 'error')
         return redirect(url_for('dashboard'))
     
-    teacher = Teacher.query.filter_by(user_id=current_user.id).first()
-    if not teacher:
+    teacher_id = current_user.profile_id
+    if not teacher_id:
         flash('Profesor no encontrado', 'error')
         return redirect(url_for('dashboard'))
     
-    # Get all grades
-    all_grades = Grade.query.order_by(Grade.level).all()
-    
-    # Get all students grouped by grade
-    grades_data = {}
-    for grade in all_grades:
-        # Get all students in this grade
-        students_in_grade = Student.query.filter_by(grade_id=grade.id).all()
-        
-        # Calculate total scores for each student
-        students_with_scores = []
-        for student in students_in_grade:
-            # Get enrollment with this teacher (if exists)
-            enrollment = Enrollment.query.filter_by(student_id=student.id, teacher_id=teacher.id).first()
-            
-            if enrollment:
-                # Calculate average from three semesters divided by 3
-                sem1 = float(enrollment.semester_1) if enrollment.semester_1 else 0
-                sem2 = float(enrollment.semester_2) if enrollment.semester_2 else 0
-                sem3 = float(enrollment.semester_3) if enrollment.semester_3 else 0
-                total_score = round((sem1 + sem2 + sem3) / 3, 2)
-                # Check if any semester has a value
-                has_grades = enrollment.semester_1 or enrollment.semester_2 or enrollment.semester_3
-                students_with_scores.append({
-                    'student': student,
-                    'enrollment': enrollment,
-                    'total_score': total_score,
-                    'has_enrollment': True,
-                    'has_grades': has_grades
-                })
-        
-        # Always add grade to grades_data, even if no students are enrolled yet
-        grades_data[grade.id] = {
-            'grade': grade,
-            'students_with_scores': students_with_scores
-        }
-    
     if request.method == 'POST':
         try:
             action = request.form.get('action')
             
             if action == 'update_grades':
-                enrollment_id = request.form.get('enrollment_id')
-                semester_1 = request.form.get('semester_1')
-                semester_2 = request.form.get('semester_2')
-                semester_3 = request.form.get('semester_3')
+                enrollment_id = _form_id('enrollment_id')
                 
-                enrollment = Enrollment.query.get(enrollment_id)
+                enrollment = Enrollment.query.filter_by(id=enrollment_id, teacher_id=teacher_id).first()
                 if enrollment:
-                    if semester_1:
-                        enrollment.semester_1 = float(semester_1)
-                        # Also save to Calificacion table for students to see
-                        existing_cal = Calificacion.query.filter_by(
-                            enrollment_id=enrollment_id,
-                            student_id=enrollment.student_id,
-                            subject_id=enrollment.subject_id,
-                            teacher_id=teacher.id,
-                            semester=1
-                        ).first()
-                        if existing_cal:
-                            existing_cal.calificacion = float(semester_1)
-                        else:
-                            cal = Calificacion(
-                                enrollment_id=enrollment_id,
-                                student_id=enrollment.student_id,
-                                subject_id=enrollment.subject_id,
-                                teacher_id=teacher.id,
-                                semester=1,
-                                calificacion=float(semester_1)
-                            )
-                            db.session.add(cal)
-                    
-                    if semester_2:
-                        enrollment.semester_2 = float(semester_2)
-                        existing_cal = Calificacion.query.filter_by(
-                            enrollment_id=enrollment_id,
-                            student_id=enrollment.student_id,
-                            subject_id=enrollment.subject_id,
-                            teacher_id=teacher.id,
-                            semester=2
-                        ).first()
-                        if existing_cal:
-                            existing_cal.calificacion = float(semester_2)
-                        else:
-                            cal = Calificacion(
-                                enrollment_id=enrollment_id,
-                                student_id=enrollment.student_id,
-                                subject_id=enrollment.subject_id,
-                                teacher_id=teacher.id,
-                                semester=2,
-                                calificacion=float(semester_2)
-                            )
-                            db.session.add(cal)
-                    
-                    if semester_3:
-                        enrollment.semester_3 = float(semester_3)
-                        existing_cal = Calificacion.query.filter_by(
-                            enrollment_id=enrollment_id,
-                            student_id=enrollment.student_id,
-                            subject_id=enrollment.subject_id,
-                            teacher_id=teacher.id,
-                            semester=3
-                        ).first()
-                        if existing_cal:
-                            existing_cal.calificacion = float(semester_3)
-                        else:
-                            cal = Calificacion(
-                                enrollment_id=enrollment_id,
-                                student_id=enrollment.student_id,
-                                subject_id=enrollment.subject_id,
-                                teacher_id=teacher.id,
-                                semester=3,
-                                calificacion=float(semester_3)
-                            )
-                            db.session.add(cal)
+                    entry = {}
+                    for semester in SEMESTERS:
+                        value = request.form.get(f'semester_{semester}')
+                        if value:
+                            entry[semester] = (float(value), None)
                     
+                    # Also saved to Calificacion table for students to see
+                    save_semester_grades([enrollment], {enrollment.id: entry})
                     db.session.commit()
                     flash('Calificaciones registradas exitosamente', 'success')
                 else:
                     flash('Error: Inscripción no encontrada', 'error')
             
             elif action == 'add_student':
-                student_id = request.form.get('student_id')
-                grade_id = request.form.get('grade_id')
-                subject_id = request.form.get('subject_id')
+                student_id = _form_id('student_id')
+                grade_id = _form_id('grade_id')
+                subject_id = _form_id('subject_id')
                 
                 student = Student.query.get(student_id)
                 if student:
                     # Check if enrollment already exists
-                    existing = Enrollment.query.filter_by(student_id=student_id, teacher_id=teacher.id).first()
+                    existing = Enrollment.query.filter_by(student_id=student_id, teacher_id=teacher_id).first()
                     if not existing:
                         enrollment = Enrollment(
                             student_id=student_id,
-                            teacher_id=teacher.id,
+                            teacher_id=teacher_id,
                             subject_id=subject_id,
                             grade_id=grade_id,
                             status='enrolled'
@@ -827,11 +819,10 @@ def teacher_grades():
                     flash('Estudiante no encontrado', 'error')
             
             elif action == 'delete_enrollment':
-                enrollment_id = request.form.get('enrollment_id')
+                enrollment_id = _form_id('enrollment_id')
                 enrollment = Enrollment.query.get(enrollment_id)
                 if enrollment:
-                    db.session.delete(enrollment)
-                    db.session.commit()
+                    deletes.delete_enrollment(enrollment)
                     flash('Estudiante removido exitosamente', 'success')
                 else:
                     flash('Inscripción no encontrada', 'error')
@@ -840,8 +831,8 @@ def teacher_grades():
                 name = request.form.get('name')
                 apellido_paterno = request.form.get('apellido_paterno')
                 apellido_materno = request.form.get('apellido_materno')
-                grade_id = request.form.get('grade_id')
-                subject_id = request.form.get('subject_id')
+                grade_id = _form_id('grade_id')
+                subject_id = _form_id('subject_id')
                 semester_1 = request.form.get('semester_1')
                 semester_2 = request.form.get('semester_2')
                 semester_3 = request.form.get('semester_3')
@@ -867,7 +858,7 @@ def teacher_grades():
                     # Create enrollment with grades
                     enrollment = Enrollment(
                         student_id=student.id,
-                        teacher_id=teacher.id,
+                        teacher_id=teacher_id,
                         subject_id=subject_id,
                         grade_id=grade_id,
                         status='enrolled',
@@ -884,7 +875,7 @@ def teacher_grades():
                             enrollment_id=enrollment.id,
                             student_id=student.id,
                             subject_id=subject_id,
-                            teacher_id=teacher.id,
+                            teacher_id=teacher_id,
                             semester=1,
                             calificacion=float(semester_1)
                         )
@@ -895,7 +886,7 @@ def teacher_grades():
                             enrollment_id=enrollment.id,
                             student_id=student.id,
                             subject_id=subject_id,
-                            teacher_id=teacher.id,
+                            teacher_id=teacher_id,
                             semester=2,
                             calificacion=float(semester_2)
                         )
@@ -906,7 +897,7 @@ def teacher_grades():
                             enrollment_id=enrollment.id,
                             student_id=student.id,
                             subject_id=subject_id,
-                            teacher_id=teacher.id,
+                            teacher_id=teacher_id,
                             semester=3,
                             calificacion=float(semester_3)
                         )
@@ -914,73 +905,100 @@ def teacher_grades():
                     
                     db.session.commit()
                     flash(f'Estudiante {name} creado y calificaciones guardadas exitosamente', 'success')
+        except InvalidId:
+            raise
         except Exception as e:
             db.session.rollback()
             flash(f'Error: {str(e)}', 'error')
         
         return redirect(url_for('teacher_grades'))
     
-    return render_template('teacher_grades.html', grades_data=grades_data, all_grades=all_grades, all_subjects=Subject.query.all())
+    sections = grade_sections('teacher_grades_section.html', ('teacher_grades', teacher_id),
+                              Grade.query.order_by(Grade.level).all(),
+                              lambda grade_ids: load_teacher_roster(teacher_id, grade_ids)[1],
+                              load_context=lambda: {'all_subjects': Subject.query.all()})
+    return render_template('teacher_grades.html', sections=sections)
 
 
-@app.route('/teacher/attendance', methods=['GET', 'POST'])
+def _parse_grade_matrix(form, enrollments):
+    """Validate the enrollment x semester cells of the bulk grade form in one pass.
+
+    Returns (grades, errors) where grades is the mapping save_semester_grades expects.
+    """
+    grades = {}
+    errors = []
+    for enrollment in enrollments:
+        entry = {}
+        for semester in SEMESTERS:
+            value = (form.get(f'semester_{semester}_{enrollment.id}') or '').strip()
+            if not value:
+                continue
+            try:
+                score = float(value)
+            except ValueError:
+                score = None
+            if score is None or not 0 <= score <= 100:
+                errors.append(f'{enrollment.student.user.name} (semestre {semester}): {value}')
+                continue
+            note = (form.get(f'nota_{semester}_{enrollment.id}') or '').strip() or None
+            entry[semester] = (score, note)
+        if entry:
+            grades[enrollment.id] = entry
+    return grades, errors
+
+
+@app.route('/teacher/grades/bulk', methods=['GET', 'POST'])
 @login_required
-def teacher_attendance():
+def teacher_bulk_grades():
     if current_user.role != 'teacher':
         flash('Acceso denegado', 'error')
         return redirect(url_for('dashboard'))
     
-    teacher = Teacher.query.filter_by(user_id=current_user.id).first()
-    if not teacher:
+    teacher_id = current_user.profile_id
+    if not teacher_id:
         flash('Profesor no encontrado', 'error')
         return redirect(url_for('dashboard'))
     
-    # Get all enrollments for this teacher
-    all_enrollments = Enrollment.query.filter_by(teacher_id=teacher.id).all()
+    grade_id = request.values.get('grade_id') or None
+    grades_data = load_teacher_gradebook(teacher_id, grade_id)
     
-    # Get only enrollments from this teacher's courses, grouped by grade
-    grades_data = {}
-    for enrollment in all_enrollments:
-        grade = enrollment.grade
-        if grade.id not in grades_data:
-            # Get only enrollments from THIS TEACHER in this grade
-            enrollments = Enrollment.query.filter_by(teacher_id=teacher.id, grade_id=grade.id).all()
+    if request.method == 'POST':
+        try:
+            enrollments = [enrollment for data in grades_data.values() for enrollment in data['enrollments']]
+            grades, errors = _parse_grade_matrix(request.form, enrollments)
             
-            # Calculate attendance statistics for each enrollment
-            enrollments_with_stats = []
-            for enr in enrollments:
-                attendance_records = Attendance.query.filter_by(enrollment_id=enr.id).order_by(Attendance.attendance_date.desc()).all()
-                total_records = len(attendance_records)
-                present_count = len([a for a in attendance_records if a.status == 'present'])
-                absent_count = len([a for a in attendance_records if a.status == 'absent'])
-                late_count = len([a for a in attendance_records if a.status == 'late'])
-                excused_count = len([a for a in attendance_records if a.status == 'excused'])
-                
-                attendance_percentage = round((present_count / total_records * 100), 1) if total_records > 0 else 0
-                # Get all attendance records sorted by date (most recent first)
-                all_attendance = sorted(attendance_records, key=lambda x: x.attendance_date, reverse=True)
-                recent_attendance = all_attendance[:10]  # Show last 10
-                
-                enrollments_with_stats.append({
-                    'enrollment': enr,
-                    'total_records': total_records,
-                    'present_count': present_count,
-                    'absent_count': absent_count,
-                    'late_count': late_count,
-                    'excused_count': excused_count,
-                    'attendance_percentage': attendance_percentage,
-                    'recent_attendance': recent_attendance,
-                    'all_attendance': all_attendance  # Add all records for expanded view
-                })
+            if errors:
+                # Nothing is saved until every cell is valid
+                flash('Calificaciones inválidas (0-100): ' + ', '.join(errors), 'error')
+                return render_template('teacher_bulk_grades.html', grades_data=grades_data, grade_id=grade_id, form=request.form)
             
-            grades_data[grade.id] = {
-                'grade': grade,
-                'enrollments': enrollments_with_stats
-            }
+            saved = save_semester_grades(enrollments, grades, with_notes=True)
+            db.session.commit()
+            flash(f'Calificaciones de {saved} estudiantes registradas exitosamente', 'success')
+        except Exception as e:
+            db.session.rollback()
+            flash(f'Error: {str(e)}', 'error')
+        
+        return redirect(url_for('teacher_bulk_grades', grade_id=grade_id))
+    
+    return render_template('teacher_bulk_grades.html', grades_data=grades_data, grade_id=grade_id, form=None)
+
+
+@app.route('/teacher/attendance', methods=['GET', 'POST'])
+@login_required
+def teacher_attendance():
+    if current_user.role != 'teacher':
+        flash('Acceso denegado', 'error')
+        return redirect(url_for('dashboard'))
+    
+    teacher_id = current_user.profile_id
+    if not teacher_id:
+        flash('Profesor no encontrado', 'error')
+        return redirect(url_for('dashboard'))
     
     if request.method == 'POST':
         try:
-            enrollment_id = request.form.get('enrollment_id')
+            enrollment_id = _form_id('enrollment_id')
             attendance_date = request.form.get('attendance_date')
             status = request.form.get('status')
             
@@ -988,27 +1006,123 @@ def teacher_attendance():
             if not status:
                 flash('Error: Por favor selecciona un estado de asistencia', 'error')
                 return redirect(url_for('teacher_attendance'))
+            if status not in ATTENDANCE_STATUSES:
+                flash('Error: Estado de asistencia inválido', 'error')
+                return redirect(url_for('teacher_attendance'))
             
             # If no date provided, use today's date
-            if not attendance_date:
-                attendance_date = date.today()
+            attendance_date = date.fromisoformat(attendance_date) if attendance_date else date.today()
             
+            lock_enrollments([enrollment_id])
             existing = Attendance.query.filter_by(enrollment_id=enrollment_id, attendance_date=attendance_date).first()
             if existing:
+                record_attendance_changes([(enrollment_id, attendance_date, existing.status, status)])
                 existing.status = status
             else:
                 attendance = Attendance(enrollment_id=enrollment_id, attendance_date=attendance_date, status=status)
                 db.session.add(attendance)
+                record_attendance_changes([(enrollment_id, attendance_date, None, status)])
             
             db.session.commit()
             flash('Asistencia registrada exitosamente', 'success')
+        except InvalidId:
+            raise
         except Exception as e:
             db.session.rollback()
             flash(f'Error: {str(e)}', 'error')
         
         return redirect(url_for('teacher_attendance'))
     
-    return render_template('teacher_attendance.html', grades_data=grades_data, today=date.today())
+    today = date.today()
+    sections = grade_sections('teacher_attendance_section.html', ('teacher_attendance', teacher_id, today),
+                              load_teaching_grades(teacher_id),
+                              lambda grade_ids: load_teacher_attendance(teacher_id, grade_ids), today=today)
+    return render_template('teacher_attendance.html', sections=sections)
+
+
+@app.route('/teacher/attendance/roll-call', methods=['POST'])
+@login_required
+def teacher_roll_call():
+    if current_user.role != 'teacher':
+        flash('Acceso denegado', 'error')
+        return redirect(url_for('dashboard'))
+    
+    teacher_id = current_user.profile_id
+    if not teacher_id:
+        flash('Profesor no encontrado', 'error')
+        return redirect(url_for('dashboard'))
+    
+    try:
+        grade_id = _form_id('grade_id')
+        attendance_date = request.form.get('attendance_date')
+        attendance_date = date.fromisoformat(attendance_date) if attendance_date else date.today()
+        
+        # Only this teacher's enrollments in the grade are accepted; they stay
+        # locked until the commit, so a concurrent roll call waits for this one
+        enrollment_ids = lock_enrollments(
+            row.id for row in db.session.query(Enrollment.id).filter_by(teacher_id=teacher_id, grade_id=grade_id)
+        )
+        
+        rows = []
+        for enrollment_id in enrollment_ids:
+            status = request.form.get(f'status_{enrollment_id}')
+            if status in ATTENDANCE_STATUSES:
+                rows.append({
+                    'enrollment_id': enrollment_id,
+                    'attendance_date': attendance_date,
+                    'status': status
+                })
+        
+        if not rows:
+            flash('Error: Por favor selecciona un estado de asistencia', 'error')
+            return redirect(url_for('teacher_attendance'))
+        
+        # Statuses being replaced, so the rollups move counts instead of adding them
+        previous = dict(
+            db.session.query(Attendance.enrollment_id, Attendance.status)
+            .filter(Attendance.enrollment_id.in_(enrollment_ids), Attendance.attendance_date == attendance_date)
+        )
+        upsert(Attendance, rows, ['enrollment_id', 'attendance_date'], ['status'])
+        record_attendance_changes([(row['enrollment_id'], attendance_date, previous.get(row['enrollment_id']), row['status'])
+                                   for row in rows])
+        db.session.commit()
+        flash(f'Asistencia registrada para {len(rows)} estudiantes', 'success')
+    except InvalidId:
+        raise
+    except Exception as e:
+        db.session.rollback()
+        flash(f'Error: {str(e)}', 'error')
+    
+    return redirect(url_for('teacher_attendance'))
+
+
+@app.route('/teacher/attendance/<id:enrollment_id>/history')
+@login_required
+def teacher_attendance_history(enrollment_id):
+    if current_user.role != 'teacher':
+        flash('Acceso denegado', 'error')
+        return redirect(url_for('dashboard'))
+    
+    enrollment = (
+        Enrollment.query
+        .options(joinedload(Enrollment.student).joinedload(Student.user),
+                 joinedload(Enrollment.subject), joinedload(Enrollment.grade))
+        .filter_by(id=enrollment_id, teacher_id=current_user.profile_id)
+        .first()
+    )
+    if not enrollment:
+        flash('Inscripción no encontrada', 'error')
+        return redirect(url_for('teacher_attendance'))
+    
+    after = request.args.get('after') or None
+    try:
+        records, next_cursor = load_attendance_history(enrollment.id, after=after)
+    except ValueError:
+        flash('Página de historial inválida', 'error')
+        return redirect(url_for('teacher_attendance_history', enrollment_id=enrollment.id))
+    summary = AttendanceSummary.query.get(enrollment.id)
+    return render_template('teacher_attendance_history.html', enrollment=enrollment, records=records, summary=summary,
+                           next_cursor=next_cursor, is_first_page=after is None)
 
 
 @app.route('/student/my-courses')
@@ -1018,32 +1132,15 @@ def student_my_courses():
         flash('Acceso denegado', 'error')
         return redirect(url_for('dashboard'))
     
-    student = Student.query.filter_by(user_id=current_user.id).first()
-    if not student:
+    if not current_user.profile_id:
         flash('Estudiante no encontrado', 'error')
         return redirect(url_for('dashboard'))
     
-    # Get all enrollments for this student
-    enrollments = Enrollment.query.filter_by(student_id=student.id).all()
-    
-    # Get schedules for the student's grade
-    schedules = Schedule.query.filter_by(grade_id=student.grade_id).all()
+    def render():
+        student = current_profile()
+        return render_template('student_my_courses.html', courses_data=load_student_courses(student), student=student)
     
-    # Organize enrollments with their schedules
-    courses_data = []
-    for enrollment in enrollments:
-        teacher = enrollment.teacher
-        subject = enrollment.subject
-        # Get schedules for this teacher in this grade
-        teacher_schedules = [s for s in schedules if s.teacher_id == teacher.id]
-        courses_data.append({
-            'teacher': teacher,
-            'subject': subject,
-            'grade': enrollment.grade,
-            'schedules': teacher_schedules
-        })
-    
-    return render_template('student_my_courses.html', courses_data=courses_data, student=student)
+    return conditional_student_page('student_my_courses', render)
 
 
 @app.route('/student/my-grades')
@@ -1053,45 +1150,17 @@ def student_my_grades():
         flash('Acceso denegado', 'error')
         return redirect(url_for('dashboard'))
     
-    student = Student.query.filter_by(user_id=current_user.id).first()
-    if not student:
+    if not current_user.profile_id:
         flash('Estudiante no encontrado', 'error')
         return redirect(url_for('dashboard'))
     
-    # Get all grades from calificaciones table for this student
-    calificaciones = Calificacion.query.filter_by(student_id=student.id).order_by(Calificacion.fecha_calificacion.desc()).all()
-    
-    # Group by subject
-    subjects_grades = {}
-    total_promedio = 0
-    total_calificaciones = 0
-    
-    for cal in calificaciones:
-        subject_id = cal.subject_id
-        if subject_id not in subjects_grades:
-            subjects_grades[subject_id] = {
-                'subject': cal.subject.name,
-                'teacher': cal.teacher,
-                'grades': []
-            }
-        subjects_grades[subject_id]['grades'].append({
-            'calificacion': float(cal.calificacion) if cal.calificacion else 0,
-            'semester': cal.semester,
-            'fecha': cal.fecha_calificacion,
-            'nota_texto': cal.nota_texto
-        })
-        
-        if cal.calificacion:
-            total_promedio += float(cal.calificacion)
-            total_calificaciones += 1
-    
-    # Convert to list
-    grades_data = list(subjects_grades.values())
-    
-    # Calculate general average
-    general_average = round(total_promedio / total_calificaciones, 2) if total_calificaciones > 0 else 0
+    def render():
+        student = current_profile()
+        key = (student.id,) + student_versions(student.id)
+        grades_data, general_average = report_cards.get_or_set(key, lambda: load_report_card(student.id))
+        return render_template('student_my_grades.html', grades_data=grades_data, student=student, general_average=general_average)
     
-    return render_template('student_my_grades.html', grades_data=grades_data, student=student, general_average=general_average)
+    return conditional_student_page('student_my_grades', render)
 
 
 @app.route('/admin/credentials', methods=['GET', 'POST'])
@@ -1103,7 +1172,7 @@ def admin_credentials():
     
     if request.method == 'POST':
         try:
-            user_id = request.form.get('user_id')
+            user_id = _form_id('user_id')
             email = request.form.get('email')
             password = request.form.get('password')
             
@@ -1123,7 +1192,10 @@ def admin_credentials():
                 user.password = hash_password(password)
             
             db.session.commit()
+            forget_identity(user.id)
             flash(f'Credenciales de {user.name} actualizadas correctamente', 'success')
+        except InvalidId:
+            raise
         except Exception as e:
             db.session.rollback()
             flash(f'Error: {str(e)}', 'error')
@@ -1144,7 +1216,7 @@ def admin_teacher_credentials():
     
     if request.method == 'POST':
         try:
-            user_id = request.form.get('user_id')
+            user_id = _form_id('user_id')
             email = request.form.get('email')
             password = request.form.get('password')
             
@@ -1164,7 +1236,10 @@ def admin_teacher_credentials():
                 user.password = hash_password(password)
             
             db.session.commit()
+            forget_identity(user.id)
             flash(f'Credenciales de {user.name} actualizadas correctamente', 'success')
+        except InvalidId:
+            raise
         except Exception as e:
             db.session.rollback()
             flash(f'Error: {str(e)}', 'error')
@@ -1190,11 +1265,14 @@ def my_profile():
                 flash('El email ya está en uso', 'error')
                 return redirect(url_for('my_profile'))
             
-            current_user.email = email
+            # current_user is a cached snapshot; write to the row itself
+            user = User.query.get(current_user.id)
+            user.email = email
             if password:
-                current_user.password = hash_password(password)
+                user.password = hash_password(password)
             
             db.session.commit()
+            remember_identity(user)
             flash('Tu perfil ha sido actualizado correctamente', 'success')
         except Exception as e:
             db.session.rollback()
@@ -1243,7 +1321,7 @@ def add_subject():
     return redirect(url_for('subjects'))
 
 
-@app.route('/subject/<subject_id>/edit', methods=['GET', 'POST'])
+@app.route('/subject/<id:subject_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_subject(subject_id):
     if current_user.role != 'admin':
@@ -1270,7 +1348,7 @@ def edit_subject(subject_id):
     return render_template('edit_subject.html', subject=subject)
 
 
-@app.route('/subject/<subject_id>/delete', methods=['POST'])
+@app.route('/subject/<id:subject_id>/delete', methods=['POST'])
 @login_required
 def delete_subject(subject_id):
     if current_user.role != 'admin':
@@ -1280,8 +1358,7 @@ def delete_subject(subject_id):
     subject = Subject.query.get(subject_id)
     if subject:
         try:
-            db.session.delete(subject)
-            db.session.commit()
+            deletes.delete_subject(subject)
             flash('Materia eliminada exitosamente', 'success')
         except Exception as e:
             db.session.rollback()
@@ -1309,10 +1386,10 @@ def add_enrollment():
         return jsonify({'error': 'Denegado'}), 403
     
     try:
-        student_id = request.form.get('student_id')
-        teacher_id = request.form.get('teacher_id')
-        subject_id = request.form.get('subject_id')
-        grade_id = request.form.get('grade_id')
+        student_id = _form_id('student_id')
+        teacher_id = _form_id('teacher_id')
+        subject_id = _form_id('subject_id')
+        grade_id = _form_id('grade_id')
         
         existing = Enrollment.query.filter_by(
             student_id=student_id,
@@ -1333,6 +1410,8 @@ def add_enrollment():
         db.session.add(enrollment)
         db.session.commit()
         flash('Inscripción agregada exitosamente', 'success')
+    except InvalidId:
+        raise
     except Exception as e:
         db.session.rollback()
         flash(f'Error: {str(e)}', 'error')
@@ -1340,7 +1419,7 @@ def add_enrollment():
     return redirect(url_for('enrollments'))
 
 
-@app.route('/enrollment/<enrollment_id>/edit', methods=['GET', 'POST'])
+@app.route('/enrollment/<id:enrollment_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_enrollment(enrollment_id):
     if current_user.role != 'admin':
@@ -1366,7 +1445,7 @@ def edit_enrollment(enrollment_id):
     return render_template('edit_enrollment.html', enrollment=enrollment)
 
 
-@app.route('/enrollment/<enrollment_id>/delete', methods=['POST'])
+@app.route('/enrollment/<id:enrollment_id>/delete', methods=['POST'])
 @login_required
 def delete_enrollment(enrollment_id):
     if current_user.role != 'admin':
@@ -1376,8 +1455,7 @@ def delete_enrollment(enrollment_id):
     enrollment = Enrollment.query.get(enrollment_id)
     if enrollment:
         try:
-            db.session.delete(enrollment)
-            db.session.commit()
+            deletes.delete_enrollment(enrollment)
             flash('Inscripción eliminada exitosamente', 'success')
         except Exception as e:
             db.session.rollback()
@@ -1405,8 +1483,8 @@ def add_teacher_subject():
         return jsonify({'error': 'Denegado'}), 403
     
     try:
-        teacher_id = request.form.get('teacher_id')
-        subject_id = request.form.get('subject_id')
+        teacher_id = _form_id('teacher_id')
+        subject_id = _form_id('subject_id')
         
         existing = TeacherSubject.query.filter_by(
             teacher_id=teacher_id,
@@ -1421,6 +1499,8 @@ def add_teacher_subject():
         db.session.add(ts)
         db.session.commit()
         flash('Asignación agregada exitosamente', 'success')
+    except InvalidId:
+        raise
     except Exception as e:
         db.session.rollback()
         flash(f'Error: {str(e)}', 'error')
@@ -1428,7 +1508,7 @@ def add_teacher_subject():
     return redirect(url_for('teacher_subjects'))
 
 
-@app.route('/teacher-subject/<ts_id>/delete', methods=['POST'])
+@app.route('/teacher-subject/<id:ts_id>/delete', methods=['POST'])
 @login_required
 def delete_teacher_subject(ts_id):
     if current_user.role != 'admin':
@@ -1449,7 +1529,7 @@ def delete_teacher_subject(ts_id):
 
 
 # ========== ASSESSMENTS CRUD COMPLETO ==========
-@app.route('/assessment/<assessment_id>/edit', methods=['GET', 'POST'])
+@app.route('/assessment/<id:assessment_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_assessment(assessment_id):
     if current_user.role != 'teacher':
@@ -1476,7 +1556,7 @@ def edit_assessment(assessment_id):
     return render_template('edit_assessment.html', assessment=assessment)
 
 
-@app.route('/assessment/<assessment_id>/delete', methods=['POST'])
+@app.route('/assessment/<id:assessment_id>/delete', methods=['POST'])
 @login_required
 def delete_assessment(assessment_id):
     if current_user.role != 'teacher':
@@ -1497,7 +1577,7 @@ def delete_assessment(assessment_id):
 
 
 # ========== ATTENDANCE CRUD COMPLETO ==========
-@app.route('/attendance/<attendance_id>/edit', methods=['GET', 'POST'])
+@app.route('/attendance/<id:attendance_id>/edit', methods=['GET', 'POST'])
 @login_required
 def edit_attendance(attendance_id):
     if current_user.role != 'teacher':
@@ -1511,7 +1591,14 @@ def edit_attendance(attendance_id):
     
     if request.method == 'POST':
         try:
-            attendance.status = request.form.get('status')
+            status = request.form.get('status')
+            if status not in ATTENDANCE_STATUSES:
+                flash('Error: Estado de asistencia inválido', 'error')
+                return redirect(url_for('teacher_attendance'))
+            lock_enrollments([attendance.enrollment_id])
+            db.session.refresh(attendance)
+            record_attendance_changes([(attendance.enrollment_id, attendance.attendance_date, attendance.status, status)])
+            attendance.status = status
             attendance.notes = request.form.get('notes')
             db.session.commit()
             flash('Asistencia actualizada exitosamente', 'success')
@@ -1523,7 +1610,7 @@ def edit_attendance(attendance_id):
     return render_template('edit_attendance.html', attendance=attendance)
 
 
-@app.route('/attendance/<attendance_id>/delete', methods=['POST'])
+@app.route('/attendance/<id:attendance_id>/delete', methods=['POST'])
 @login_required
 def delete_attendance(attendance_id):
     if current_user.role != 'teacher':
@@ -1533,6 +1620,9 @@ def delete_attendance(attendance_id):
     attendance = Attendance.query.get(attendance_id)
     if attendance:
         try:
+            lock_enrollments([attendance.enrollment_id])
+            db.session.refresh(attendance)
+            record_attendance_changes([(attendance.enrollment_id, attendance.attendance_date, attendance.status, None)])
             db.session.delete(attendance)
             db.session.commit()
             flash('Registro de asistencia eliminado exitosamente', 'success')
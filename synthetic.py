@@ -0,0 +1,255 @@
+"""
+Synthetic - Deterministic school generator for benchmarks
+"""
+
+import math
+import random
+import uuid
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from models import (db, User, Grade, Subject, Student, Teacher, TeacherSubject, Enrollment, Attendance,
+                    Schedule, Calificacion, ATTENDANCE_STATUSES, SEMESTERS, SCHOOL_DAYS, semester_average)
+from auth import hash_password
+from cache import rows_written
+from rollups import rebuild_attendance_rollups
+from timetable import Course, school_periods
+
+# Rows per INSERT executemany; one commit per chunk keeps memory flat
+INSERT_CHUNK_SIZE = 5000
+# Every generated account logs in with this password
+SYNTHETIC_PASSWORD = '123456'
+SYNTHETIC_DOMAIN = 'bench.local'
+ADMIN_EMAIL = f'admin@{SYNTHETIC_DOMAIN}'
+
+# Mostly present, like a real roll
+ATTENDANCE_WEIGHTS = (85, 7, 5, 3)
+
+
+class SchoolGenerator:
+    """Build a school of the requested size with Core executemany inserts.
+
+    Each student is enrolled in subjects_per_student subjects of their
+    grade, taught by the teacher assigned to that (grade, subject) pair.
+    Attendance is spread over the most recent school days and
+    calificaciones fill semester 1 for every enrollment before semester 2,
+    mirroring how a school year accumulates data. The same seed always
+    produces the same ids, names and scores.
+    """
+
+    def __init__(self, grades=60, students=30000, teachers=200, subjects=12, subjects_per_student=6,
+                 attendance=500000, calificaciones=200000, seed=1, echo=None):
+        if subjects_per_student > subjects:
+            raise ValueError('subjects_per_student no puede ser mayor que subjects')
+        self.grades = grades
+        self.students = students
+        self.teachers = teachers
+        self.subjects = subjects
+        self.subjects_per_student = subjects_per_student
+        self.attendance = attendance
+        self.calificaciones = calificaciones
+        self.rng = random.Random(seed)
+        self.echo = echo or (lambda message: None)
+        self.now = datetime.utcnow()
+        self.today = date.today()
+
+    def _uuid(self):
+        return str(uuid.UUID(int=self.rng.getrandbits(128), version=4))
+
+    def _insert_chunk(self, table, chunk):
+        db.session.execute(table.insert(), chunk)
+        rows_written(db.session, table.name, chunk)
+        db.session.commit()
+        return len(chunk)
+
+    def _insert(self, model, rows):
+        """Insert an iterable of row dicts in INSERT_CHUNK_SIZE chunks; returns the count."""
+        table = model.__table__
+        count = 0
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) >= INSERT_CHUNK_SIZE:
+                count += self._insert_chunk(table, chunk)
+                chunk = []
+        if chunk:
+            count += self._insert_chunk(table, chunk)
+        self.echo(f'{table.name}: {count} rows')
+        return count
+
+    def _users(self, role, prefix, count, password_hash):
+        ids = [self._uuid() for _ in range(count)]
+        rows = ({
+            'id': user_id,
+            'email': f'{prefix}{i}@{SYNTHETIC_DOMAIN}',
+            'password': password_hash,
+            'name': f'{prefix.capitalize()} {i}',
+            'role': role,
+            'created_at': self.now
+        } for i, user_id in enumerate(ids))
+        self._insert(User, rows)
+        return ids
+
+    def _school_days(self, count):
+        """The most recent count weekdays, oldest first."""
+        days = []
+        day = self.today
+        while len(days) < count:
+            if day.weekday() < 5:
+                days.append(day)
+            day -= timedelta(days=1)
+        return days[::-1]
+
+    def run(self):
+        """Generate the school; returns {table name: rows inserted}."""
+        counts = {}
+        password_hash = hash_password(SYNTHETIC_PASSWORD)
+
+        admin_id = self._uuid()
+        counts['users'] = self._insert(User, [{
+            'id': admin_id, 'email': ADMIN_EMAIL, 'password': password_hash,
+            'name': 'Administrador', 'role': 'admin', 'created_at': self.now
+        }])
+
+        grade_ids = [self._uuid() for _ in range(self.grades)]
+        seats = math.ceil(self.students / max(self.grades, 1))
+        counts['grades'] = self._insert(Grade, ({
+            'id': grade_id, 'name': f'Grado {i + 1}', 'level': i + 1,
+            'max_students': max(seats, 40), 'created_at': self.now
+        } for i, grade_id in enumerate(grade_ids)))
+
+        subject_ids = [self._uuid() for _ in range(self.subjects)]
+        counts['subjects'] = self._insert(Subject, ({
+            'id': subject_id, 'name': f'Materia {i + 1}', 'code': f'MAT{i + 1:03d}',
+            'credits': 3, 'created_at': self.now
+        } for i, subject_id in enumerate(subject_ids)))
+
+        teacher_user_ids = self._users('teacher', 'teacher', self.teachers, password_hash)
+        counts['users'] += len(teacher_user_ids)
+        teacher_ids = [self._uuid() for _ in teacher_user_ids]
+        counts['teachers'] = self._insert(Teacher, ({
+            'id': teacher_id, 'user_id': user_id, 'teacher_code': f'DOC{i:05d}',
+            'specialization': f'Materia {i % self.subjects + 1}', 'apellido_paterno': f'Paterno{i}',
+            'apellido_materno': f'Materno{i}', 'hire_date': self.today, 'status': 'active', 'created_at': self.now
+        } for i, (teacher_id, user_id) in enumerate(zip(teacher_ids, teacher_user_ids))))
+
+        # One teacher per (grade, subject), spread round-robin
+        assignments = {}
+        for g in range(self.grades):
+            for s in range(self.subjects):
+                assignments[g, s] = teacher_ids[(g * self.subjects + s) % len(teacher_ids)]
+        pairs = sorted({(teacher_id, subject_ids[s]) for (_, s), teacher_id in assignments.items()})
+        counts['teacher_subjects'] = self._insert(TeacherSubject, ({
+            'id': self._uuid(), 'teacher_id': teacher_id, 'subject_id': subject_id, 'created_at': self.now
+        } for teacher_id, subject_id in pairs))
+
+        counts['schedules'] = self._insert(Schedule, ({
+            'id': self._uuid(), 'teacher_id': assignments[g, s], 'grade_id': grade_ids[g],
+            'day_of_week': SCHOOL_DAYS[s % len(SCHOOL_DAYS)], 'start_time': f'{8 + s // len(SCHOOL_DAYS):02d}:00',
+            'end_time': f'{9 + s // len(SCHOOL_DAYS):02d}:00', 'start_minute': (8 + s // len(SCHOOL_DAYS)) * 60,
+            'end_minute': (9 + s // len(SCHOOL_DAYS)) * 60, 'classroom': f'A{g + 1}', 'subject_id': subject_ids[s],
+            'created_at': self.now
+        } for g in range(self.grades) for s in range(self.subjects)))
+
+        student_user_ids = self._users('student', 'student', self.students, password_hash)
+        counts['users'] += len(student_user_ids)
+        students = []
+        for i, user_id in enumerate(student_user_ids):
+            students.append((self._uuid(), user_id, i % self.grades))
+        counts['students'] = self._insert(Student, ({
+            'id': student_id, 'user_id': user_id, 'student_code': f'EST{i:07d}', 'grade_id': grade_ids[g],
+            'apellido_paterno': f'Paterno{i % 997}', 'apellido_materno': f'Materno{i % 991}',
+            'enrollment_date': self.today, 'status': 'active', 'created_at': self.now
+        } for i, (student_id, user_id, g) in enumerate(students)))
+
+        # (enrollment_id, student_id, teacher_id, subject_id) kept for the
+        # attendance and calificaciones passes
+        enrollments = []
+        for student_id, _, g in students:
+            for s in self.rng.sample(range(self.subjects), self.subjects_per_student):
+                enrollments.append((self._uuid(), student_id, assignments[g, s], subject_ids[s], grade_ids[g]))
+
+        # Semester scores are decided up front so the enrollment columns and
+        # calificaciones rows agree
+        scores = {}
+        remaining = min(self.calificaciones, len(enrollments) * len(SEMESTERS))
+        for semester in SEMESTERS:
+            for enrollment in enrollments:
+                if not remaining:
+                    break
+                scores[enrollment[0], semester] = round(self.rng.uniform(40, 100), 2)
+                remaining -= 1
+
+        counts['enrollments'] = self._insert(Enrollment, (
+            self._enrollment_row(enrollment, [scores.get((enrollment[0], semester)) for semester in SEMESTERS])
+            for enrollment in enrollments))
+
+        counts['calificaciones'] = self._insert(Calificacion, ({
+            'id': self._uuid(), 'enrollment_id': enrollment_id, 'student_id': student_id,
+            'subject_id': subject_id, 'teacher_id': teacher_id, 'semester': semester,
+            'calificacion': scores[enrollment_id, semester], 'fecha_calificacion': self.today,
+            'created_at': self.now
+        } for semester in SEMESTERS
+            for enrollment_id, student_id, teacher_id, subject_id, _ in enrollments
+            if (enrollment_id, semester) in scores))
+
+        counts['attendance'] = self._insert(Attendance, self._attendance_rows(enrollments))
+        rebuild_attendance_rollups()
+        db.session.commit()
+        return counts
+
+    def _enrollment_row(self, enrollment, semester_scores):
+        enrollment_id, student_id, teacher_id, subject_id, grade_id = enrollment
+        row = {
+            'id': enrollment_id, 'student_id': student_id, 'teacher_id': teacher_id,
+            'subject_id': subject_id, 'grade_id': grade_id, 'enrollment_date': self.now,
+            'status': 'enrolled', 'created_at': self.now,
+        }
+        for semester, score in zip(SEMESTERS, semester_scores):
+            row[f'semester_{semester}'] = score
+        row['average'], row['has_grades'] = semester_average(*semester_scores)
+        return row
+
+    def _attendance_rows(self, enrollments):
+        if not enrollments or not self.attendance:
+            return
+        remaining = self.attendance
+        for day in self._school_days(math.ceil(self.attendance / len(enrollments))):
+            for enrollment in enrollments:
+                if not remaining:
+                    return
+                yield {
+                    'id': self._uuid(), 'enrollment_id': enrollment[0], 'attendance_date': day,
+                    'status': self.rng.choices(ATTENDANCE_STATUSES, ATTENDANCE_WEIGHTS)[0],
+                    'notes': None, 'created_at': self.now
+                }
+                remaining -= 1
+
+
+def timetable_problem(grades, subjects=12, lessons=3, periods=8, unavailable=0.1, room_ratio=0.95, seed=1):
+    """TimetableSolver arguments for a synthetic school of the given number of grades.
+
+    Every grade takes lessons periods a week of each subject. There are
+    about 2.5 teachers per grade, each qualified for two subjects and
+    given the least loaded (grade, subject) pairs they can teach, and each
+    teacher is unavailable for a random unavailable fraction of the week.
+    Classes share a pool of room_ratio * grades classrooms.
+    """
+    rng = random.Random(seed)
+    day_periods = school_periods(periods=periods)
+    teachers = max(math.ceil(grades * 2.5), subjects)
+    qualified = defaultdict(list)
+    for t in range(teachers):
+        for s in (t % subjects, (t + 1 + t // subjects) % subjects):
+            if t not in qualified[s]:
+                qualified[s].append(t)
+    load = [0] * teachers
+    courses = []
+    for g in range(grades):
+        for s in range(subjects):
+            teacher = min(qualified[s], key=lambda t: (load[t], rng.random()))
+            load[teacher] += lessons
+            courses.append(Course(f'G{g}', f'S{s}', f'T{teacher}', lessons))
+    slots = [(day, start, end) for day in SCHOOL_DAYS for start, end in day_periods]
+    blocked = {f'T{t}': rng.sample(slots, round(len(slots) * unavailable)) for t in range(teachers)}
+    rooms = [f'Aula {r + 1}' for r in range(max(1, math.ceil(grades * room_ratio)))]
+    return {'courses': courses, 'periods': day_periods, 'unavailable': blocked, 'rooms': rooms, 'seed': seed}
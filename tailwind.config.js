@@ -0,0 +1,8 @@
+/** Tailwind build for flask build-assets: only classes used in the templates are emitted. */
+module.exports = {
+  content: ['./templates/**/*.html'],
+  theme: {
+    extend: {},
+  },
+  plugins: [],
+};
@@ -0,0 +1,478 @@
+"""
+Timetable - Schedule conflict detection and weekly timetable generation
+"""
+
+import functools
+import operator
+import random
+import time
+from collections import defaultdict, deque, namedtuple
+from datetime import date, datetime
+from sqlalchemy import func, or_
+from cache import rows_written
+from models import (db, Grade, Subject, Teacher, TeacherSubject, Enrollment, Schedule, SCHOOL_DAYS, format_minutes,
+                    new_id)
+
+# (column, label, message) for each resource that cannot be in two classes at once
+CONFLICT_RESOURCES = (
+    ('teacher_id', 'Profesor', 'el profesor ya tiene clase'),
+    ('grade_id', 'Grado', 'el grado ya tiene clase'),
+    ('classroom', 'Aula', 'el aula ya está ocupada'),
+)
+
+
+def find_conflict(schedule):
+    """Return (column, message, other schedule) for the first booking schedule overlaps, or None.
+
+    schedule is refreshed first, so invalid times raise ValueError. The
+    schedules already stored for one resource and day do not overlap each
+    other (this check keeps it so), which makes the one with the latest
+    start before schedule ends the only possible overlap: a single seek on
+    the resource's (column, day, start) index. Overlaps that predate the
+    check are reported by find_all_conflicts().
+    """
+    schedule.refresh_minutes()
+    with db.session.no_autoflush:
+        for column, _, message in CONFLICT_RESOURCES:
+            value = getattr(schedule, column)
+            if value in (None, ''):
+                continue
+            query = Schedule.query.filter(
+                getattr(Schedule, column) == value,
+                Schedule.day_of_week == schedule.day_of_week,
+                Schedule.start_minute < schedule.end_minute
+            )
+            if schedule.id is not None:
+                query = query.filter(Schedule.id != schedule.id)
+            previous = query.order_by(Schedule.start_minute.desc()).first()
+            if previous is not None and previous.end_minute > schedule.start_minute:
+                return column, message, previous
+    return None
+
+
+def resource_name(column, schedule):
+    """Display name of the teacher, grade or classroom a schedule books under column."""
+    if column == 'teacher_id':
+        return schedule.teacher.user.name
+    if column == 'grade_id':
+        return schedule.grade_rel.name
+    return schedule.classroom
+
+
+def conflict_message(conflict):
+    _, message, other = conflict
+    return f'Conflicto de horario: {message} el {other.day_of_week} de {other.start_time} a {other.end_time}'
+
+
+def find_all_conflicts(schedules=None):
+    """Every overlapping pair of schedules, as [(column, label, earlier, later)].
+
+    schedules defaults to the whole table, read with one query. Each
+    resource's classes for a day are swept in start order, keeping only
+    the ones still running, so the cost is the sort plus the pairs found.
+    Schedules whose times were never normalized are skipped.
+    """
+    if schedules is None:
+        schedules = Schedule.query.all()
+    conflicts = []
+    for column, label, _ in CONFLICT_RESOURCES:
+        bookings = defaultdict(list)
+        for schedule in schedules:
+            value = getattr(schedule, column)
+            if value not in (None, '') and schedule.start_minute is not None:
+                bookings[value, schedule.day_of_week].append(schedule)
+        for day_bookings in bookings.values():
+            day_bookings.sort(key=lambda s: (s.start_minute, s.end_minute))
+            running = []
+            for schedule in day_bookings:
+                running = [other for other in running if other.end_minute > schedule.start_minute]
+                conflicts.extend((column, label, other, schedule) for other in running)
+                running.append(schedule)
+    return conflicts
+
+
+# One class period of a course, or a booking the generator must work around
+Lesson = namedtuple('Lesson', ['teacher_id', 'grade_id', 'subject_id', 'day_of_week', 'start_minute', 'end_minute',
+                               'classroom'])
+# A teacher teaching a subject to a grade for lessons periods a week
+Course = namedtuple('Course', ['grade_id', 'subject_id', 'teacher_id', 'lessons'])
+Timetable = namedtuple('Timetable', ['lessons', 'unplaced', 'moves', 'seconds'])
+
+
+def school_periods(day_start=8 * 60, period_minutes=60, periods=8, break_after=0, break_minutes=0):
+    """[(start_minute, end_minute)] for one school day, with an optional break after break_after periods."""
+    result = []
+    start = day_start
+    for period in range(periods):
+        result.append((start, start + period_minutes))
+        start += period_minutes
+        if break_after and period + 1 == break_after:
+            start += break_minutes
+    if result and result[-1][1] > 24 * 60:
+        raise ValueError('La jornada termina después de medianoche')
+    return result
+
+
+def _bits(mask):
+    """Slot numbers set in mask, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+class TimetableSolver:
+    """Weekly timetable for a set of courses, with no teacher, grade or classroom booked twice.
+
+    Slots are the (day, period) pairs numbered day * periods + period, and
+    the bookings of every teacher, grade and home room are an int bitmask
+    over them, so the free slots for a lesson are a few ORs away. Lessons
+    are placed greedily, most constrained course first (least spare
+    teacher time, then least spare grade time), in the free slot that best
+    spreads a course over the week and a teacher over their days. A
+    lesson left without a free slot is placed by moving the lessons in its
+    way to free slots of their own, and failing that by ejecting them and
+    queueing them again, with recently placed lessons protected from
+    ejection so the search does not cycle. The search stops when every
+    lesson is placed or after time_limit seconds, keeping the state with
+    the fewest lessons unplaced.
+
+    unavailable maps teacher ids to (day_of_week, start_minute,
+    end_minute) blocks; fixed is a list of Lesson bookings kept as they
+    are. rooms is a classroom pool (at most len(rooms) classes per slot,
+    each grade kept in the same room where possible); without it every
+    grade has class in home_rooms[grade_id].
+    """
+
+    def __init__(self, courses, days=SCHOOL_DAYS, periods=None, unavailable=None, fixed=(), rooms=None,
+                 home_rooms=None, seed=1, time_limit=10.0):
+        self.courses = [course for course in courses if course.lessons > 0]
+        self.days = list(days)
+        self.periods = list(periods or school_periods())
+        self.slot_count = len(self.days) * len(self.periods)
+        self.all_slots = (1 << self.slot_count) - 1
+        self.rooms = list(rooms) if rooms else None
+        self.home_rooms = home_rooms or {}
+        self.seed = seed
+        self.time_limit = time_limit
+
+        # Resources are ('teacher', id), ('grade', id) and, without a pool, ('room', name)
+        self.blocked = defaultdict(int)
+        self.fixed_rooms = defaultdict(set)
+        for teacher_id, blocks in (unavailable or {}).items():
+            for day, start, end in blocks:
+                self.blocked['teacher', teacher_id] |= self._mask(day, start, end)
+        for booking in fixed:
+            mask = self._mask(booking.day_of_week, booking.start_minute, booking.end_minute)
+            self.blocked['teacher', booking.teacher_id] |= mask
+            self.blocked['grade', booking.grade_id] |= mask
+            if booking.classroom:
+                self.blocked['room', booking.classroom] |= mask
+                if self.rooms and booking.classroom in self.rooms:
+                    for slot in _bits(mask):
+                        self.fixed_rooms[slot].add(booking.classroom)
+
+    def _mask(self, day, start, end):
+        """Bitmask of the slots on day that overlap [start, end)."""
+        if day not in self.days:
+            return 0
+        base = self.days.index(day) * len(self.periods)
+        mask = 0
+        for period, (period_start, period_end) in enumerate(self.periods):
+            if period_start < end and start < period_end:
+                mask |= 1 << (base + period)
+        return mask
+
+    def _resources(self, course):
+        resources = [('teacher', course.teacher_id), ('grade', course.grade_id)]
+        room = self.home_rooms.get(course.grade_id)
+        if not self.rooms and room:
+            resources.append(('room', room))
+        return resources
+
+    def solve(self):
+        start = time.perf_counter()
+        placement, unplaced, moves = self._search(random.Random(self.seed), start + self.time_limit)
+        return Timetable(self._lessons(placement), [self.courses[c] for c in unplaced], moves,
+                         time.perf_counter() - start)
+
+    def _search(self, rng, deadline):
+        periods = len(self.periods)
+        capacity = len(self.rooms) if self.rooms else None
+        resources = [self._resources(course) for course in self.courses]
+        allowed = [self.all_slots & ~functools.reduce(operator.or_, (self.blocked[r] for r in course_resources))
+                   for course_resources in resources]
+        busy = defaultdict(int)
+        # (resource, slot) -> unit booked there
+        booked = {}
+        slot_units = [set() for _ in range(self.slot_count)]
+        slot_load = [len(self.fixed_rooms.get(slot, ())) for slot in range(self.slot_count)]
+        # Slots where every pool room is taken
+        full = sum(1 << slot for slot, count in enumerate(slot_load) if capacity is not None and count >= capacity)
+        course_day = defaultdict(int)
+        teacher_day = defaultdict(int)
+        # One unit per lesson; placement[unit] is its slot, or None
+        units = [c for c, course in enumerate(self.courses) for _ in range(course.lessons)]
+        placement = [None] * len(units)
+        # Step until which a unit just placed by an ejection may not be ejected again
+        tabu = [0] * len(units)
+
+        load = defaultdict(int)
+        for course in self.courses:
+            load['teacher', course.teacher_id] += course.lessons
+            load['grade', course.grade_id] += course.lessons
+
+        def slack(course):
+            return tuple(self.slot_count - bin(self.blocked[resource]).count('1') - load[resource]
+                         for resource in (('teacher', course.teacher_id), ('grade', course.grade_id)))
+
+        slacks = [slack(course) for course in self.courses]
+
+        def free_slots(c):
+            taken = full
+            for resource in resources[c]:
+                taken |= busy[resource]
+            return allowed[c] & ~taken
+
+        def best_slot(c, mask):
+            teacher_id = self.courses[c].teacher_id
+            best, best_score = None, None
+            for slot in _bits(mask):
+                day, period = divmod(slot, periods)
+                score = 100 * course_day[c, day] + 3 * teacher_day[teacher_id, day] + period + rng.random()
+                if best_score is None or score < best_score:
+                    best, best_score = slot, score
+            return best
+
+        def place(u, slot):
+            nonlocal full
+            c = units[u]
+            bit = 1 << slot
+            day = slot // periods
+            placement[u] = slot
+            for resource in resources[c]:
+                busy[resource] |= bit
+                booked[resource, slot] = u
+            slot_units[slot].add(u)
+            course_day[c, day] += 1
+            teacher_day[self.courses[c].teacher_id, day] += 1
+            slot_load[slot] += 1
+            if capacity is not None and slot_load[slot] >= capacity:
+                full |= bit
+
+        def unplace(u):
+            nonlocal full
+            c = units[u]
+            slot = placement[u]
+            bit = 1 << slot
+            day = slot // periods
+            placement[u] = None
+            for resource in resources[c]:
+                busy[resource] &= ~bit
+                del booked[resource, slot]
+            slot_units[slot].discard(u)
+            course_day[c, day] -= 1
+            teacher_day[self.courses[c].teacher_id, day] -= 1
+            slot_load[slot] -= 1
+            full &= ~bit
+
+        def blockers(c, slot):
+            """Placed units that keep course c out of slot; the room pool counts as one."""
+            found = {booked.get((resource, slot)) for resource in resources[c]}
+            found.discard(None)
+            if not found and full >> slot & 1:
+                # None when only fixed bookings fill the rooms
+                found.add(rng.choice(sorted(slot_units[slot])) if slot_units[slot] else None)
+            return found
+
+        def repair(u):
+            """Place u where every blocker can move to a free slot of its own."""
+            c = units[u]
+            candidates = list(_bits(allowed[c]))
+            rng.shuffle(candidates)
+            for slot in candidates:
+                found = blockers(c, slot)
+                if None in found:
+                    continue
+                moved = []
+                for blocker in found:
+                    target = best_slot(units[blocker], free_slots(units[blocker]) & ~(1 << slot))
+                    if target is None:
+                        break
+                    moved.append((blocker, placement[blocker]))
+                    unplace(blocker)
+                    place(blocker, target)
+                else:
+                    place(u, slot)
+                    return True
+                for blocker, previous in reversed(moved):
+                    unplace(blocker)
+                    place(blocker, previous)
+            return False
+
+        def eject(u, step):
+            """Place u in the slot with the fewest blockers not placed recently; returns the ejected units."""
+            c = units[u]
+            best, best_cost = None, None
+            for slot in _bits(allowed[c]):
+                found = blockers(c, slot)
+                if None in found:
+                    continue
+                cost = len(found) + rng.random() + (10 if any(tabu[b] > step for b in found) else 0)
+                if best_cost is None or cost < best_cost:
+                    best, best_cost = (slot, found), cost
+            if best is None:
+                return None
+            slot, found = best
+            for blocker in found:
+                unplace(blocker)
+            place(u, slot)
+            tabu[u] = step + 5 + rng.randrange(10)
+            return found
+
+        for u in sorted(range(len(units)), key=lambda u: (slacks[units[u]], units[u])):
+            slot = best_slot(units[u], free_slots(units[u]))
+            if slot is not None:
+                place(u, slot)
+
+        queue = deque(u for u in range(len(units)) if placement[u] is None)
+        best = len(queue), list(placement)
+        step = 0
+        while queue and (step % 64 or time.perf_counter() < deadline):
+            step += 1
+            u = queue.popleft()
+            slot = best_slot(units[u], free_slots(units[u]))
+            if slot is not None:
+                place(u, slot)
+            elif not repair(u):
+                ejected = eject(u, step)
+                if ejected is None:
+                    # Every slot the course could use is blocked for its teacher, grade or room
+                    continue
+                queue.extend(ejected)
+            if len(queue) < best[0]:
+                best = len(queue), list(placement)
+        placement = best[1]
+        return ([(units[u], slot) for u, slot in enumerate(placement) if slot is not None],
+                [units[u] for u, slot in enumerate(placement) if slot is None], step)
+
+    def _lessons(self, placement):
+        periods = len(self.periods)
+        by_slot = defaultdict(list)
+        for c, slot in placement:
+            by_slot[slot].append(self.courses[c])
+        lessons = []
+        # Keep a grade in the same pool room whenever that room is free
+        preferred = {}
+        for slot in sorted(by_slot):
+            day, period = divmod(slot, periods)
+            start, end = self.periods[period]
+            taken = set(self.fixed_rooms.get(slot, ()))
+            for course in sorted(by_slot[slot], key=lambda course: str(course.grade_id)):
+                if self.rooms:
+                    room = preferred.get(course.grade_id)
+                    if room is None or room in taken:
+                        room = next(room for room in self.rooms if room not in taken)
+                        preferred.setdefault(course.grade_id, room)
+                    taken.add(room)
+                else:
+                    room = self.home_rooms.get(course.grade_id)
+                lessons.append(Lesson(course.teacher_id, course.grade_id, course.subject_id, self.days[day],
+                                      start, end, room))
+        return lessons
+
+
+def _active_teachers(today):
+    rows = db.session.query(Teacher.id).filter(
+        Teacher.status == 'active',
+        or_(Teacher.end_contract_date.is_(None), Teacher.end_contract_date >= today)
+    )
+    return {teacher_id for teacher_id, in rows}
+
+
+def load_problem(grade_ids=None, lessons=None, today=None):
+    """TimetableSolver arguments for the grades in grade_ids (default: every grade) from the database.
+
+    A grade needs every subject its students are enrolled in, taught by
+    the enrollments' teacher, for Subject.credits periods a week (or
+    lessons, when given). A teacher who is no longer active is replaced
+    by the least loaded active teacher qualified for the subject in
+    TeacherSubject. Schedules of the other grades are kept as fixed
+    bookings, and each grade keeps the classroom it uses most today
+    unless a busier grade already claimed it. Returns (solver kwargs, [(grade name, subject name)] left without a
+    teacher).
+    """
+    today = today or date.today()
+    query = db.session.query(Enrollment.grade_id, Enrollment.subject_id, Enrollment.teacher_id,
+                             func.count()).group_by(Enrollment.grade_id, Enrollment.subject_id, Enrollment.teacher_id)
+    if grade_ids is not None:
+        query = query.filter(Enrollment.grade_id.in_(grade_ids))
+    # The teacher with the most enrollments teaches the grade the subject
+    teaching = {}
+    for grade_id, subject_id, teacher_id, count in query.order_by(func.count().desc(), Enrollment.teacher_id):
+        teaching.setdefault((grade_id, subject_id), teacher_id)
+
+    active = _active_teachers(today)
+    qualified = defaultdict(list)
+    for teacher_id, subject_id in db.session.query(TeacherSubject.teacher_id, TeacherSubject.subject_id):
+        if teacher_id in active:
+            qualified[subject_id].append(teacher_id)
+    credits = dict(db.session.query(Subject.id, Subject.credits))
+
+    load = defaultdict(int)
+    for (_, subject_id), teacher_id in teaching.items():
+        if teacher_id in active:
+            load[teacher_id] += lessons or credits.get(subject_id) or 0
+    courses, missing = [], []
+    for (grade_id, subject_id), teacher_id in sorted(teaching.items()):
+        count = lessons or credits.get(subject_id) or 0
+        if teacher_id not in active:
+            if not qualified[subject_id]:
+                missing.append((grade_id, subject_id))
+                continue
+            teacher_id = min(qualified[subject_id], key=lambda candidate: (load[candidate], candidate))
+            load[teacher_id] += count
+        courses.append(Course(grade_id, subject_id, teacher_id, count))
+
+    regenerated = {grade_id for grade_id, _ in teaching} | set(grade_ids or ())
+    fixed, rooms = [], defaultdict(lambda: defaultdict(int))
+    for schedule in Schedule.query.filter(Schedule.start_minute.isnot(None)):
+        if schedule.grade_id in regenerated:
+            if schedule.classroom:
+                rooms[schedule.grade_id][schedule.classroom] += 1
+        else:
+            fixed.append(Lesson(schedule.teacher_id, schedule.grade_id, schedule.subject_id, schedule.day_of_week,
+                                schedule.start_minute, schedule.end_minute, schedule.classroom))
+    names = dict(db.session.query(Grade.id, Grade.name))
+    # Each grade gets the classroom it uses most that no other grade has claimed yet
+    home_rooms, claimed = {}, set()
+    usage = sorted(((count, room, grade_id) for grade_id in regenerated for room, count in rooms[grade_id].items()),
+                   key=lambda item: (-item[0], item[1]))
+    for _, room, grade_id in usage:
+        if grade_id not in home_rooms and room not in claimed:
+            home_rooms[grade_id] = room
+            claimed.add(room)
+    for grade_id in regenerated:
+        home_rooms.setdefault(grade_id, names.get(grade_id))
+    subjects = dict(db.session.query(Subject.id, Subject.name))
+    missing = [(names.get(grade_id), subjects.get(subject_id)) for grade_id, subject_id in missing]
+    return {'courses': courses, 'fixed': fixed, 'home_rooms': home_rooms}, missing
+
+
+def save_timetable(grade_ids, lessons):
+    """Replace the schedules of grade_ids with lessons, in one transaction; returns the rows inserted."""
+    table = Schedule.__table__
+    now = datetime.utcnow()
+    db.session.execute(table.delete().where(table.c.grade_id.in_(list(grade_ids))))
+    rows = [{
+        'id': new_id(), 'teacher_id': lesson.teacher_id, 'grade_id': lesson.grade_id, 'subject_id': lesson.subject_id,
+        'day_of_week': lesson.day_of_week, 'start_time': format_minutes(lesson.start_minute),
+        'end_time': format_minutes(lesson.end_minute), 'start_minute': lesson.start_minute,
+        'end_minute': lesson.end_minute, 'classroom': lesson.classroom, 'created_at': now
+    } for lesson in lessons]
+    if rows:
+        db.session.execute(table.insert(), rows)
+    # Both the grades emptied and the ones filled show different schedules now
+    rows_written(db.session, table.name, [{'grade_id': grade_id} for grade_id in grade_ids] + rows)
+    db.session.commit()
+    return len(rows)
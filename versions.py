@@ -0,0 +1,205 @@
+"""
+Versions - Data versions behind conditional GETs and cached page fragments
+"""
+
+import hashlib
+import os
+from datetime import datetime
+from flask import Response, make_response, render_template, request, session
+from flask_login import current_user
+from markupsafe import Markup
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+from werkzeug.http import is_resource_modified
+from bulk import increment
+from cache import invalidate_rows_on, page_fragments
+from models import db, User, Student, Enrollment, DataVersion
+
+# Teacher, subject, grade and user names appear on every page
+CATALOG_SCOPE = 'catalog'
+
+
+def student_scope(student_id):
+    return f'student:{student_id}'
+
+
+def grade_scope(grade_id):
+    return f'grade:{grade_id}'
+
+
+class VersionedRows:
+    """Row-keyed dependent (see cache.invalidate_rows_on) whose keys become data version bumps.
+
+    to_scopes(keys) maps the keys of the rows written in a transaction to
+    the scopes to bump. _bump_versions() claims the keys before the
+    commit, so the bumps commit or roll back with the writes themselves.
+    """
+
+    def __init__(self, to_scopes):
+        self.to_scopes = to_scopes
+
+
+def _grades_and_students(grade_ids):
+    rows = db.session.query(Student.id).filter(Student.grade_id.in_(list(grade_ids)))
+    return [grade_scope(grade_id) for grade_id in grade_ids] + [student_scope(student_id) for student_id, in rows]
+
+
+def _students_and_their_grades(student_ids):
+    # Teacher rosters list a student's enrollments under the student's own grade
+    rows = db.session.query(Student.grade_id).filter(Student.id.in_(list(student_ids))).distinct()
+    return [student_scope(student_id) for student_id in student_ids] + [grade_scope(grade_id) for grade_id, in rows]
+
+
+def _grades_of_enrollments(enrollment_ids):
+    rows = db.session.query(Enrollment.grade_id).filter(Enrollment.id.in_(list(enrollment_ids))).distinct()
+    return [grade_scope(grade_id) for grade_id, in rows]
+
+
+student_rows = VersionedRows(lambda student_ids: [student_scope(student_id) for student_id in student_ids])
+enrollment_rows = VersionedRows(_students_and_their_grades)
+grade_rows = VersionedRows(lambda grade_ids: [grade_scope(grade_id) for grade_id in grade_ids])
+# A schedule also shows up on the courses page of every student in its grade
+schedule_rows = VersionedRows(_grades_and_students)
+attendance_rows = VersionedRows(_grades_of_enrollments)
+catalog_rows = VersionedRows(lambda keys: [CATALOG_SCOPE])
+
+invalidate_rows_on(student_rows, 'students', 'id')
+invalidate_rows_on(grade_rows, 'students', 'grade_id')
+invalidate_rows_on(enrollment_rows, 'enrollments', 'student_id')
+invalidate_rows_on(grade_rows, 'enrollments', 'grade_id')
+invalidate_rows_on(student_rows, 'calificaciones', 'student_id')
+invalidate_rows_on(schedule_rows, 'schedules', 'grade_id')
+invalidate_rows_on(attendance_rows, 'attendance', 'enrollment_id')
+for _table in ('grades', 'subjects', 'teachers'):
+    invalidate_rows_on(catalog_rows, _table, 'id')
+
+
+def version_stamps(scopes):
+    """{scope: version} for scopes, from one primary key lookup; scopes never bumped are at 0."""
+    rows = db.session.query(DataVersion.scope, DataVersion.version).filter(DataVersion.scope.in_(list(scopes)))
+    stamps = dict.fromkeys(scopes, 0)
+    stamps.update(rows)
+    return stamps
+
+
+def student_versions(student_id):
+    """(student version, catalog version): everything a student's own pages show, as one cache key part."""
+    stamps = version_stamps([student_scope(student_id), CATALOG_SCOPE])
+    return stamps[student_scope(student_id)], stamps[CATALOG_SCOPE]
+
+
+def bump_versions(scopes):
+    """Add one to the version of each scope, in the current transaction."""
+    now = datetime.utcnow()
+    increment(DataVersion, [{'scope': scope, 'version': 1, 'updated_at': now} for scope in sorted(set(scopes))],
+              ['scope'], ['version'], replace_columns=['updated_at'])
+
+
+@event.listens_for(Session, 'before_flush')
+def _record_renamed_users(session, flush_context, instances):
+    # Only a name change matters to other users' pages; logins rewrite password hashes
+    for obj in session.dirty:
+        if isinstance(obj, User) and inspect(obj).attrs.name.history.has_changes():
+            session.info['catalog_changed'] = True
+
+
+@event.listens_for(Session, 'before_commit')
+def _bump_versions(session):
+    session.flush()
+    pending = session.info.get('pending_invalidations')
+    claimed = {(target, key) for target, key in pending or () if isinstance(target, VersionedRows)}
+    keys = {}
+    for target, key in claimed:
+        keys.setdefault(target, set()).add(key)
+    scopes = set()
+    for target, target_keys in keys.items():
+        scopes.update(target.to_scopes(target_keys))
+    if session.info.pop('catalog_changed', False):
+        scopes.add(CATALOG_SCOPE)
+    if pending:
+        pending -= claimed
+    if scopes:
+        bump_versions(scopes)
+
+
+def _fingerprint(root):
+    """Digest of the templates' and top-level modules' modification times, so a deploy changes every ETag.
+
+    Only templates/ is walked; node_modules, static and the rest of the
+    tree never change a rendered page.
+    """
+    paths = [os.path.join(root, name) for name in os.listdir(root) if name.endswith('.py')]
+    for directory, _, files in os.walk(os.path.join(root, 'templates')):
+        paths.extend(os.path.join(directory, name) for name in files if name.endswith('.html'))
+    stamps = sorted(f'{os.path.relpath(path, root)}:{os.stat(path).st_mtime_ns}' for path in paths)
+    return hashlib.sha1('\n'.join(stamps).encode('utf-8')).hexdigest()[:16]
+
+
+_code_fingerprint = None
+
+
+def page_validators(page, student_id):
+    """(ETag, Last-Modified) for page as the current user sees it, from one primary key lookup."""
+    global _code_fingerprint
+    if _code_fingerprint is None:
+        _code_fingerprint = _fingerprint(os.path.dirname(os.path.abspath(__file__)))
+    rows = (
+        db.session.query(DataVersion.scope, DataVersion.version, DataVersion.updated_at)
+        .filter(DataVersion.scope.in_([student_scope(student_id), CATALOG_SCOPE]))
+        .all()
+    )
+    versions = sorted((scope, version) for scope, version, _ in rows)
+    raw = '\0'.join(str(value) for value in (page, student_id, current_user.stamp, _code_fingerprint, versions))
+    etag = hashlib.sha1(raw.encode('utf-8')).hexdigest()[:20]
+    last_modified = max((updated_at for _, _, updated_at in rows), default=None)
+    return etag, last_modified
+
+
+def conditional_student_page(page, render):
+    """Answer 304 when the browser's copy of page is current; otherwise return render() with validators.
+
+    The current user must be a student. A page carrying flashed messages
+    is rendered without validators, so the message is never replayed
+    from the browser's cache.
+    """
+    if '_flashes' in session:
+        return render()
+    etag, last_modified = page_validators(page, current_user.profile_id)
+    if is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        response = make_response(render())
+    else:
+        response = Response(status=304)
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    # Per-user pages: browsers may keep them but must revalidate every time
+    response.headers['Cache-Control'] = 'private, no-cache'
+    response.vary.add('Cookie')
+    return response
+
+
+def grade_sections(template, key, grades, load, load_context=None, **context):
+    """The per-grade sections of a page as Markup, in the order of grades.
+
+    Each section is template rendered with grade_id, data and context, and
+    is cached in cache.page_fragments under key + (grade id, grade version,
+    catalog version). Only the sections missing from the cache are loaded,
+    with load(grade_ids) -> {grade_id: data}, and rendered; load_context()
+    returns context that is only worth querying for when something renders
+    (catalog lists, which the catalog version already covers). The versions
+    are read before the data, so a section can be newer than its key but
+    never older.
+    """
+    scopes = {grade.id: grade_scope(grade.id) for grade in grades}
+    stamps = version_stamps(list(scopes.values()) + [CATALOG_SCOPE])
+    keys = {grade_id: key + (grade_id, stamps[scope], stamps[CATALOG_SCOPE]) for grade_id, scope in scopes.items()}
+    sections = {grade_id: page_fragments.get(fragment_key) for grade_id, fragment_key in keys.items()}
+    stale = [grade_id for grade_id, html in sections.items() if html is None]
+    if stale:
+        data = load(stale)
+        if load_context is not None:
+            context.update(load_context())
+        for grade_id in stale:
+            sections[grade_id] = render_template(template, grade_id=grade_id, data=data[grade_id], **context)
+            page_fragments.set(keys[grade_id], sections[grade_id])
+    return [Markup(sections[grade.id]) for grade in grades]